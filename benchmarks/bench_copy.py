@@ -0,0 +1,15 @@
+"""
+Benchmarks for copying a tree to another folder on the same backend.
+"""
+
+
+def bench_copy_to(backend, path, tree, context):
+    backend.file(path).copy_to(backend.file(context["target"]))
+    return tree.files
+
+
+def _setup(backend, path, context):
+    context["target"] = context["cleanup"] = path + "-copy"
+
+
+bench_copy_to.setup = _setup
@@ -0,0 +1,8 @@
+"""
+Benchmarks for deleting a whole tree.
+"""
+
+
+def bench_delete(backend, path, tree, context):
+    backend.file(path).delete()
+    return tree.files
@@ -0,0 +1,18 @@
+"""
+Benchmarks for hashing every file in a tree. Operations are counted in
+bytes hashed rather than files, so the rate is the hashing throughput.
+"""
+
+
+def bench_hash(backend, path, tree, context):
+    for f in context["files"]:
+        f.hash()
+    return tree.size
+
+
+def _setup(backend, path, context):
+    context["files"] = [f for f in backend.file(path).recurse()
+                        if f.is_file]
+
+
+bench_hash.setup = _setup
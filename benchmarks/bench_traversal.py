@@ -0,0 +1,33 @@
+"""
+Benchmarks for walking trees: recurse, and child_names on every folder.
+"""
+
+
+def bench_recurse(backend, path, tree, context):
+    count = 0
+    for f in backend.file(path).recurse():
+        count += 1
+    return count
+
+
+def bench_recurse_is_folder(backend, path, tree, context):
+    # What most callers of recurse go on to do with each file, and the case
+    # that listing-backed stat caches are meant to speed up
+    count = 0
+    for f in backend.file(path).recurse():
+        f.is_folder
+        count += 1
+    return count
+
+
+def bench_child_names(backend, path, tree, context):
+    count = 0
+    pending = [backend.file(path)]
+    while pending:
+        folder = pending.pop()
+        for name in folder.child_names:
+            count += 1
+            child = folder.child(name)
+            if child.is_folder:
+                pending.append(child)
+    return count
@@ -0,0 +1,240 @@
+"""
+The machinery shared by the benchmarks: synthetic trees, the backends they're
+run against, and the timing and reporting of individual benchmarks.
+"""
+
+from fileutils.metrics import Metrics
+import fileutils
+import posixpath
+import tempfile
+import random
+import shutil
+import time
+import os
+
+
+class Tree(object):
+    """
+    A recipe for a synthetic tree of files. Trees are generated from a fixed
+    random seed, so the same recipe always produces the same tree (names,
+    shape, sizes and contents alike).
+    """
+    def __init__(self, name, folders, files_per_folder, file_size, depth=1,
+                 scales="folders", seed=0):
+        self.name = name
+        self.folders = folders
+        self.files_per_folder = files_per_folder
+        self.file_size = file_size
+        self.depth = depth
+        # Which of folders, files, size and depth scaled() scales
+        self.scales = scales
+        self.seed = seed
+
+    @property
+    def files(self):
+        return self.folders * self.files_per_folder
+
+    @property
+    def size(self):
+        return self.files * self.file_size
+
+    def build(self, path):
+        """
+        Create the tree in the (not yet existing) local folder at path.
+        """
+        generator = random.Random(self.seed)
+        # One block of random data, sliced up for the files' contents; it's
+        # the layout that matters here, not the entropy
+        block = bytearray(generator.getrandbits(8)
+                          for _ in range(min(self.file_size, 2**16) + 256))
+        block = bytes(block)
+        os.mkdir(path)
+        for folder in range(self.folders):
+            # Each folder is nested depth levels down from the root
+            names = ["d{0}-{1}".format(folder, level)
+                     for level in range(self.depth)]
+            folder_path = os.path.join(path, *names)
+            if not os.path.isdir(folder_path):
+                os.makedirs(folder_path)
+            for number in range(self.files_per_folder):
+                offset = generator.randrange(256)
+                with open(os.path.join(folder_path, "f{0}".format(number)),
+                          "wb") as f:
+                    remaining = self.file_size
+                    while remaining > 0:
+                        piece = block[offset:offset + remaining]
+                        f.write(piece)
+                        remaining -= len(piece)
+
+    def scaled(self, scale):
+        """
+        Return a copy of this recipe scaled up or down by the specified
+        factor, in whichever dimension it's meant to exercise: the number of
+        folders, the number of files per folder, the size of each file, or
+        the depth to which folders are nested.
+        """
+        sizes = {"folders": self.folders, "files": self.files_per_folder,
+                 "size": self.file_size, "depth": self.depth}
+        sizes[self.scales] = max(1, int(sizes[self.scales] * scale))
+        return Tree(self.name, sizes["folders"], sizes["files"],
+                    sizes["size"], sizes["depth"], self.scales, self.seed)
+
+    def __repr__(self):
+        return "<Tree {0}: {1} files of {2} bytes>".format(
+            self.name, self.files, self.file_size)
+
+
+# Many small files spread over a handful of folders, a few huge files, a
+# deeply nested chain of folders, and one very wide folder
+TREES = [
+    Tree("small", folders=20, files_per_folder=100, file_size=1024),
+    Tree("huge", folders=1, files_per_folder=3, file_size=32 * 2**20,
+         scales="size"),
+    Tree("deep", folders=1, files_per_folder=2, file_size=512, depth=200,
+         scales="depth"),
+    Tree("wide", folders=1, files_per_folder=5000, file_size=64,
+         scales="files"),
+]
+
+
+class Backend(object):
+    """
+    A backend to run benchmarks against. Every backend serves the same local
+    scratch folder, so trees are built with plain os calls and then handed to
+    benchmarks as the backend's own file objects.
+    """
+    name = None
+
+    def __init__(self, scratch):
+        self.scratch = scratch
+        self.metrics = Metrics()
+
+    def file(self, path):
+        """
+        Return this backend's file object for the local path specified.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class LocalBackend(Backend):
+    name = "local"
+
+    def __init__(self, scratch):
+        Backend.__init__(self, scratch)
+        fileutils.LocalFileSystem().metrics = self.metrics
+
+    def file(self, path):
+        return fileutils.File(path)
+
+    def close(self):
+        fileutils.LocalFileSystem().metrics = None
+
+
+class SFTPBackend(Backend):
+    name = "sftp"
+
+    def __init__(self, scratch):
+        from benchmarks.servers import serve_sftp
+        Backend.__init__(self, scratch)
+        self.filesystem = fileutils.SSHFileSystem(serve_sftp(),
+                                                  client_name="benchmark")
+        self.filesystem.metrics = self.metrics
+
+    def file(self, path):
+        return self.filesystem.child(path)
+
+    def close(self):
+        self.filesystem.close()
+
+
+class FTPBackend(Backend):
+    name = "ftp"
+
+    def __init__(self, scratch):
+        from benchmarks.servers import serve_ftp
+        from fileutils.ftp import FTPFileSystem
+        Backend.__init__(self, scratch)
+        self.client = serve_ftp(scratch)
+        self.filesystem = FTPFileSystem(self.client)
+        self.filesystem.metrics = self.metrics
+
+    def file(self, path):
+        from fileutils.ftp import FTPFile
+        relative = os.path.relpath(path, self.scratch).replace(os.sep, "/")
+        return FTPFile(self.filesystem, posixpath.join("/", relative))
+
+    def close(self):
+        self.client.close()
+
+
+BACKENDS = [LocalBackend, SFTPBackend, FTPBackend]
+
+
+class Result(object):
+    """
+    The outcome of running one benchmark against one backend and tree.
+    """
+    def __init__(self, benchmark, backend, tree, seconds=None, operations=None,
+                 requests=None, error=None):
+        self.benchmark = benchmark
+        self.backend = backend
+        self.tree = tree
+        self.seconds = seconds
+        self.operations = operations
+        self.requests = requests or {}
+        self.error = error
+
+    @property
+    def rate(self):
+        if not self.seconds:
+            return None
+        return self.operations / self.seconds
+
+    def format(self):
+        prefix = "{0:<24} {1:<6} {2:<6}".format(self.benchmark, self.backend,
+                                                 self.tree)
+        if self.error is not None:
+            return "{0} {1}".format(prefix, self.error)
+        requests = " ".join("{0}={1}".format(name, count) for name, count in
+                            sorted(self.requests.items()))
+        return "{0} {1:9.3f}s {2:>12} {3}".format(
+            prefix, self.seconds, "{0:,.0f}/s".format(self.rate or 0),
+            requests)
+
+
+def run(benchmark, backend, tree, repeat=3):
+    """
+    Run benchmark (one of the bench_* functions from the benchmark modules)
+    against backend on a fresh copy of tree, repeat times, and return a
+    Result for the fastest run. Request counts come from the backend's
+    :obj:`fileutils.metrics.Metrics`, and are the same for every run.
+    """
+    name = benchmark.__name__[len("bench_"):]
+    best = None
+    for _ in range(repeat):
+        path = tempfile.mkdtemp(dir=backend.scratch)
+        os.rmdir(path)
+        tree.build(path)
+        context = {}
+        if hasattr(benchmark, "setup"):
+            benchmark.setup(backend, path, context)
+        backend.metrics.reset()
+        start = time.time()
+        try:
+            operations = benchmark(backend, path, tree, context)
+        except NotImplementedError:
+            return Result(name, backend.name, tree.name,
+                          error="not supported by this backend")
+        finally:
+            seconds = time.time() - start
+            shutil.rmtree(path, ignore_errors=True)
+            shutil.rmtree(context.get("cleanup", path), ignore_errors=True)
+        requests = dict((operation, stats.count) for operation, stats in
+                        backend.metrics.snapshot().items())
+        if best is None or seconds < best.seconds:
+            best = Result(name, backend.name, tree.name, seconds, operations,
+                          requests)
+    return best
@@ -0,0 +1,81 @@
+"""
+Run the benchmarks and print a line per benchmark, backend and tree: the
+time the fastest run took, the rate at which it got through its work (files,
+or bytes for the hash benchmarks), and how many of each kind of request it
+made of the backend. Run it from the top of the source tree::
+
+    python -m benchmarks.run
+    python -m benchmarks.run --backend local --filter recurse --scale 0.1
+
+Every run starts from a freshly generated copy of its tree, so timings are
+comparable across runs and across versions of fileutils; for remote backends
+the request counts are the more telling numbers, as the servers are
+in-process.
+"""
+
+from benchmarks import harness
+import argparse
+import tempfile
+import shutil
+import sys
+import os
+
+MODULES = ["bench_traversal", "bench_copy", "bench_hash", "bench_delete"]
+
+
+def benchmarks():
+    for name in MODULES:
+        module = __import__("benchmarks." + name, fromlist=[name])
+        for attribute in sorted(dir(module)):
+            if attribute.startswith("bench_"):
+                yield getattr(module, attribute)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Run fileutils benchmarks")
+    parser.add_argument("--backend", action="append",
+                        choices=[b.name for b in harness.BACKENDS],
+                        help="Backend to run against; can be given more than "
+                        "once (default: all of them)")
+    parser.add_argument("--tree", action="append",
+                        choices=[t.name for t in harness.TREES],
+                        help="Tree to run on; can be given more than once "
+                        "(default: all of them)")
+    parser.add_argument("--filter", default="",
+                        help="Only run benchmarks whose names contain this")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="Multiply the size of each tree by this")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of times to run each benchmark")
+    options = parser.parse_args(args)
+    scratch = os.path.realpath(tempfile.mkdtemp(prefix="fileutils-bench-"))
+    try:
+        for backend_class in harness.BACKENDS:
+            if options.backend and backend_class.name not in options.backend:
+                continue
+            try:
+                backend = backend_class(scratch)
+            except ImportError as e:
+                sys.stderr.write("Skipping {0}: {1}\n".format(
+                    backend_class.name, e))
+                continue
+            try:
+                for tree in harness.TREES:
+                    if options.tree and tree.name not in options.tree:
+                        continue
+                    tree = tree.scaled(options.scale)
+                    for benchmark in benchmarks():
+                        if options.filter not in benchmark.__name__:
+                            continue
+                        result = harness.run(benchmark, backend, tree,
+                                             options.repeat)
+                        print(result.format())
+                        sys.stdout.flush()
+            finally:
+                backend.close()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
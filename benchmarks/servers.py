@@ -0,0 +1,178 @@
+"""
+In-process stand-ins for the servers SSHFile and FTPFile talk to, so that the
+benchmarks can exercise those backends without any external setup.
+
+The SFTP server is built on paramiko's server-side SFTP support and serves
+the local filesystem as-is, so an SSHFile's path is the same as the
+corresponding local path. The FTP server is pyftpdlib's, serving a single
+folder to an anonymous user with full write access.
+
+Both run on threads of this process and talk to their clients over loopback
+sockets, so round trips are real but cheap; compare request counts rather
+than absolute times when judging how a backend would do over a real network.
+"""
+
+import threading
+import socket
+import os
+
+try:
+    import paramiko
+    from paramiko import SFTPServer, SFTPAttributes
+except ImportError:
+    paramiko = None
+
+
+def serve_sftp():
+    """
+    Start an in-process SFTP server and return a paramiko.Transport that's
+    connected and authenticated to it. The server goes away with the process.
+    """
+    if paramiko is None:
+        raise ImportError("The SFTP benchmarks need paramiko")
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(5)
+    key = paramiko.RSAKey.generate(2048)
+
+    def run():
+        while True:
+            connection, _ = listener.accept()
+            transport = paramiko.Transport(connection)
+            transport.add_server_key(key)
+            transport.set_subsystem_handler("sftp", SFTPServer,
+                                            _SFTPInterface)
+            transport.start_server(server=_SSHInterface())
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    client = paramiko.Transport(listener.getsockname())
+    client.connect(username="benchmark", password="benchmark")
+    return client
+
+
+def serve_ftp(root):
+    """
+    Start an in-process FTP server serving the specified local folder and
+    return an ftplib.FTP that's logged in to it. The server goes away with
+    the process.
+    """
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import ThreadedFTPServer
+    import ftplib
+    import warnings
+    import logging
+    # pyftpdlib logs every command to stderr unless logging's been set up
+    logger = logging.getLogger("pyftpdlib")
+    if not logger.handlers:
+        logger.addHandler(logging.NullHandler())
+    logger.setLevel(logging.WARNING)
+    authorizer = DummyAuthorizer()
+    with warnings.catch_warnings():
+        # pyftpdlib warns about giving anonymous users write access
+        warnings.simplefilter("ignore")
+        authorizer.add_anonymous(root, perm="elradfmwMT")
+
+    class Handler(FTPHandler):
+        pass
+    Handler.authorizer = authorizer
+    server = ThreadedFTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    client = ftplib.FTP()
+    client.connect(*server.address)
+    client.login()
+    return client
+
+
+def _attempt(function, *args):
+    # Call function, translating OSErrors into SFTP status codes the way
+    # paramiko's server expects
+    try:
+        result = function(*args)
+    except OSError as e:
+        return SFTPServer.convert_errno(e.errno)
+    return paramiko.SFTP_OK if result is None else result
+
+
+def _attributes(path, stat=os.lstat, name=None):
+    attributes = SFTPAttributes.from_stat(stat(path))
+    if name is not None:
+        attributes.filename = name
+    return attributes
+
+
+if paramiko is not None:
+    class _SSHInterface(paramiko.ServerInterface):
+        def check_auth_password(self, username, password):
+            return paramiko.AUTH_SUCCESSFUL
+
+        def get_allowed_auths(self, username):
+            return "password"
+
+        def check_channel_request(self, kind, channel_id):
+            return paramiko.OPEN_SUCCEEDED
+
+    class _Handle(paramiko.SFTPHandle):
+        def stat(self):
+            return _attempt(lambda: SFTPAttributes.from_stat(
+                os.fstat(self.readfile.fileno())))
+
+        def chattr(self, attributes):
+            return _attempt(SFTPServer.set_file_attr, self.filename,
+                            attributes)
+
+    class _SFTPInterface(paramiko.SFTPServerInterface):
+        def list_folder(self, path):
+            return _attempt(lambda: [
+                _attributes(os.path.join(path, name), name=name)
+                for name in os.listdir(path)])
+
+        def stat(self, path):
+            return _attempt(_attributes, path, os.stat)
+
+        def lstat(self, path):
+            return _attempt(_attributes, path)
+
+        def open(self, path, flags, attributes):
+            try:
+                fd = os.open(path, flags, 0o666)
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+            if flags & os.O_WRONLY:
+                mode = "ab" if flags & os.O_APPEND else "wb"
+            elif flags & os.O_RDWR:
+                mode = "a+b" if flags & os.O_APPEND else "r+b"
+            else:
+                mode = "rb"
+            handle = _Handle(flags)
+            handle.filename = path
+            handle.readfile = handle.writefile = os.fdopen(fd, mode)
+            return handle
+
+        def remove(self, path):
+            return _attempt(os.remove, path)
+
+        def rename(self, old_path, new_path):
+            return _attempt(os.rename, old_path, new_path)
+
+        def posix_rename(self, old_path, new_path):
+            return _attempt(os.rename, old_path, new_path)
+
+        def mkdir(self, path, attributes):
+            return _attempt(os.mkdir, path)
+
+        def rmdir(self, path):
+            return _attempt(os.rmdir, path)
+
+        def chattr(self, path, attributes):
+            return _attempt(SFTPServer.set_file_attr, path, attributes)
+
+        def symlink(self, target, path):
+            return _attempt(os.symlink, target, path)
+
+        def readlink(self, path):
+            return _attempt(os.readlink, path)
@@ -2,9 +2,61 @@
 from fileutils.constants import *
 from fileutils.interface import *
 from fileutils.mixins import *
-from fileutils.ftp import *
-from fileutils.local import *
-from fileutils.ssh import *
-from fileutils.url import *
+from fileutils.memory import *
+from fileutils.attributes import (ExtendedAttributes, PosixPermissions,
+                                  Timestamps)
+import sys as _sys
+import types as _types
 
+# The backends, and the names each of them exports. These aren't imported
+# until one of their names is first looked up on this module, so that
+# programs that only use local files don't pay for importing paramiko,
+# requests and so on.
+_lazy_modules = {
+    "fileutils.ftp": ["FTPFileSystem", "FTPFile"],
+    "fileutils.local": ["LocalFileSystem", "PosixLocalFileSystem",
+                        "WindowsLocalFileSystem", "LocalMountPoint",
+                        "PosixLocalMountPoint", "WindowsMountPoint",
+                        "PosixLocalExtendedAttributes",
+                        "PosixLocalPermissions", "LocalTimestamps",
+                        "LocalCache", "File", "PosixFile", "WindowsFile",
+                        "LocalFile", "create_temporary_folder"],
+    "fileutils.ssh": ["SSHFileSystem", "Authenticator", "FirstOf",
+                      "Password", "InteractivePassword", "Key", "Agent",
+                      "User", "SSHFile", "SSHPermissions", "SSHTimestamps",
+                      "ssh_connect"],
+    "fileutils.url": ["URLFileSystem", "URL", "sane_urlparse",
+                      "register_scheme"],
+}
+_lazy_names = dict((name, module) for module, names in _lazy_modules.items()
+                   for name in names)
 
+__all__ = (sorted(name for name in list(globals()) if not name.startswith("_"))
+           + sorted(_lazy_names))
+
+
+class _LazyModule(_types.ModuleType):
+    def __getattr__(self, name):
+        # Only called for names not already in our __dict__, so each backend
+        # is imported (and its names copied over) just the once
+        module_name = _lazy_names.get(name)
+        if module_name is None:
+            raise AttributeError("module 'fileutils' has no attribute "
+                                 "{0!r}".format(name))
+        __import__(module_name)
+        module = _sys.modules[module_name]
+        for lazy_name in _lazy_modules[module_name]:
+            setattr(self, lazy_name, getattr(module, lazy_name))
+        return getattr(module, name)
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(_lazy_names))
+
+
+# Swap this module for a _LazyModule with the same contents. The original is
+# kept alive (as _original) because Python 2 clears out the globals of
+# modules when they're garbage collected, and _LazyModule's methods use ours.
+_module = _LazyModule(__name__, __doc__)
+_module.__dict__.update(globals())
+_module._original = _sys.modules[__name__]
+_sys.modules[__name__] = _module
@@ -0,0 +1,419 @@
+"""
+Using files from asyncio code.
+
+Everything on :obj:`BaseFile <fileutils.interface.BaseFile>` blocks, so
+calling it from a coroutine stalls the event loop. :obj:`AsyncFile` wraps a
+file on any backend and provides awaitable versions of the most commonly used
+operations, which are carried out on a bounded pool of worker threads::
+
+    f = AsyncFile(SSHFile.connect(...).child("/srv/data"))
+    data = await f.child("config.json").aread()
+    await f.child("backup").acopy_to(AsyncFile(File("/tmp/backup")))
+    async for child in f.arecurse():
+        print(child.file.path)
+
+Operations on SSH files are carried out over SFTP sessions of the worker
+threads' own, opened on the file's existing SSH connection, so several of them
+can run at once without opening a connection each. Every operation in flight
+does occupy one of the executor's threads until it finishes, though, so how
+many run at once is bounded by the size of the executor. The extra sessions
+are closed along with the filesystem they were opened on.
+
+Cancelling an operation (for example, because the request that started it
+was aborted) cancels it in its worker thread too: copies, reads and
+recursions stop at the next block or file, although copies that have already
+started leave whatever they've copied so far behind.
+
+This module requires Python 3, and isn't imported by fileutils itself.
+"""
+
+from fileutils.parallel import default_workers
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+import collections
+import threading
+import weakref
+import asyncio
+import sys
+
+__all__ = ["AsyncFile"]
+
+# The executor AsyncFile instances use when they aren't given one, created
+# the first time it's needed
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+
+def _get_default_executor():
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            # Most of the work is waiting on the network or the disk, so
+            # allow for a few times as many threads as there are CPUs
+            _default_executor = ThreadPoolExecutor(default_workers() * 4)
+        return _default_executor
+
+
+class AsyncFile(object):
+    """
+    An asyncio-friendly wrapper around a :obj:`BaseFile
+    <fileutils.interface.BaseFile>`.
+
+    The operations whose names start with "a" start straight away, on a
+    thread from executor (a concurrent.futures.Executor, which defaults to
+    one shared by all AsyncFile instances), and return an asyncio future for
+    their result; they must be called from a thread running an event loop.
+    Other files passed to them can be AsyncFile instances or plain BaseFile
+    instances.
+    """
+    def __init__(self, f, executor=None):
+        self._file = f
+        self._executor = executor
+
+    @property
+    def file(self):
+        """
+        The BaseFile this AsyncFile wraps.
+        """
+        return self._file
+
+    @property
+    def parent(self):
+        parent = self._file.parent
+        return None if parent is None else AsyncFile(parent, self._executor)
+
+    def child(self, *names):
+        return AsyncFile(self._file.child(*names), self._executor)
+
+    def _run(self, function, *args):
+        # Run function(cancellation, *args) on a worker thread and return an
+        # asyncio future for its result. Cancelling the future cancels
+        # cancellation, which function passes on as a limiter to whatever it
+        # does that takes a while.
+        executor = self._executor or _get_default_executor()
+        cancellation = _Cancellation()
+        future = asyncio.wrap_future(executor.submit(function, cancellation,
+                                                     *args))
+        def done(future):
+            if future.cancelled():
+                cancellation.cancel()
+        future.add_done_callback(done)
+        return future
+
+    def aexists(self):
+        """
+        Awaitable version of :obj:`BaseFile.exists
+        <fileutils.interface.BaseFile.exists>`.
+        """
+        return self._run(_exists, self._file)
+
+    def astat(self):
+        """
+        Awaitable version of :obj:`BaseFile.stat
+        <fileutils.interface.BaseFile.stat>`.
+        """
+        return self._run(_stat, self._file)
+
+    def aread(self, limiter=None):
+        """
+        Awaitable version of :obj:`BaseFile.read
+        <fileutils.interface.BaseFile.read>`. limiter has the same meaning
+        as it does for :obj:`BaseFile.copy_to
+        <fileutils.interface.BaseFile.copy_to>`.
+        """
+        return self._run(_read, self._file, limiter)
+
+    def awrite(self, data, binary=True, atomic=False):
+        """
+        Awaitable version of :obj:`BaseFile.write
+        <fileutils.interface.BaseFile.write>`.
+
+        Cancelling the write only stops it if it hasn't started yet, so that
+        the file isn't left with only some of data written to it.
+        """
+        return self._run(_write, self._file, data, binary, atomic)
+
+    def acopy_to(self, other, overwrite=False, dereference_links=True,
+                 which_attributes={}, progress=None, limiter=None):
+        """
+        Awaitable version of :obj:`BaseFile.copy_to
+        <fileutils.interface.BaseFile.copy_to>`.
+        """
+        return self._run(_copy_to, self._file, _unwrap(other), overwrite,
+                         dereference_links, which_attributes, progress,
+                         limiter)
+
+    def arecurse(self, filter=None, include_self=True, recurse_skipped=True,
+                 batch=64):
+        """
+        Asynchronous iterator version of :obj:`BaseFile.recurse
+        <fileutils.interface.BaseFile.recurse>`, yielding AsyncFile
+        instances. Files are found up to batch at a time, each batch on a
+        worker thread of its own.
+
+        filter is called on the worker threads, so it shouldn't touch
+        anything belonging to the event loop.
+        """
+        return _AsyncRecursion(self, filter, include_self, recurse_skipped,
+                               batch)
+
+    def __eq__(self, other):
+        return isinstance(other, AsyncFile) and self._file == other._file
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._file)
+
+    def __repr__(self):
+        return "<fileutils.AsyncFile {0!r}>".format(self._file)
+
+    __str__ = __repr__
+
+
+class _AsyncRecursion(object):
+    # The asynchronous iterator returned from AsyncFile.arecurse. Only one
+    # batch is fetched at a time, so the recursion (and the SFTP session it
+    # uses, for SSH files) is only ever used from one thread at a time.
+    def __init__(self, f, filter, include_self, recurse_skipped, batch):
+        self._file = f
+        self._arguments = (filter, include_self, recurse_skipped)
+        self._batch = batch
+        self._buffer = collections.deque()
+        self._generator = None
+        self._session = None
+        self._exhausted = False
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        loop = asyncio.get_event_loop()
+        if self._buffer or self._exhausted:
+            future = loop.create_future()
+            if self._buffer:
+                future.set_result(self._buffer.popleft())
+            else:
+                future.set_exception(StopAsyncIteration())
+            return future
+        fetched = self._file._run(self._fetch)
+        future = loop.create_future()
+        def done(fetched):
+            if future.cancelled():
+                return
+            if fetched.cancelled():
+                future.cancel()
+            elif fetched.exception() is not None:
+                future.set_exception(fetched.exception())
+            elif self._buffer:
+                future.set_result(self._buffer.popleft())
+            else:
+                future.set_exception(StopAsyncIteration())
+        fetched.add_done_callback(done)
+        def cancel(future):
+            if future.cancelled():
+                fetched.cancel()
+        future.add_done_callback(cancel)
+        return future
+
+    def _fetch(self, cancellation):
+        if self._generator is None:
+            f = self._file.file
+            ssh = sys.modules.get("fileutils.ssh")
+            if ssh is not None and isinstance(f, ssh.SSHFile):
+                # A session of our own, since the worker threads each batch
+                # is fetched on will be used for other things in between
+                self._session = _Sessions.of(f.filesystem).open()
+                f = ssh.SSHFile(self._session, f._path)
+            self._generator = f.recurse(*self._arguments)
+        files = []
+        try:
+            for f in self._generator:
+                files.append(AsyncFile(_restore(f, self._file.file),
+                                       self._file._executor))
+                if len(files) >= self._batch:
+                    break
+                cancellation.check()
+            else:
+                self._finish()
+        except BaseException:
+            self._finish()
+            raise
+        self._buffer.extend(files)
+
+    def _finish(self):
+        self._exhausted = True
+        self._generator = None
+        if self._session is not None:
+            self._session._client.close()
+            self._session = None
+
+    def __del__(self):
+        # An async for loop that breaks out early never calls aclose, so
+        # don't leave the session open until the filesystem is closed
+        if self._session is not None:
+            self._session._client.close()
+
+    def aclose(self):
+        """
+        Stop the recursion, releasing anything it holds open.
+        """
+        self._buffer.clear()
+        if self._exhausted:
+            future = asyncio.get_event_loop().create_future()
+            future.set_result(None)
+            return future
+        return self._file._run(lambda cancellation: self._finish())
+
+
+class _Cancellation(object):
+    # A limiter that lets everything through until it's cancelled, after
+    # which it raises CancelledError, aborting whatever transfer it was
+    # given to. Anything it wraps (passed as limiter) is consumed too.
+    def __init__(self, limiter=None):
+        self._event = threading.Event()
+        self._limiter = limiter
+
+    def wrap(self, limiter, *files):
+        # A _Cancellation cancelled along with this one, wrapping limiter
+        # unless it's one of files' filesystems' rate limiters, which the
+        # transfer applies by itself
+        if any(limiter is f.filesystem.rate_limiter for f in files):
+            limiter = None
+        wrapper = _Cancellation(limiter)
+        wrapper._event = self._event
+        return wrapper
+
+    def cancel(self):
+        self._event.set()
+
+    def check(self):
+        if self._event.is_set():
+            raise CancelledError()
+
+    def consume(self, count):
+        self.check()
+        if self._limiter is not None:
+            self._limiter.consume(count)
+
+
+class _Sessions(object):
+    # The extra SFTP sessions opened on an SSHFileSystem's connection: one
+    # per worker thread, held in a thread local, plus one per recursion.
+    # paramiko's SFTPClient can't be used from more than one thread at a
+    # time, so this is how operations on the same filesystem run at once.
+    # They're all closed when the filesystem is closed (SSHFileSystem.close
+    # calls close_all) or garbage collected.
+    _instances = weakref.WeakKeyDictionary()
+    _lock = threading.Lock()
+
+    def __init__(self, filesystem):
+        self._filesystem = weakref.ref(filesystem)
+        self._local = threading.local()
+        self._opened = []
+        self._opened_lock = threading.Lock()
+        weakref.finalize(filesystem, _close_sessions, self._opened,
+                         self._opened_lock)
+
+    @classmethod
+    def of(cls, filesystem):
+        with cls._lock:
+            sessions = cls._instances.get(filesystem)
+            if sessions is None:
+                sessions = cls._instances[filesystem] = cls(filesystem)
+            return sessions
+
+    @classmethod
+    def close_all(cls, filesystem):
+        # Close every session opened on filesystem. They're reopened if the
+        # filesystem is used again, since filesystems with autoclose=False
+        # stay usable after being closed.
+        with cls._lock:
+            sessions = cls._instances.get(filesystem)
+        if sessions is not None:
+            _close_sessions(sessions._opened, sessions._opened_lock)
+
+    def open(self):
+        from fileutils.ssh import SSHFileSystem
+        filesystem = self._filesystem()
+        session = SSHFileSystem(filesystem._transport,
+                                filesystem._transport.open_sftp_client(),
+                                filesystem._client_name, autoclose=False)
+        # Share the original's metrics, block cache and rate limiter
+        for name in ("metrics", "block_cache", "rate_limiter"):
+            setattr(session, name, getattr(filesystem, name))
+        with self._opened_lock:
+            self._opened[:] = [s for s in self._opened if not _closed(s)]
+            self._opened.append(session)
+        return session
+
+    @property
+    def current(self):
+        session = getattr(self._local, "session", None)
+        if session is None or _closed(session):
+            session = self._local.session = self.open()
+        return session
+
+
+def _closed(session):
+    return session._client.sock.closed
+
+
+def _close_sessions(opened, lock):
+    with lock:
+        sessions = opened[:]
+        del opened[:]
+    for session in sessions:
+        session._client.close()
+
+
+def _localize(f):
+    # f, or for SSH files, the same file on this thread's SFTP session
+    ssh = sys.modules.get("fileutils.ssh")
+    if ssh is not None and isinstance(f, ssh.SSHFile):
+        return ssh.SSHFile(_Sessions.of(f.filesystem).current, f._path)
+    return f
+
+
+def _restore(f, original):
+    # The reverse of _localize: f, moved back to original's filesystem if
+    # it's on one of its sessions
+    if f.filesystem is not original.filesystem:
+        return type(f)(original.filesystem, f._path)
+    return f
+
+
+def _unwrap(f):
+    return f.file if isinstance(f, AsyncFile) else f
+
+
+# The functions AsyncFile runs on its worker threads
+
+def _exists(cancellation, f):
+    cancellation.check()
+    return _localize(f).exists
+
+
+def _stat(cancellation, f):
+    cancellation.check()
+    return _localize(f).stat
+
+
+def _read(cancellation, f, limiter):
+    cancellation.check()
+    f = _localize(f)
+    return b"".join(f.read_blocks(limiter=cancellation.wrap(limiter, f)))
+
+
+def _write(cancellation, f, data, binary, atomic):
+    cancellation.check()
+    _localize(f).write(data, binary, atomic)
+
+
+def _copy_to(cancellation, f, other, overwrite, dereference_links,
+             which_attributes, progress, limiter):
+    cancellation.check()
+    f = _localize(f)
+    other = _localize(other)
+    f.copy_to(other, overwrite, dereference_links, which_attributes, progress,
+              cancellation.wrap(limiter, f, other))
@@ -0,0 +1,216 @@
+"""
+Crash-safe writes.
+
+Writing a file in place leaves it truncated or half-written if the machine
+crashes (or the process dies) partway through. :obj:`BaseFile.write(data,
+atomic=True) <fileutils.interface.BaseFile.write>` and
+:obj:`BaseFile.atomic_writer <fileutils.interface.BaseFile.atomic_writer>`
+instead write to a temporary file next to the target, flush it to stable
+storage and then rename it over the target, so readers only ever see the old
+contents or the new ones::
+
+    with f.atomic_writer() as stream:
+        json.dump(config, stream)
+
+Flushing every file separately gets expensive when writing lots of them, so
+a :obj:`GroupCommit` can be used to hold off on the renames until the end of
+a batch and flush everything in the batch in one go::
+
+    with GroupCommit() as group:
+        for f, data in records:
+            f.write(data, atomic=group)
+"""
+
+from fileutils.interface import _open_exclusively
+from fileutils.attributes import PosixPermissions
+from fileutils.constants import FILE
+from fileutils.exceptions import generate
+from fileutils import exceptions
+import threading
+import tempfile
+import errno
+import stat
+import sys
+import os
+
+__all__ = ["AtomicWriter", "GroupCommit"]
+
+
+class AtomicWriter(object):
+    """
+    A context manager that writes a file atomically. Its __enter__ returns a
+    stream to write the file's new contents to; the file is replaced with
+    them when the with statement finishes, and left alone if it finishes by
+    raising an exception.
+
+    If group is a GroupCommit, the file is replaced when the group commits
+    instead.
+
+    Instances are usually obtained from :obj:`BaseFile.atomic_writer
+    <fileutils.interface.BaseFile.atomic_writer>`.
+    """
+    def __init__(self, target, group=None):
+        self._target = target
+        self._group = group
+        self._temporary = None
+        self._stream = None
+
+    @property
+    def target(self):
+        """
+        The file this writer replaces.
+        """
+        return self._target
+
+    def __enter__(self):
+        # Write through symbolic links to the files they point to, rather
+        # than replacing the links themselves
+        if self._target.is_link:
+            self._target = self._target.dereference(True)
+        self._temporary, self._stream = _open_sibling(self._target)
+        try:
+            _copy_permissions(self._target, self._temporary)
+        except:
+            self._stream.close()
+            self._temporary.delete(ignore_missing=True)
+            raise
+        return self._stream
+
+    def __exit__(self, exception_type, *args):
+        stream, self._stream = self._stream, None
+        if exception_type is not None:
+            stream.close()
+            self._temporary.delete(ignore_missing=True)
+            return
+        if self._group is not None:
+            # The group flushes everything at once when it commits
+            stream.close()
+            self._group._add(self._temporary, self._target)
+            return
+        try:
+            self._target._sync_stream(stream)
+        finally:
+            stream.close()
+        self._temporary._rename_over(self._target)
+        # Make the rename itself durable
+        self._target.parent._sync()
+
+
+class GroupCommit(object):
+    """
+    A batch of atomic writes whose files are all replaced together when the
+    batch is committed.
+
+    Writes made as part of the group go to temporary files without being
+    flushed to stable storage one at a time. When the group commits, each
+    filesystem written to is asked to flush all of the temporary files at
+    once (with a single syncfs(2) per local filesystem, where available),
+    then the temporary files are renamed over their targets, and then the
+    renames are flushed the same way. Until then, readers keep seeing the
+    files' old contents.
+
+    GroupCommit instances can be used as context managers, in which case the
+    group commits when the with statement finishes, or aborts (deleting the
+    temporary files and leaving their targets alone) if it finishes by
+    raising an exception. They're safe to use from multiple threads.
+    """
+    def __init__(self):
+        self._pending = []
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """
+        The number of files waiting for this group to commit.
+        """
+        return len(self._pending)
+
+    def _add(self, temporary, target):
+        with self._lock:
+            self._pending.append((temporary, target))
+
+    def commit(self):
+        """
+        Flush and rename all of the files written as part of this group so
+        far. The group can be used for further writes afterward.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        _sync_all(temporary for temporary, _ in pending)
+        for temporary, target in pending:
+            temporary._rename_over(target)
+        _sync_all(target.parent for _, target in pending)
+
+    def abort(self):
+        """
+        Discard all of the files written as part of this group that haven't
+        yet been committed.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for temporary, _ in pending:
+            temporary.delete(ignore_missing=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, *args):
+        if exception_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+    def __repr__(self):
+        return "<fileutils.GroupCommit with {0} pending>".format(
+            len(self._pending))
+
+    __str__ = __repr__
+
+
+def _open_sibling(target):
+    # Create a new temporary file next to target, and return it along with a
+    # stream open for writing to it
+    names = tempfile._get_candidate_names()
+    for _ in range(20):
+        temporary = target.sibling(".{0}.tmp{1}".format(target.name,
+                                                       next(names)))
+        try:
+            return temporary, _open_exclusively(temporary)
+        except exceptions.FileExistsError:
+            continue
+    raise generate(exceptions.FileExistsError, target)
+
+
+def _copy_permissions(target, temporary):
+    # Give temporary (before anything's written to it) target's permissions,
+    # and for local files its owner too where we're allowed to, so that
+    # replacing target doesn't change who can read or run it
+    if target.type is not FILE:
+        return
+    ours = target.attributes.get(PosixPermissions)
+    theirs = temporary.attributes.get(PosixPermissions)
+    if ours is not None and theirs is not None:
+        theirs.mode = stat.S_IMODE(ours.mode)
+    local = sys.modules.get("fileutils.local")
+    if (local is not None and isinstance(target, local.File) and
+            isinstance(temporary, local.File) and hasattr(os, "chown")):
+        s = os.stat(target.path)
+        try:
+            os.chown(temporary.path, s.st_uid, s.st_gid)
+        except OSError as e:
+            if e.errno != errno.EPERM:
+                raise
+
+
+def _sync_all(files):
+    # Sync the specified files, in one batch per filesystem and without
+    # repeating any
+    batches = {}
+    for f in files:
+        filesystem, batch = batches.setdefault(id(f.filesystem),
+                                               (f.filesystem, {}))
+        batch.setdefault(f.path, f)
+    for filesystem, batch in batches.values():
+        filesystem.sync(list(batch.values()))
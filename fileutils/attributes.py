@@ -1,5 +1,6 @@
 
 import stat
+import errno
 
 class AttributeSet(object):
     """
@@ -52,6 +53,19 @@ class AttributeSet(object):
         property. Subclasses of those classes shouldn't need to override this.
         """
         raise NotImplementedError
+    
+    def for_stream(self, stream):
+        """
+        Return an attribute set of the same type that reads and writes the
+        attributes of this set's file through the specified stream, which
+        must have been opened from that file, or None if that isn't
+        supported.
+        
+        BaseFile.copy_to uses this to copy attributes through the streams it
+        already has open, so that the files involved don't have to be looked
+        up again. The default implementation returns None.
+        """
+        return None
 
 
 class PosixPermissions(AttributeSet):
@@ -74,16 +88,51 @@ class PosixPermissions(AttributeSet):
         """
         raise NotImplementedError
     
+    # The mode being built up by the innermost batch() in progress, and how
+    # many batches are in progress
+    _batch_mode = None
+    _batch_depth = 0
+    
+    def _current_mode(self):
+        if self._batch_depth:
+            return self._batch_mode
+        return self.mode
+    
+    def _store_mode(self, mode):
+        if self._batch_depth:
+            self._batch_mode = mode
+        else:
+            self.mode = mode
+    
+    def batch(self):
+        """
+        Return a context manager that batches up changes made to these
+        permissions and applies them all at once. Without it, every change
+        reads the file's mode and then writes it back. Within it, the mode is
+        read once when the with statement starts, and written (with a single
+        chmod, and only if it changed) when it finishes::
+        
+            with f.attributes[PosixPermissions].batch() as permissions:
+                permissions.user.write = True
+                permissions.group.write = True
+                permissions.other.read = False
+        
+        Changes made within the with statement are discarded if it raises an
+        exception. Batches can be nested; the changes are applied when the
+        outermost one finishes.
+        """
+        return _Batch(self)
+    
     def set(self, mask, value):
         # Takes one of the stat.S_* constants
-        mode = self.mode
+        mode = self._current_mode()
         mode &= ~mask
         if value:
             mode |= mask
-        self.mode = mode
+        self._store_mode(mode)
     
     def get(self, mask):
-        return bool(self.mode & mask)
+        return bool(self._current_mode() & mask)
     
     @property
     def user(self):
@@ -157,11 +206,12 @@ class PosixPermissions(AttributeSet):
         execute bits that are already set). Setting the value of this property
         to False clears all executable bits that are set.
         """
-        return bool(self.mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH))
+        return bool(self._current_mode() &
+                    (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH))
     
     @execute.setter
     def execute(self, value):
-        mode = self.mode
+        mode = self._current_mode()
         if value:
             # Set executable bits where the corresponding read bit is set
             if mode & stat.S_IRUSR:
@@ -173,7 +223,7 @@ class PosixPermissions(AttributeSet):
         else:
             # Clear all executable bits
             mode &= ~(stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
-        self.mode = mode
+        self._store_mode(mode)
     
     def copy_to(self, other):
         other.mode = self.mode
@@ -212,20 +262,132 @@ class ExtendedAttributes(AttributeSet):
         """
         raise NotImplementedError
     
+    def items(self):
+        """
+        Return a list of (name, value) pairs, one for each of this file's
+        extended attributes.
+        
+        The default implementation calls list and then get for each name;
+        backends that can read everything in one pass override it.
+        """
+        result = []
+        for name in self.list():
+            try:
+                result.append((name, self.get(name)))
+            except KeyError:
+                # Deleted since we listed it
+                pass
+        return result
+    
+    def update(self, attributes, ignore_unsupported=False):
+        """
+        Set each of the specified extended attributes, which can be given as
+        a dictionary or as a sequence of (name, value) pairs (such as one
+        returned from items).
+        
+        If ignore_unsupported is True, attributes that this file's filesystem
+        refuses to store (because it doesn't support extended attributes, or
+        doesn't allow attributes in a particular namespace to be set by us)
+        are skipped instead of raising an exception.
+        """
+        if isinstance(attributes, dict):
+            attributes = attributes.items()
+        for name, value in attributes:
+            try:
+                self.set(name, value)
+            except EnvironmentError as e:
+                if not (ignore_unsupported and _unsupported(name, e)):
+                    raise
+    
     def copy_to(self, other):
         # Copy over our attributes. Note that we specifically don't delete the
         # other file's existing attributes first to avoid trampling on other
         # attribute sets that are just fronts for certain extended attributes
         # (like the future FileMimeType will be, at least on Linux).
-        for name in self.list():
-            try:
-                other.set(name, self.get(name))
-            except EnvironmentError:
-                # Probably because the target file is on a filesystem that
-                # places restrictions on the names of extended attributes; just
-                # ignore for now. Might want to consider raising some sort of
-                # warning later.
-                pass
+        # Attributes the target's filesystem won't store are skipped; might
+        # want to consider raising some sort of warning later.
+        other.update(self.items(), ignore_unsupported=True)
+
+
+# Error codes from setting an extended attribute that mean the target won't
+# store it, as opposed to something actually having gone wrong
+_UNSUPPORTED = set([errno.EOPNOTSUPP,
+                    getattr(errno, "ENOTSUP", errno.EOPNOTSUPP)])
+
+# Namespaces that only privileged processes can write to, so that EPERM from
+# setting an attribute in one of them means it can't be stored by us rather
+# than that the file itself is off limits
+_PRIVILEGED_NAMESPACES = ("trusted.", "security.")
+
+
+def _unsupported(name, error):
+    # True if error, raised from setting the extended attribute name, means
+    # the target won't store that attribute
+    if error.errno in _UNSUPPORTED:
+        return True
+    if isinstance(name, bytes):
+        name = name.decode("utf-8", "replace")
+    return (error.errno == errno.EPERM and
+            name.startswith(_PRIVILEGED_NAMESPACES))
+
+
+class Timestamps(AttributeSet):
+    """
+    An attribute set providing access to a file's last access and last
+    modification times, as integer numbers of nanoseconds since the epoch.
+    
+    Timestamps are copied by default, so that copies look unchanged to
+    anything that decides what to process (or transfer) next by comparing
+    modification times. copy_to copies a folder's timestamps after copying
+    its children, as writing them would otherwise update its modification
+    time all over again.
+    
+    Not every backend can store nanoseconds; SFTP, for one, only stores whole
+    seconds. Times are truncated to whatever precision the backend supports.
+    """
+    copy_by_default = True
+    
+    def get(self):
+        """
+        Return a tuple (atime_ns, mtime_ns) of this file's last access and
+        last modification times, read in one go.
+        """
+        raise NotImplementedError
+    
+    def set(self, atime_ns, mtime_ns):
+        """
+        Set this file's last access and last modification times at once.
+        """
+        raise NotImplementedError
+    
+    @property
+    def atime_ns(self):
+        """
+        This file's last access time. This property can be modified to change
+        it.
+        """
+        return self.get()[0]
+    
+    @atime_ns.setter
+    def atime_ns(self, value):
+        self.set(value, self.get()[1])
+    
+    @property
+    def mtime_ns(self):
+        """
+        This file's last modification time. This property can be modified to
+        change it.
+        """
+        return self.get()[1]
+    
+    @mtime_ns.setter
+    def mtime_ns(self, value):
+        self.set(self.get()[0], value)
+    
+    def copy_to(self, other):
+        atime_ns, mtime_ns = self.get()
+        if atime_ns is not None and mtime_ns is not None:
+            other.set(atime_ns, mtime_ns)
 
 
 class _ModeAccessor(object):
@@ -260,10 +422,31 @@ class _ModeAccessor(object):
         self._attributes.set(self._x, value)
     
     def __repr__(self):
-        mode = self._attributes.mode
+        mode = self._attributes._current_mode()
         r = "r" if mode & self._r else "-"
         w = "w" if mode & self._w else "-"
         x = "x" if mode & self._x else "-"
         return "<mode " + r + w + x + ">"
     
     __str__ = __repr__
+
+
+class _Batch(object):
+    def __init__(self, permissions):
+        self._permissions = permissions
+    
+    def __enter__(self):
+        permissions = self._permissions
+        if not permissions._batch_depth:
+            self._original = permissions._batch_mode = permissions.mode
+        permissions._batch_depth += 1
+        return permissions
+    
+    def __exit__(self, exception_type, *args):
+        permissions = self._permissions
+        permissions._batch_depth -= 1
+        if permissions._batch_depth:
+            return
+        mode, permissions._batch_mode = permissions._batch_mode, None
+        if exception_type is None and mode != self._original:
+            permissions.mode = mode
@@ -0,0 +1,210 @@
+"""
+An in-process cache of blocks read from remote files.
+
+Reading the same parts of the same remote files over and over (zip central
+directories, file headers read during scans, and so on) costs a network round
+trip every time. Giving a remote FileSystem a :obj:`BlockCache` makes streams
+returned by its files' open_for_reading fetch whole blocks and keep them
+around for the next reader::
+
+    fs = SSHFileSystem.connect(...)
+    fs.block_cache = BlockCache(capacity=256 * 2**20)
+    ZipFile(fs.child("/releases/big.zip")).child_names
+
+    URLFileSystem.block_cache = BlockCache()
+
+A single BlockCache can be shared by any number of filesystems.
+"""
+
+from collections import OrderedDict
+import threading
+
+__all__ = ["BlockCache"]
+
+
+class BlockCache(object):
+    """
+    A least-recently-used cache of fixed-size blocks of remote files, holding
+    at most capacity bytes.
+
+    Blocks are keyed by the file's identity (its URL, which covers both the
+    filesystem it's on and its path), its :obj:`validator
+    <fileutils.interface.BaseFile.validator>` as of the time the stream was
+    opened, and the index of the block within the file. A file that changes
+    therefore gets a new validator and new blocks, and the stale ones age out
+    of the cache on their own. Files whose backends can't provide a validator
+    aren't cached.
+
+    BlockCache instances are safe to use from multiple threads, and all
+    streams using the same BlockCache share its blocks.
+    """
+    def __init__(self, capacity=64 * 2**20, block_size=2**18):
+        self._capacity = capacity
+        self._block_size = block_size
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def capacity(self):
+        """
+        The maximum number of bytes this cache holds.
+        """
+        return self._capacity
+
+    @property
+    def block_size(self):
+        """
+        The size of the blocks this cache fetches and stores.
+        """
+        return self._block_size
+
+    @property
+    def size(self):
+        """
+        The number of bytes currently held by this cache.
+        """
+        return self._size
+
+    @property
+    def hits(self):
+        """
+        The number of block reads served from this cache.
+        """
+        return self._hits
+
+    @property
+    def misses(self):
+        """
+        The number of block reads that had to be fetched from the backend.
+        """
+        return self._misses
+
+    @property
+    def evictions(self):
+        """
+        The number of blocks evicted to make room for others.
+        """
+        return self._evictions
+
+    def reset_stats(self):
+        """
+        Reset hits, misses and evictions to zero.
+        """
+        with self._lock:
+            self._hits = self._misses = self._evictions = 0
+
+    def clear(self):
+        """
+        Drop all cached blocks.
+        """
+        with self._lock:
+            self._blocks.clear()
+            self._size = 0
+
+    def open(self, identity, validator, size, fetch, close=None):
+        """
+        Return a read-only, seekable stream over a file of the specified size
+        whose blocks are read from this cache where possible, and otherwise
+        fetched with fetch(offset, length) and stored in it. close, if given,
+        is called when the stream is closed.
+
+        This is used by backends to implement open_for_reading; see the
+        module documentation for how to turn caching on.
+        """
+        return _CachedStream(self, (identity, validator), size, fetch, close)
+
+    def _get(self, key, fetch):
+        with self._lock:
+            block = self._blocks.pop(key, None)
+            if block is not None:
+                self._blocks[key] = block # Now the most recently used
+                self._hits += 1
+                return block
+            self._misses += 1
+        # Fetch without holding the lock so that other readers can carry on
+        block = fetch()
+        with self._lock:
+            if key not in self._blocks:
+                self._blocks[key] = block
+                self._size += len(block)
+                while self._size > self._capacity and len(self._blocks) > 1:
+                    _, evicted = self._blocks.popitem(last=False)
+                    self._size -= len(evicted)
+                    self._evictions += 1
+        return block
+
+    def __repr__(self):
+        return ("<fileutils.BlockCache: {0} of {1} bytes used, {2} hits, "
+                "{3} misses>".format(self._size, self._capacity, self._hits,
+                                     self._misses))
+
+    __str__ = __repr__
+
+
+class _CachedStream(object):
+    def __init__(self, cache, key, size, fetch, close):
+        self._cache = cache
+        self._key = key
+        self._size = size
+        self._fetch = fetch
+        self._close = close
+        self._position = 0
+        self.closed = False
+
+    def _block(self, index):
+        block_size = self._cache._block_size
+        offset = index * block_size
+        def fetch():
+            return self._fetch(offset, min(block_size, self._size - offset))
+        return self._cache._get(self._key + (index,), fetch)
+
+    def read(self, size=-1):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        end = self._size
+        if size is not None and size >= 0:
+            end = min(end, self._position + size)
+        block_size = self._cache._block_size
+        pieces = []
+        while self._position < end:
+            index, start = divmod(self._position, block_size)
+            block = self._block(index)
+            piece = block[start:start + end - self._position]
+            if not piece: # The file shrank since we were opened
+                break
+            pieces.append(piece)
+            self._position += len(piece)
+        return b"".join(pieces)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += self._size
+        self._position = max(offset, 0)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self._close is not None:
+                self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,295 @@
+"""
+Writing lots of small files quickly.
+
+Writing a file with :obj:`BaseFile.write` resolves its whole path every time,
+and making sure its folder exists first costs another request or two. That's
+fine for a handful of files but adds up quickly when writing hundreds of
+thousands of them. A :obj:`DirectoryWriter` remembers which folders it has
+already created and (on backends that support it) holds them open, so that
+each file costs as little as the backend allows::
+
+    with folder.directory_writer() as writer:
+        writer.write("2016/05/record-1.json", data)
+        writer.write_many(("2016/05/" + name, data) for name, data in records)
+
+or, for a one-off batch, just::
+
+    folder.write_many(records)
+"""
+
+from fileutils.parallel import ordered_map
+from fileutils.exceptions import Convert
+from fileutils.metrics import measure
+from fileutils import exceptions
+import posixpath
+import threading
+import errno
+import stat
+import os
+
+__all__ = ["DirectoryWriter"]
+
+
+class DirectoryWriter(object):
+    """
+    An object that writes files into a folder and any number of subfolders
+    of it, creating the subfolders as needed.
+
+    Paths given to write and write_many are relative to the folder, and can
+    be strings using "/" as their separator or sequences of names. Folders
+    leading up to each file are created if they don't exist yet; each one is
+    only created (or found to exist) once per writer, so files are written
+    on the assumption that nothing else deletes folders from underneath it
+    while it's in use.
+
+    This generic implementation works on top of create_folder and
+    open_for_writing. Backends that can do better provide their own through
+    :obj:`BaseFile.directory_writer <fileutils.interface.BaseFile.directory_writer>`,
+    which is how instances should usually be obtained.
+
+    DirectoryWriter instances are safe to use from multiple threads. They
+    should be closed when they're no longer needed, which is most easily done
+    by using them as context managers.
+    """
+    def __init__(self, folder, workers=None):
+        """
+        Create a writer for the specified folder, which is created if it
+        doesn't already exist. workers is the number of threads write_many
+        spreads writes across, and defaults to the number of CPUs on this
+        machine.
+        """
+        folder.create_folder(ignore_existing=True, recursive=True)
+        self._folder = folder
+        self._workers = workers
+        self._known_folders = set([()])
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @property
+    def folder(self):
+        """
+        The folder this writer writes into.
+        """
+        return self._folder
+
+    def write(self, path, data):
+        """
+        Write data to the file at the specified path, replacing the file if
+        it already exists.
+        """
+        if self._closed:
+            raise ValueError("DirectoryWriter has already been closed")
+        names = _split(path)
+        if not names:
+            raise ValueError("Can't write to {0!r}".format(path))
+        self._ensure_folder(names[:-1])
+        self._write_file(names, data)
+
+    def write_many(self, items):
+        """
+        Write each of the specified (path, data) pairs, fanning the writes out
+        across this writer's worker threads. items is consumed lazily, so it
+        can be a generator producing far more data than would fit in memory.
+
+        If any of the writes fail, the first exception raised is propagated
+        once the writes already under way have finished.
+        """
+        def write(item):
+            self.write(*item)
+        for _ in ordered_map(write, items, self._workers):
+            pass
+
+    def close(self):
+        """
+        Release any resources held by this writer. Nothing can be written
+        with it afterward.
+        """
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _ensure_folder(self, names):
+        # Create the folder with the specified names relative to ours, and
+        # all the folders leading up to it, unless we already know they
+        # exist
+        if names in self._known_folders:
+            return
+        self._ensure_folder(names[:-1])
+        self._create_folder(names)
+        with self._lock:
+            self._known_folders.add(names)
+
+    def _create_folder(self, names):
+        # Create the specified folder, whose parent is known to exist
+        self._folder.child(*names).create_folder(ignore_existing=True)
+
+    def _write_file(self, names, data):
+        # Write the specified file, whose parent folder is known to exist
+        with self._folder.child(*names).open_for_writing() as f:
+            f.write(data)
+
+    def __repr__(self):
+        return "<fileutils.DirectoryWriter for {0!r}>".format(self._folder)
+
+    __str__ = __repr__
+
+
+class _LocalDirectoryWriter(DirectoryWriter):
+    """
+    A DirectoryWriter for local folders that creates files relative to open
+    descriptors of the folders they're written into, so that the kernel
+    doesn't have to look up every file's full path. Only used on platforms
+    that support dir_fd (Python 3.3 and later on POSIX systems).
+    """
+    def __init__(self, folder, workers=None):
+        DirectoryWriter.__init__(self, folder, workers)
+        self._fds = {}
+
+    def _fd(self, names):
+        # A descriptor for the folder with the specified names, opening it
+        # if we haven't already
+        fd = self._fds.get(names)
+        if fd is not None:
+            return fd
+        if names:
+            with Convert(self._path(names)):
+                fd = os.open(names[-1], _FOLDER_FLAGS,
+                             dir_fd=self._fd(names[:-1]))
+        else:
+            with Convert(self._folder.path):
+                fd = os.open(self._folder.path, _FOLDER_FLAGS)
+        with self._lock:
+            if names in self._fds: # Another thread beat us to it
+                os.close(fd)
+                return self._fds[names]
+            self._fds[names] = fd
+        return fd
+
+    def _path(self, names):
+        return os.path.join(self._folder.path, *names)
+
+    def _measure(self, operation, bytes=0):
+        from fileutils import local
+        return measure(local._local_file_system.metrics, operation, bytes)
+
+    def _create_folder(self, names):
+        try:
+            with self._measure("mkdir"):
+                os.mkdir(names[-1], 0o777, dir_fd=self._fd(names[:-1]))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise exceptions.convert(e, self._path(names))
+
+    def _write_file(self, names, data):
+        from fileutils import local
+        if local._lazy_files:
+            local._fetch_lazy(self._path(names), "wb")
+        with Convert(self._path(names)):
+            with self._measure("open"):
+                fd = os.open(names[-1], _FILE_FLAGS, 0o666,
+                             dir_fd=self._fd(names[:-1]))
+            try:
+                with self._measure("write", len(data)):
+                    view = memoryview(data)
+                    while view:
+                        view = view[os.write(fd, view):]
+            finally:
+                os.close(fd)
+
+    def close(self):
+        DirectoryWriter.close(self)
+        with self._lock:
+            fds = list(self._fds.values())
+            self._fds.clear()
+        for fd in fds:
+            os.close(fd)
+
+
+class _SSHDirectoryWriter(DirectoryWriter):
+    """
+    A DirectoryWriter for SSHFile folders. paramiko's SFTPClient can't be used
+    from more than one thread at a time, so each thread that writes gets an
+    SFTP session of its own over the folder's SSH connection. Writes within
+    each session are pipelined, so writing a small file costs one round trip
+    to open it and one to close it, and write_many keeps one such exchange
+    in flight per worker.
+    """
+    def __init__(self, folder, workers=None):
+        DirectoryWriter.__init__(self, folder, workers)
+        self._local = threading.local()
+        self._clients = []
+
+    @property
+    def _client(self):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            transport = self._folder.filesystem._transport
+            client = self._local.client = transport.open_sftp_client()
+            with self._lock:
+                self._clients.append(client)
+        return client
+
+    def _path(self, names):
+        return posixpath.join(self._folder._path, *names)
+
+    def _create_folder(self, names):
+        path = self._path(names)
+        client = self._client
+        try:
+            with self._folder._measure("mkdir"):
+                client.mkdir(path)
+        except IOError as e:
+            # SFTP v3 doesn't tell us whether the folder already existed, so
+            # check for ourselves
+            try:
+                existing = client.stat(path)
+            except IOError:
+                existing = None
+            if existing is None or not stat.S_ISDIR(existing.st_mode):
+                raise exceptions.convert(e, path)
+
+    def _write_file(self, names, data):
+        path = self._path(names)
+        client = self._client
+        with Convert(path):
+            with self._folder._measure("open"):
+                f = client.open(path, "wb")
+            try:
+                f.set_pipelined(True)
+                with self._folder._measure("write", len(data)):
+                    f.write(data)
+            finally:
+                f.close()
+
+    def close(self):
+        DirectoryWriter.close(self)
+        with self._lock:
+            clients = list(self._clients)
+            del self._clients[:]
+        for client in clients:
+            client.close()
+
+
+_CLOEXEC = getattr(os, "O_CLOEXEC", 0)
+_FOLDER_FLAGS = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0) | _CLOEXEC
+_FILE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | _CLOEXEC
+
+
+def _split(path):
+    # Split path into names, rejecting absolute paths and ".." so that
+    # nothing gets written outside the writer's folder
+    if isinstance(path, (tuple, list)):
+        names = path
+        absolute = any("/" in name for name in names)
+    else:
+        names = path.split("/")
+        absolute = path.startswith("/")
+    names = tuple(name for name in names if name not in ("", "."))
+    if absolute or ".." in names:
+        raise ValueError("{0!r} would escape the writer's folder"
+                         .format(path))
+    return names
@@ -0,0 +1,253 @@
+"""
+A persistent local cache of remote files and folders.
+
+:obj:`LocalFileSystem.cache() <fileutils.local.LocalFileSystem.cache>` copies
+whatever it's given into a new temporary folder every time it's called. When
+given a :obj:`FileCache`, it instead keeps copies in the cache's folder and
+reuses them for as long as they're still up to date, across calls and across
+processes::
+
+    store = FileCache("/var/cache/artifacts", budget=20 * 2**30)
+    with LocalFileSystem().cache(remote_artifact, store) as local_copy:
+        ...
+"""
+
+from fileutils.interface import BaseFile
+from fileutils.constants import FILE, FOLDER
+import hashlib
+import errno
+import json
+import os
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+__all__ = ["FileCache"]
+
+
+class FileCache(object):
+    """
+    A folder on the local machine holding copies of remote files and folders.
+
+    Each copy is stored under a key derived from the identity of the file it
+    was copied from (its URL, where it has one), along with that file's
+    :obj:`validator <fileutils.interface.BaseFile.validator>` at the time of
+    copying. A copy is reused as long as the original's validator is still
+    the same; a copy of a folder is checked against the validators of
+    everything inside the folder, which takes a walk of the original (but no
+    data transfer). Files whose backends can't provide validators are copied
+    again every time.
+
+    Any number of processes can share the same cache folder. They coordinate
+    with file locks (on platforms that have fcntl.flock), so a given file is
+    only downloaded by one of them at a time and copies aren't evicted or
+    replaced while another process is using them.
+
+    If budget is given, copies are evicted, least recently used first, to
+    keep the total size of the cache under that many bytes. The copy being
+    returned and copies in use by other processes are never evicted, so the
+    budget can be exceeded temporarily.
+
+    Copies handed out by the cache are shared with everyone else using it, so
+    they must not be modified.
+    """
+    def __init__(self, location, budget=None):
+        """
+        Create a cache stored in the specified local folder, which can be a
+        File or a pathname. It's created if it doesn't already exist.
+        """
+        if not isinstance(location, BaseFile):
+            from fileutils.local import File
+            location = File(location)
+        location.create_folder(ignore_existing=True, recursive=True)
+        self._location = location
+        self._budget = budget
+
+    @property
+    def location(self):
+        """
+        The folder in which this cache is stored.
+        """
+        return self._location
+
+    @property
+    def budget(self):
+        """
+        The maximum total size of this cache in bytes, or None if there's no
+        limit.
+        """
+        return self._budget
+
+    def get(self, f):
+        """
+        Return a LocalCache wrapping an up-to-date local copy of the specified
+        file or folder, copying it into the cache first if there's no such
+        copy yet. The copy has the same name as the original.
+
+        The copy is guaranteed not to be evicted or replaced until the
+        returned LocalCache's __exit__ is called (which is why it should
+        usually be used in a with statement), or until it's garbage
+        collected.
+        """
+        from fileutils.local import LocalCache
+        identity = _identity(f)
+        key = hashlib.sha1(_encode(identity)).hexdigest()
+        entry = self._location.child(key)
+        metadata_file = entry.child("metadata.json")
+        lock = _Lock(self._location.child(key + ".lock").path)
+        # Check the copy under a shared lock, so that any number of users of
+        # an up-to-date copy can go ahead at once, and only take an exclusive
+        # one if it has to be fetched
+        lock.acquire(exclusive=False)
+        try:
+            validator = _validator(f)
+            metadata = _current_metadata(metadata_file, validator)
+            if metadata is None:
+                lock.acquire()
+                # The upgrade isn't atomic, so someone else may have fetched
+                # it in the meantime
+                metadata = _current_metadata(metadata_file, validator)
+                if metadata is None:
+                    metadata = self._fetch(f, key, identity, validator)
+                # Let other processes use the copy too, but not replace it
+                lock.acquire(exclusive=False)
+            # Record the use for the benefit of eviction
+            os.utime(metadata_file.path, None)
+        except:
+            lock.release()
+            raise
+        self._evict(key)
+        return LocalCache(None, entry.child(metadata["name"]), lock)
+
+    def _fetch(self, f, key, identity, validator):
+        # Copy f into the cache, replacing any previous copy. Must be called
+        # with the entry's lock held.
+        entry = self._location.child(key)
+        staging = self._location.child(key + ".tmp")
+        # Anything already here was left behind by a process that died
+        # partway through a copy
+        staging.delete(ignore_missing=True)
+        staging.create_folder()
+        name = f.name or "data"
+        f.copy_to(staging.child(name))
+        metadata = {"identity": identity, "validator": validator,
+                    "name": name, "size": staging.child(name).size}
+        staging.child("metadata.json").write(
+            json.dumps(metadata).encode("utf-8"))
+        entry.delete(ignore_missing=True)
+        staging.rename_to(entry)
+        return metadata
+
+    def _evict(self, keep):
+        if self._budget is None:
+            return
+        lock = _Lock(self._location.child("eviction.lock").path)
+        lock.acquire()
+        try:
+            entries = []
+            total = 0
+            for entry in self._location.children:
+                metadata_file = entry.child("metadata.json")
+                try:
+                    last_used = os.stat(metadata_file.path).st_mtime
+                    metadata = json.loads(metadata_file.read().decode("utf-8"))
+                except (EnvironmentError, ValueError):
+                    continue # Lock file, or a copy in progress
+                total += metadata["size"]
+                entries.append((last_used, entry.name, metadata["size"]))
+            entries.sort()
+            for _, key, size in entries:
+                if total <= self._budget:
+                    break
+                if key == keep:
+                    continue
+                entry_lock = _Lock(self._location.child(key + ".lock").path)
+                try:
+                    # Skip copies that are in use
+                    if entry_lock.acquire(blocking=False):
+                        self._location.child(key).delete(ignore_missing=True)
+                        total -= size
+                finally:
+                    entry_lock.release()
+        finally:
+            lock.release()
+
+    def __repr__(self):
+        return "<fileutils.FileCache in {0!r}>".format(self._location)
+
+    __str__ = __repr__
+
+
+class _Lock(object):
+    """
+    An advisory lock on a local file, which is created if necessary. The
+    lock is released when release() is called or when the _Lock is garbage
+    collected.
+    """
+    def __init__(self, path):
+        self._file = open(path, "a")
+
+    def acquire(self, exclusive=True, blocking=True):
+        """
+        Acquire the lock (or convert a lock already held between shared and
+        exclusive) and return True, or return False if blocking is False and
+        someone else holds a conflicting lock.
+        """
+        if fcntl is None:
+            return True
+        flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(self._file.fileno(), flags)
+        except EnvironmentError as e:
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        return True
+
+    def release(self):
+        # Closing the file releases the lock
+        self._file.close()
+
+
+def _current_metadata(metadata_file, validator):
+    # The metadata of the copy in the cache if it's up to date with
+    # validator, or None if it isn't (or there isn't one)
+    if validator is None or not metadata_file.exists:
+        return None
+    metadata = json.loads(metadata_file.read().decode("utf-8"))
+    if metadata["validator"] != validator:
+        return None
+    return metadata
+
+
+def _identity(f):
+    url = getattr(f, "url", None)
+    if url:
+        return url
+    return repr(f)
+
+
+def _validator(f):
+    # The validator of a file, or one covering everything within a folder
+    # (None if any part of it doesn't have one)
+    if f.dereference(True).type is not FOLDER:
+        return f.validator
+    digest = hashlib.sha1()
+    for child in f.recurse(include_self=False):
+        validator = child.validator if child.type is FILE else child.type
+        if validator is None:
+            return None
+        path = "/".join(child.get_path_components(relative_to=f))
+        digest.update(_encode("{0}\0{1}\0".format(path, validator)))
+    return digest.hexdigest()
+
+
+def _encode(text):
+    # Python 2 strings are already bytes
+    if isinstance(text, bytes):
+        return text
+    return text.encode("utf-8", "surrogateescape")
@@ -2,9 +2,14 @@
 from fileutils.interface import BaseFile, FileSystem
 from fileutils.mixins import ChildrenMixin
 from fileutils.constants import FILE, FOLDER
+from fileutils.exceptions import generate
+from fileutils.metrics import measure
+from fileutils import exceptions
 import ftplib
 import posixpath
 
+__all__ = ["FTPFileSystem", "FTPFile"]
+
 class FTPFileSystem(FileSystem):
     def __init__(self, client):
         self._client = client
@@ -23,6 +28,9 @@ class FTPFile(ChildrenMixin, BaseFile):
     def _client(self):
         return self._filesystem._client
     
+    def _measure(self, operation, bytes=0):
+        return measure(self._filesystem.metrics, operation, bytes)
+    
     @property
     def filesystem(self):
         return self._filesystem
@@ -33,7 +41,8 @@ class FTPFile(ChildrenMixin, BaseFile):
         # use it to detect whether we're actually a folder. I'm not aware of
         # any other way to go about this...
         try:
-            self._client.cwd(self._path)
+            with self._measure("stat"):
+                self._client.cwd(self._path)
             return True
         except ftplib.error_perm as e:
             if str(e).startswith('550'):
@@ -47,7 +56,7 @@ class FTPFile(ChildrenMixin, BaseFile):
         # size; we'll get back a '550 Could not get file size' if this is
         # actually a directory or a nonexistent file.
         try:
-            self._client.size(self._path)
+            self._size()
             return True
         except ftplib.error_perm as e:
             if str(e).startswith('550'):
@@ -71,17 +80,47 @@ class FTPFile(ChildrenMixin, BaseFile):
         # our own.
         if not self.is_folder:
             return None
-        return [posixpath.split(name)[1] for name in self._client.nlst(self._path)]
+        with self._measure("list"):
+            names = self._client.nlst(self._path)
+        return [posixpath.split(name)[1] for name in names]
     
     def child(self, *names):
         return FTPFile(self._filesystem, posixpath.join(self._path, *names))
     
+    @property
+    def parent(self):
+        parent = posixpath.dirname(self._path)
+        if parent == self._path:
+            return None
+        return FTPFile(self._filesystem, parent)
+    
     def create_folder(self, ignore_existing=False, recursive=False):
-        if recursive and not self.parent.is_folder:
-            self.parent.create_folder(recursive=True)
+        # Just try to create the folder; we only need to find out what's
+        # going on if that fails.
+        try:
+            with self._measure("mkdir"):
+                self._client.mkd(self._path)
+            return
+        except ftplib.error_perm as e:
+            if not str(e).startswith('550'):
+                raise
+        # A 550 doesn't tell us why the folder couldn't be created, so we
+        # have to work it out ourselves.
         if self.is_folder:
+            if ignore_existing:
+                return
+            raise generate(exceptions.FileExistsError, self._path)
+        if self.is_file:
+            raise generate(exceptions.FileExistsError, self._path)
+        parent = self.parent
+        if parent is not None and not parent.is_folder:
+            if not recursive:
+                raise generate(exceptions.FileNotFoundError, self._path)
+            parent.create_folder(ignore_existing=True, recursive=True)
+            self.create_folder(ignore_existing=ignore_existing)
             return
-        self._client.mkd(self._path)
+        # Our parent exists and we don't, so the server must have refused
+        raise generate(exceptions.PermissionError, self._path)
     
     def delete(self, ignore_missing=False, recursive=False):
         # Things are somewhat complicated here. FTP doesn't give us a generic
@@ -99,7 +138,8 @@ class FTPFile(ChildrenMixin, BaseFile):
         #
         # First, try to delete it as a file.
         try:
-            self._client.delete(self._path)
+            with self._measure("remove"):
+                self._client.delete(self._path)
             return
         except ftplib.error_perm as e:
             if not str(e).startswith('550'):
@@ -107,7 +147,9 @@ class FTPFile(ChildrenMixin, BaseFile):
         # Didn't work, so it's either a directory or nonexistent. List its
         # contents, ignoring any errors we might encounter.
         try:
-            child_names = [posixpath.split(name)[1] for name in self._client.nlst(self._path)]
+            with self._measure("list"):
+                names = self._client.nlst(self._path)
+            child_names = [posixpath.split(name)[1] for name in names]
         except ftplib.Error:
             pass
         else:
@@ -116,7 +158,8 @@ class FTPFile(ChildrenMixin, BaseFile):
                 self.child(name).delete(recursive=recursive)
         # Now try to delete it as a directory.
         try:
-            self._client.rmd(self._path)
+            with self._measure("remove"):
+                self._client.rmd(self._path)
             return
         except ftplib.error_perm as e:
             if not str(e).startswith('550'):
@@ -125,9 +168,9 @@ class FTPFile(ChildrenMixin, BaseFile):
         # doesn't and ignore_missing is True, we're good. Otherwise, raise an
         # exception.
         if self.exists:
-            raise Exception("Couldn't delete {0!r}".format(self))
+            raise generate(exceptions.PermissionError, self._path)
         if not ignore_missing:
-            raise Exception("Tried to delete a file that doesn't exist")
+            raise generate(exceptions.FileNotFoundError, self._path)
     
     def get_path_components(self, relative_to=None):
         if relative_to:
@@ -144,7 +187,14 @@ class FTPFile(ChildrenMixin, BaseFile):
     @property
     def size(self):
         # TODO: Make this work for directories
-        return self._client.size(self._path)
+        return self._size()
+    
+    def _size(self):
+        # Plenty of servers refuse SIZE in ASCII mode, and ftplib switches to
+        # ASCII mode for every listing, so switch back to binary first.
+        with self._measure("stat"):
+            self._client.voidcmd("TYPE I")
+            return self._client.size(self._path)
 
 
 
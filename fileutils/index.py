@@ -0,0 +1,257 @@
+"""
+A persistent SQLite index of a tree's metadata.
+
+Walking a multi-million-file tree to answer "which files larger than X were
+modified after Y under Z?" takes a long time no matter how fast the backend is.
+TreeIndex stores the metadata gathered by such a walk in a local SQLite
+database so that queries like that can be answered without touching the
+filesystem at all::
+
+    index = TreeIndex(some_folder, "/var/cache/some_folder.sqlite")
+    index.refresh()
+    for f in index.find(under="logs", min_size=10 * 2**20):
+        ...
+
+Later calls to refresh() are incremental; see :obj:`TreeIndex.refresh` for
+details.
+"""
+
+from fileutils.constants import FILE, FOLDER, LINK
+import sqlite3
+
+__all__ = ["TreeIndex"]
+
+_TYPE_CODES = {FILE: 1, FOLDER: 2, LINK: 3}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    type INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent);
+CREATE INDEX IF NOT EXISTS entries_size ON entries (size);
+CREATE INDEX IF NOT EXISTS entries_mtime ON entries (mtime_ns);
+"""
+
+
+class TreeIndex(object):
+    """
+    An index of the files and folders beneath a particular folder, stored in a
+    local SQLite database.
+
+    Paths stored in the index are relative to the indexed folder and always use
+    "/" as their separator. Query methods accept such relative paths for their
+    under argument ("" meaning the whole tree) and return BaseFile instances
+    obtained from the indexed folder's child method.
+
+    TreeIndex instances can be used as context managers, in which case the
+    underlying database connection is closed when the block exits.
+    """
+    def __init__(self, root, database):
+        """
+        Create an index of the specified folder (any BaseFile instance) stored
+        in the specified SQLite database, which can be a local pathname, a
+        local File instance, or ":memory:". The database is created if it
+        doesn't already exist, but isn't populated until refresh() is called.
+        """
+        self._root = root
+        if hasattr(database, "path"):
+            database = database.path
+        self._db = sqlite3.connect(database)
+        if str is bytes:
+            # Python 2: let 8-bit pathnames through untouched
+            self._db.text_factory = str
+        self._db.executescript(_SCHEMA)
+
+    @property
+    def root(self):
+        """
+        The folder this index covers.
+        """
+        return self._root
+
+    def close(self):
+        """
+        Close the underlying database connection.
+        """
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def refresh(self, full=False):
+        """
+        Bring the index up to date with the tree.
+
+        A folder's modification time changes whenever a file is added to,
+        removed from, or renamed within it, so only folders whose modification
+        time differs from the one recorded in the index are listed again, and
+        only their immediate children are re-examined. Unchanged folders cost a
+        single stat each. This makes refreshing an index of a large tree that
+        has seen few changes far cheaper than walking it from scratch.
+
+        The flip side is that a file modified in place (which doesn't change
+        its folder's modification time) isn't noticed by an incremental
+        refresh. If full is True, every folder is re-listed and every file
+        re-examined regardless of modification times. Folders on backends that
+        don't expose modification times are always re-listed.
+        """
+        with self._db:
+            root_stat = self._root.stat
+            if root_stat is None or root_stat.type is not FOLDER:
+                self._delete_tree("")
+                return
+            stack = [("", self._root, root_stat)]
+            while stack:
+                path, folder, folder_stat = stack.pop()
+                row = self._db.execute(
+                    "SELECT type, mtime_ns FROM entries WHERE path = ?",
+                    (path,)).fetchone()
+                unchanged = (not full and row is not None and
+                             row[0] == _TYPE_CODES[FOLDER] and
+                             folder_stat.mtime_ns is not None and
+                             row[1] == folder_stat.mtime_ns)
+                if unchanged:
+                    # Nothing was added or removed, but our subfolders could
+                    # still have changed, so stat them and carry on down.
+                    subfolders = self._db.execute(
+                        "SELECT path FROM entries WHERE parent = ? AND "
+                        "type = ?", (path, _TYPE_CODES[FOLDER])).fetchall()
+                    for (child_path,) in subfolders:
+                        child = folder.child(child_path.rpartition("/")[2])
+                        child_stat = child.stat
+                        if child_stat is None or child_stat.type is not FOLDER:
+                            # Raced with a concurrent change; the parent will
+                            # be rescanned next time around.
+                            continue
+                        stack.append((child_path, child, child_stat))
+                else:
+                    stack.extend(self._rescan(path, folder))
+                self._store(path, folder_stat)
+
+    def _rescan(self, path, folder):
+        # Re-list a folder, store its children, and return (path, file, stat)
+        # tuples for its subfolders
+        names = folder.child_names or []
+        prefix = path + "/" if path else ""
+        known = set(child_path for (child_path,) in self._db.execute(
+            "SELECT path FROM entries WHERE parent = ?", (path,)))
+        subfolders = []
+        seen = set()
+        for name in names:
+            child_path = prefix + name
+            child = folder.child(name)
+            child_stat = child.stat
+            if child_stat is None:
+                continue
+            seen.add(child_path)
+            if child_stat.type is FOLDER:
+                # Stored by refresh once the folder itself has been scanned, so
+                # that an interrupted refresh leaves it looking out of date
+                subfolders.append((child_path, child, child_stat))
+            else:
+                if child_path in known:
+                    # Might have been a folder with children before
+                    self._delete_tree(child_path)
+                self._store(child_path, child_stat)
+        for child_path in known - seen:
+            self._delete_tree(child_path)
+        return subfolders
+
+    def _store(self, path, s):
+        parent = path.rpartition("/")[0] if path else None
+        self._db.execute(
+            "INSERT OR REPLACE INTO entries (path, parent, type, size, "
+            "mtime_ns) VALUES (?, ?, ?, ?, ?)",
+            (path, parent, _TYPE_CODES.get(s.type, 4),
+             s.size if s.type is not FOLDER and s.size else 0, s.mtime_ns))
+
+    def _delete_tree(self, path):
+        if path:
+            self._db.execute("DELETE FROM entries WHERE path = ? OR "
+                             "(path >= ? AND path < ?)",
+                             (path, path + "/", path + "0"))
+        else:
+            self._db.execute("DELETE FROM entries")
+
+    def _under(self, under):
+        # A WHERE clause fragment and its parameters selecting everything
+        # strictly beneath the specified path ("0" sorts right after "/")
+        if not under:
+            return "path != ''", ()
+        under = under.strip("/")
+        return "path >= ? AND path < ?", (under + "/", under + "0")
+
+    def _file(self, path):
+        return self._root.child(*path.split("/"))
+
+    def find(self, under="", min_size=None, max_size=None,
+             modified_after=None, modified_before=None, type=FILE):
+        """
+        Return a list of all files beneath the specified relative path that
+        match the specified criteria, sorted by path.
+
+        modified_after and modified_before are given in seconds since the
+        epoch, as returned by time.time(). type is one of FILE, FOLDER, or
+        LINK, or None to include entries of any type.
+        """
+        clause, parameters = self._under(under)
+        clauses, parameters = [clause], list(parameters)
+        if min_size is not None:
+            clauses.append("size >= ?")
+            parameters.append(min_size)
+        if max_size is not None:
+            clauses.append("size <= ?")
+            parameters.append(max_size)
+        if modified_after is not None:
+            clauses.append("mtime_ns > ?")
+            parameters.append(int(modified_after * 1000000000))
+        if modified_before is not None:
+            clauses.append("mtime_ns < ?")
+            parameters.append(int(modified_before * 1000000000))
+        if type is not None:
+            clauses.append("type = ?")
+            parameters.append(_TYPE_CODES.get(type, 4))
+        cursor = self._db.execute("SELECT path FROM entries WHERE " +
+                                  " AND ".join(clauses) + " ORDER BY path",
+                                  parameters)
+        return [self._file(path) for (path,) in cursor]
+
+    def du(self, under=""):
+        """
+        Return the total size, in bytes, of all files beneath the specified
+        relative path.
+        """
+        clause, parameters = self._under(under)
+        (total,) = self._db.execute("SELECT SUM(size) FROM entries WHERE " +
+                                    clause, parameters).fetchone()
+        return total or 0
+
+    def folder_sizes(self, under=""):
+        """
+        Return a list of (folder, size) tuples, one for each immediate
+        subfolder of the specified relative path, where size is the total size
+        of all files within that subfolder.
+        """
+        under = under.strip("/")
+        cursor = self._db.execute("SELECT path FROM entries WHERE parent = ? "
+                                  "AND type = ? ORDER BY path",
+                                  (under, _TYPE_CODES[FOLDER]))
+        return [(self._file(path), self.du(path))
+                for (path,) in cursor.fetchall()]
+
+    def __len__(self):
+        (count,) = self._db.execute(
+            "SELECT COUNT(*) FROM entries WHERE path != ''").fetchone()
+        return count
+
+    def __repr__(self):
+        return "<fileutils.TreeIndex of {0!r}>".format(self._root)
+
+    __str__ = __repr__
@@ -6,7 +6,7 @@ fileutils.
 """
 
 from abc import ABCMeta, abstractmethod, abstractproperty
-from fileutils.constants import FILE, FOLDER, LINK, YIELD, RECURSE
+from fileutils.constants import FILE, FOLDER, LINK, YIELD, RECURSE, SKIP
 from fileutils.exceptions import generate
 from fileutils import exceptions
 import hashlib
@@ -16,7 +16,7 @@ import random
 import tempfile
 
 __all__ = ["FileSystem", "MountPoint", "MountDevice", "DiskUsage", "Usage",
-           "BaseFile"]
+           "FileStat", "BaseFile"]
 
 class DiskUsage(object):
     """
@@ -97,6 +97,74 @@ class Usage(object):
         return "Usage(total={0!r}, used={1!r}, available={2!r})".format(self.total, self.used, self.available)
 
 
+class FileStat(object):
+    """
+    A snapshot of a file's metadata, as returned by :obj:`BaseFile.stat`.
+    
+    Backends fill in whatever they cheaply can; fields a particular backend
+    doesn't expose (SFTP has no notion of inode numbers, for example) are None.
+    """
+    def __init__(self, type, size=None, mtime_ns=None, atime_ns=None,
+                 inode=None, mode=None):
+        self._type = type
+        self._size = size
+        self._mtime_ns = mtime_ns
+        self._atime_ns = atime_ns
+        self._inode = inode
+        self._mode = mode
+    
+    @property
+    def type(self):
+        """
+        One of FILE, FOLDER, or LINK, as per :obj:`BaseFile.type`.
+        """
+        return self._type
+    
+    @property
+    def size(self):
+        """
+        The size of the file in bytes. Unlike :obj:`BaseFile.size`, this is
+        never a recursive sum for folders.
+        """
+        return self._size
+    
+    @property
+    def mtime_ns(self):
+        """
+        The file's modification time, in nanoseconds since the epoch.
+        """
+        return self._mtime_ns
+    
+    @property
+    def atime_ns(self):
+        """
+        The file's access time, in nanoseconds since the epoch.
+        """
+        return self._atime_ns
+    
+    @property
+    def inode(self):
+        """
+        The file's inode number.
+        """
+        return self._inode
+    
+    @property
+    def mode(self):
+        """
+        The file's numerical mode, including the file type bits.
+        """
+        return self._mode
+    
+    def __repr__(self):
+        return ("FileStat(type={0!r}, size={1!r}, mtime_ns={2!r}, "
+                "atime_ns={3!r}, inode={4!r}, mode={5!r})".format(
+                    self.type, self.size, self.mtime_ns, self.atime_ns,
+                    self.inode, self.mode))
+    
+    __str__ = __repr__
+
+
 class FileSystem(object):
     """
     An abstract class representing an entire file system hierarchy.
@@ -108,6 +176,16 @@ class FileSystem(object):
     machine. Other subclasses include
     :obj:`SSHFileSystem <fileutils.ssh.SSHFileSystem>`.
     """
+    # A fileutils.blockcache.BlockCache that open_for_reading should read
+    # through, on backends that support one (SSHFileSystem and URLFileSystem)
+    block_cache = None
+    # A fileutils.metrics.Metrics that this filesystem's files record the
+    # operations they carry out against, if any (see fileutils.metrics)
+    metrics = None
+    # A fileutils.transfer.TokenBucket limiting the rate at which data is
+    # transferred to and from this filesystem's files, if any
+    rate_limiter = None
+    
     def child(self, path):
         """
         Return an instance of :obj:`BaseFile` representing the file located at
@@ -165,6 +243,21 @@ class FileSystem(object):
         only file systems like FTPFileSystem and URLFileSystem do not.
         """
         return None
+    
+    def sync(self, files):
+        """
+        Make sure that everything written to the specified files and folders
+        on this file system (including the creation, renaming and deletion of
+        their children, for folders) has reached stable storage.
+        
+        This is used by :obj:`GroupCommit <fileutils.atomic.GroupCommit>` to
+        flush a whole batch of writes at once. The default implementation
+        flushes each file in turn, as well as its backend allows (which, for
+        some backends, isn't at all); LocalFileSystem flushes all of them with
+        a single syncfs(2) call per underlying device where that's available.
+        """
+        for f in files:
+            f._sync()
 
 
 class MountPoint(object):
@@ -550,6 +643,49 @@ class BaseFile(object):
         """
         raise NotImplementedError
     
+    @property
+    def stat(self):
+        """
+        A :obj:`FileStat` describing this file, or None if it doesn't exist.
+        Like :obj:`type`, this doesn't follow symbolic links.
+        
+        The default implementation is built out of self.type and self.size, so
+        only the type and size fields are filled in. Subclasses that can fetch
+        all of a file's metadata in one go (File does so with a single lstat,
+        SSHFile with a single SFTP lstat request) override this.
+        """
+        file_type = self.type
+        if file_type is None:
+            return None
+        return FileStat(file_type, self.size if file_type is FILE else 0)
+    
+    @property
+    def _cached_stat(self):
+        # Same as stat, but backends can return what they already know about
+        # this file (from the listing it came from, say) instead of asking
+        # again. Used by things that walk whole trees, where that saves a
+        # request per file.
+        return self.stat
+    
+    @property
+    def validator(self):
+        """
+        A string that changes whenever the contents of this file change, or
+        None if this file doesn't exist or the backend can't provide such a
+        thing. Caches (see :obj:`fileutils.cache.FileCache`) compare
+        validators to decide whether a copy of a file made earlier is still
+        up to date.
+        
+        The default implementation combines the file's size and modification
+        time from self.stat, and returns None on backends that don't expose
+        modification times. URL uses the ETag or Last-Modified header sent by
+        the server instead.
+        """
+        s = self.stat
+        if s is None or s.mtime_ns is None:
+            return None
+        return "{0}:{1}".format(s.size, s.mtime_ns)
+    
     @property
     def link_target(self):
         """
@@ -680,7 +816,7 @@ class BaseFile(object):
             raise generate(exceptions.FileNotFoundError, self)
     
     def copy_to(self, other, overwrite=False, dereference_links=True,
-                which_attributes={}):
+                which_attributes={}, progress=None, limiter=None):
         """
         Copies the contents and attributes of this file or directory to the
         specified file. An exception will be thrown if the specified file
@@ -694,33 +830,65 @@ class BaseFile(object):
         
         which_attributes is a dictionary indicating which attributes are to be
         copied, in the same format as that given to :obj:`copy_attributes_to`\ .
-        """
+        
+        progress, if given, is a :obj:`fileutils.transfer.Progress` to report
+        the copy's progress to, and limiter a
+        :obj:`fileutils.transfer.TokenBucket` limiting the rate at which data
+        is copied (on top of the rate_limiter of either file's filesystem).
+        """
+        from fileutils import transfer
+        limiters = transfer._limiters(limiter, self, other)
+        _start_transfer(self, progress, dereference_links)
+        try:
+            self._copy_to(other, overwrite, dereference_links,
+                          which_attributes, progress, limiters)
+        finally:
+            if progress is not None:
+                progress._finish()
+    
+    def _copy_to(self, other, overwrite, dereference_links, which_attributes,
+                 progress, limiters):
+        from fileutils.transfer import _copy_stream
         # If self.is_folder is True, requires isinstance(self, Listable) and
         # isinstance(other, Hierarchy) when we implement support for folders.
         # Requires isinstance(other, Writable) always.
         
-        # TODO: Use (and catch or pass on) proper exceptions here, EAFP style
-        if other.exists:
-            if overwrite:
-                other.delete()
-            else:
-                raise generate(exceptions.FileExistsError, other)
-        if dereference_links:
-            source = self.dereference(True)
-        else:
-            source = self
+        # Rather than checking whether other exists beforehand (and what
+        # it is, so that it can be deleted), we just go ahead and create it,
+        # and only delete whatever's in the way if the backend tells us
+        # there's something there. On remote filesystems this saves several
+        # round trips per file copied.
+        def create(function, *args, **kwargs):
+            try:
+                return function(*args, **kwargs)
+            except exceptions.FileExistsError:
+                if not overwrite:
+                    raise
+            other.delete()
+            return function(*args, **kwargs)
+        
+        source = self
         file_type = source.type
+        if dereference_links and file_type is LINK:
+            source = self.dereference(True)
+            file_type = source.type
         if file_type is FILE:
-            with other.open_for_writing() as write_to:
-                for block in self.read_blocks():
-                    write_to.write(block)
+            with source.open_for_reading() as read_from:
+                with create(_open_exclusively, other) as write_to:
+                    _copy_stream(read_from, write_to, self._default_block_size,
+                                 limiters, progress)
+                    which_attributes = source._copy_stream_attributes(
+                        read_from, other, write_to, which_attributes)
+            if progress is not None:
+                progress._file_done()
         elif file_type is FOLDER:
-            other.create_folder()
+            create(other.create_folder)
             for child in self.children:
-                child.copy_into(other, dereference_links=dereference_links,
-                                which_attributes=which_attributes)
+                child._copy_to(other.child(child.name), False,
+                               dereference_links, which_attributes, progress,
+                               limiters)
         elif file_type is LINK:
-            other.link_to(self.link_target)
+            create(other.link_to, self.link_target)
         elif file_type is None:
             # TODO: This will happen when we're dereferencing links and we
             # find one that doesn't exist. Should we just ignore such a
@@ -732,7 +900,7 @@ class BaseFile(object):
         source.copy_attributes_to(other, which_attributes=which_attributes)
 
     def copy_into(self, other, overwrite=False, dereference_links=True,
-                  which_attributes={}):
+                  which_attributes={}, progress=None, limiter=None):
         """
         Copies this file to an identically named file inside the specified
         folder. This is just shorthand for self.copy_to(other.child(self.name))
@@ -742,14 +910,16 @@ class BaseFile(object):
         The newly-created file in the specified folder will be returned as per
         other.child(self.name).
         
-        overwrite, dereference_links, and which_attributes have the same
-        meanings as their respective arguments given to copy_to.
+        overwrite, dereference_links, which_attributes, progress and limiter
+        have the same meanings as their respective arguments given to copy_to.
         """
         new_file = other.child(self.name)
-        self.copy_to(new_file, overwrite, dereference_links, which_attributes)
+        self.copy_to(new_file, overwrite, dereference_links, which_attributes,
+                     progress, limiter)
         return new_file
     
-    def merge_to(self, other, dereference_links=True, which_attributes={}):
+    def merge_to(self, other, dereference_links=True, which_attributes={},
+                 progress=None, limiter=None):
         """
         Merges this directory (or file) into the specified directory.
         Specifically:
@@ -762,7 +932,21 @@ class BaseFile(object):
          * Otherwise, the children of self are recursively merged into other as
            if by c.merge_to(other.child(c.name)), for every child c in
            self.children.
+        
+        progress and limiter have the same meanings as they do for copy_to.
         """
+        from fileutils import transfer
+        limiters = transfer._limiters(limiter, self, other)
+        _start_transfer(self, progress, dereference_links)
+        try:
+            self._merge_to(other, dereference_links, which_attributes,
+                           progress, limiters)
+        finally:
+            if progress is not None:
+                progress._finish()
+    
+    def _merge_to(self, other, dereference_links, which_attributes, progress,
+                  limiters):
         # Dereference ourselves if dereference_links is True
         if dereference_links:
             source = self.dereference(True)
@@ -770,21 +954,89 @@ class BaseFile(object):
             source = self
         other_type = other.type
         if other_type is None: # other doesn't exist, so just copy
-            source.copy_to(other, dereference_links=dereference_links,
-                           which_attributes=which_attributes)
+            source._copy_to(other, False, dereference_links,
+                            which_attributes, progress, limiters)
             return
         source_type = source.type
         if source_type != FOLDER or other_type != FOLDER:
             # One of them's something other than a folder, so just copy
-            source.copy_to(other, overwrite=True,
-                           dereference_links=dereference_links,
-                           which_attributes=which_attributes)
+            source._copy_to(other, True, dereference_links, which_attributes,
+                            progress, limiters)
             return
         
         # Both are folders that exist, so recursively merge each of our
         # children into other.
         for c in source.children:
-            c.merge_to(other.child(c.name))
+            c._merge_to(other.child(c.name), dereference_links,
+                        which_attributes, progress, limiters)
+
+    def zip_into(self, target, contents=True, compression=None, level=6,
+                 workers=None, dereference_links=True):
+        """
+        Creates a zip archive of this folder (or file) and writes it to the
+        specified file, which can be any BaseFile, including ones like SSHFile
+        whose write streams can't seek.
+        
+        If contents is True (the default), the files (and folders, and so on
+        recursively) contained within this folder will be written directly to
+        the zip file. If it's False, the folder will be written itself. The
+        difference is that, given a folder foo which looks like this::
+        
+            foo/
+                bar
+                baz/
+                    qux
+        
+        Specifying contents=False will result in a zip file whose contents look
+        something like::
+        
+            zipfile.zip/
+                foo/
+                    bar
+                    baz/
+                        qux
+        
+        Whereas specifying contents=True will result in this::
+        
+            zipfile.zip/
+                bar
+                baz/
+                    qux
+        
+        compression is one of the ZIP_* constants from :obj:`fileutils.zip`
+        and defaults to ZIP_DEFLATED; level is the compression level. Members
+        are compressed by a pool of worker threads, workers of them (one per
+        CPU by default). See :obj:`ZipWriter <fileutils.zip.ZipWriter>` for
+        the details.
+        """
+        from fileutils.zip import ZipWriter, ZIP_DEFLATED
+        if compression is None:
+            compression = ZIP_DEFLATED
+        with target.open_for_writing() as stream:
+            with ZipWriter(stream, compression, level, workers) as writer:
+                if self.is_folder and contents:
+                    writer.add_tree(self, dereference_links=dereference_links)
+                else:
+                    writer.add_tree(self, self.name,
+                                    dereference_links=dereference_links)
+
+    def unzip_into(self, folder, workers=None):
+        """
+        Unzips the zip file referred to by self into the specified folder,
+        which will be automatically created if it does not yet exist. The
+        folder can be on a different backend than self; members are streamed
+        straight into it.
+        
+        Member names are checked with folder.safe_child, so an archive
+        containing absolute paths or paths that use ".." to escape the folder
+        is rejected with a ValueError before anything is written. Members are
+        decompressed concurrently by workers threads (one per CPU by default).
+        See :obj:`fileutils.zip.extract` for the details.
+        
+        The return value of this function is folder.
+        """
+        from fileutils.zip import extract
+        return extract(self, folder, workers)
 
     def dereference(self, recursive=False):
         """
@@ -808,7 +1060,8 @@ class BaseFile(object):
         else:
             return target
 
-    def hash(self, algorithm=hashlib.md5, return_hex=True):
+    def hash(self, algorithm=hashlib.md5, return_hex=True, progress=None,
+             limiter=None):
         """
         Compute the hash of this file and return it, as a hexidecimal string.
         
@@ -819,15 +1072,26 @@ class BaseFile(object):
         If return_hex is False (it defaults to True), the hash object itself
         will be returned instead of the return value of its hexdigest() method.
         One can use this to access the binary hash instead.
+        
+        progress and limiter have the same meanings as they do for copy_to.
         """
         hasher = algorithm()
-        for block in self.read_blocks():
-            hasher.update(block)
+        _start_transfer(self, progress, True)
+        try:
+            for block in self.read_blocks(limiter=limiter):
+                hasher.update(block)
+                if progress is not None:
+                    progress._add(len(block))
+            if progress is not None:
+                progress._file_done()
+        finally:
+            if progress is not None:
+                progress._finish()
         if return_hex:
             hasher = hasher.hexdigest()
         return hasher
     
-    def read_blocks(self, block_size=None):
+    def read_blocks(self, block_size=None, limiter=None):
         """
         A generator that yields successive blocks of data from this file. Each
         block will be no larger than block_size bytes, which defaults to 16384.
@@ -839,12 +1103,17 @@ class BaseFile(object):
             with target.open("wb") as target_stream:
                 for block in source.read_blocks():
                     target_stream.write(block)
+        
+        limiter has the same meaning as it does for copy_to.
         """
+        from fileutils import transfer
+        limiters = transfer._limiters(limiter, self)
         if block_size is None:
             block_size = self._default_block_size
         with self.open_for_reading() as f:
             data = f.read(block_size)
             while data:
+                transfer._limit(limiters, len(data))
                 yield data
                 data = f.read(block_size)
 
@@ -908,6 +1177,23 @@ class BaseFile(object):
                 for f in child.recurse(filter, True, recurse_skipped):
                     yield f
 
+    def snapshot_tree(self, filter=None):
+        """
+        Capture the metadata of every file and folder beneath this one and
+        return it as a :obj:`Snapshot <fileutils.snapshot.Snapshot>`. Two
+        snapshots of the same tree taken at different times can be compared
+        with :obj:`fileutils.snapshot.diff` to find out what changed in
+        between.
+
+        The tree is walked with self.recurse, so this works for any backend
+        that implements children and :obj:`stat`. Symbolic links are recorded
+        but never followed. If filter is specified, it's called with each file
+        and folder and can return SKIP (or False) to leave the file and its
+        children out of the snapshot.
+        """
+        from fileutils.snapshot import Snapshot
+        return Snapshot.of(self, filter)
+
     def change_to(self):
         """
         Sets the current working directory to self.
@@ -997,7 +1283,7 @@ class BaseFile(object):
         """
         raise NotImplementedError
     
-    def open_for_writing(self, append=False):
+    def open_for_writing(self, append=False, exclusive=False):
         """
         Open this file for reading in binary mode and return a Python file-like
         object from which this file's contents can be read.
@@ -1007,6 +1293,11 @@ class BaseFile(object):
         is True, the file's contents will not be erased, and the returned
         stream will be positioned at the end of the file.
         
+        If exclusive is True, the file must not already exist; if it does,
+        FileExistsError will be raised instead. This is checked by the backend
+        as part of opening the file (like O_EXCL), so it doesn't cost an extra
+        request.
+        
         Note that some implementations (e.g. SMBFile and FTPFile) don't have
         native support for writing files remotely; support in such
         implementations can be emulated by returning a wrapper around a
@@ -1023,6 +1314,21 @@ class BaseFile(object):
         """
         with self.open_for_writing(append=True) as f:
             f.write(data)
+    
+    def _sync_stream(self, stream):
+        # Flush data written to stream (which was returned from our
+        # open_for_writing) to stable storage, if our backend can
+        pass
+    
+    def _sync(self):
+        # Flush this file or folder to stable storage, if our backend can
+        pass
+    
+    def _rename_over(self, other):
+        # Rename this file to other, replacing other if it exists. Backends
+        # that can do this atomically should override this.
+        other.delete(ignore_missing=True)
+        self.rename_to(other)
 
     def mkdir(self, silent=False):
         """
@@ -1054,22 +1360,8 @@ class BaseFile(object):
                 return f
             except exceptions.FileExistsError:
                 continue
-            except IOError:
-                # Really ugly hack: SFTP v3 (and hence Paramiko) doesn't have
-                # any support for indicating that a mkdir failed because the
-                # directory in question already exists, so we assume that any
-                # failure is because the directory already exists. There's not
-                # much wrong with this approach other than taking an inordinate
-                # amount of time to fail when the real issue is, say, related
-                # to permissions, and annoyingly breaking encapsulation in
-                # quite a glaring manner.
-                from fileutils.ssh import SSHFile
-                if isinstance(self, SSHFile):
-                    continue
-                else:
-                    raise
 
-    def write(self, data, binary=True):
+    def write(self, data, binary=True, atomic=False):
         """
         Overwrite this file with the specified data. After this is called,
         self.size will be equal to len(data), and self.read() will be equal to
@@ -1077,10 +1369,81 @@ class BaseFile(object):
         
         If binary is True (the default), the file will be written
         byte-for-byte. If it's False, the file will be written in text mode. 
+        
+        If atomic is True, the file is written as if by
+        :obj:`atomic_writer`, so that a crash partway through leaves either
+        its old contents or its new ones and never anything in between.
+        atomic can also be a :obj:`GroupCommit <fileutils.atomic.GroupCommit>`,
+        in which case the file is written as part of that group.
         """
-        with open(self.path, "wb") as f:
-            f.write(data)
-    
+        if atomic:
+            group = None if atomic is True else atomic
+            with self.atomic_writer(group) as f:
+                f.write(data)
+        else:
+            with self.open_for_writing() as f:
+                f.write(data)
+    
+    def atomic_writer(self, group=None):
+        """
+        Return a context manager for replacing this file's contents
+        atomically. Its __enter__ returns a stream to which the new contents
+        should be written::
+        
+            with f.atomic_writer() as stream:
+                stream.write(...)
+        
+        The stream actually writes to a temporary file next to this one.
+        When the with statement finishes, the temporary file is flushed to
+        stable storage and renamed over this file (with rename(2) semantics
+        on backends that support them, such as local files and SFTP servers
+        that implement posix-rename@openssh.com), so that readers and crashes
+        only ever see the old contents or the new ones. If the with statement
+        raises an exception, the temporary file is deleted and this file is
+        left alone.
+        
+        The temporary file is given this file's permissions (and, for local
+        files, its owner and group, where the current user is allowed to set
+        them) before anything is written to it. If this file is a symbolic
+        link, the file it points to is replaced instead, leaving the link in
+        place.
+        
+        Flushing costs an fsync per file; when writing lots of files, pass a
+        :obj:`GroupCommit <fileutils.atomic.GroupCommit>` as group to flush
+        and rename them all at once when the group commits instead.
+        """
+        from fileutils.atomic import AtomicWriter
+        return AtomicWriter(self, group)
+
+    def directory_writer(self, workers=None):
+        """
+        Return a :obj:`DirectoryWriter <fileutils.bulk.DirectoryWriter>` for
+        writing lots of files into this folder (which is created if it doesn't
+        exist) and its subfolders. workers is the number of threads that the
+        writer's write_many spreads writes across.
+
+        Backends override this to return writers that make use of their
+        native capabilities; local files are written relative to open folder
+        descriptors, for example, and SSHFile writes over several SFTP
+        sessions at once.
+        """
+        from fileutils.bulk import DirectoryWriter
+        return DirectoryWriter(self, workers)
+
+    def write_many(self, items, workers=None):
+        """
+        Write each of the specified (path, data) pairs to a file inside this
+        folder, creating subfolders as needed. Paths are relative to this
+        folder and can be strings using "/" as their separator or sequences of
+        names.
+
+        This is shorthand for writing items with a
+        :obj:`directory_writer`, and is much faster than calling write on
+        each file in turn when there are lots of them.
+        """
+        with self.directory_writer(workers) as writer:
+            writer.write_many(items)
+
     def rename_to(self, other):
         """
         Rename this file or folder to the specified name, which should be
@@ -1161,33 +1524,136 @@ class BaseFile(object):
         
         so take it as purely an example.)
         """
-        default_spec = which_attributes.get(None)
         for attribute_set in self.attributes.keys():
             if attribute_set in other.attributes:
                 ours = self.attributes[attribute_set]
                 theirs = other.attributes[attribute_set]
-                # Try an attribute set specific spec first
-                try:
-                    spec = which_attributes[attribute_set]
-                except KeyError:
-                    # Wasn't specified for this particular attribute set, so
-                    # use the default if one was specified
-                    if default_spec is not None:
-                        spec = default_spec
-                    else:
-                        # Default wasn't specified, so use the attribute set's
-                        # default copying policy. TODO: Consider changing this
-                        # to only copy if both ours.copy_by_default and
-                        # theirs.copy_by_default are True; this would allow
-                        # certain targets to specifically request that they not
-                        # be copied to by default.
-                        spec = ours.copy_by_default
+                spec = _copy_spec(which_attributes, attribute_set, ours)
                 if spec is True:
                     ours.copy_to(theirs)
                 elif spec is False:
                     pass
                 else:
                     spec(ours, theirs)
+    
+    def _transfer_totals(self, dereference_links):
+        # The number of files, and of bytes, that copying this file (and
+        # everything in it) would transfer. Backends whose listings come with
+        # each child's stat (see SSHFile.children) make this cost one request
+        # per folder.
+        totals = [0, 0]
+        def count(f):
+            s = f._cached_stat
+            if s is not None and s.type is LINK:
+                if not dereference_links:
+                    # The copy recreates the link without looking inside it,
+                    # so don't either: it could point back up the tree
+                    return SKIP
+                s = f.dereference(True).stat
+            if s is not None and s.type is FILE:
+                totals[0] += 1
+                totals[1] += s.size or 0
+            return True
+        for _ in self.recurse(count):
+            pass
+        return tuple(totals)
+    
+    def _copy_stream_attributes(self, stream, other, other_stream,
+                                which_attributes):
+        # Copy the attribute sets that can be copied through streams open on
+        # self and other (see AttributeSet.for_stream), and return a new
+        # which_attributes telling copy_attributes_to to skip them
+        copied = {}
+        for attribute_set, ours in self.attributes.items():
+            theirs = other.attributes.get(attribute_set)
+            if (theirs is None or
+                    _copy_spec(which_attributes, attribute_set, ours)
+                    is not True):
+                continue
+            ours = ours.for_stream(stream)
+            theirs = theirs.for_stream(other_stream)
+            if ours is not None and theirs is not None:
+                ours.copy_to(theirs)
+                copied[attribute_set] = False
+        if not copied:
+            return which_attributes
+        result = dict(which_attributes)
+        result.update(copied)
+        return result
+    
+    def chmod_tree(self, files_mode=None, dirs_mode=None, workers=None):
+        """
+        Set the POSIX permissions of every file within this folder to
+        files_mode and of every folder within it (including this folder
+        itself) to dirs_mode, like a recursive chmod. Either can be None to
+        leave files or folders alone. Symbolic links are neither changed nor
+        followed, and files whose backends don't support POSIX permissions
+        are skipped.
+        
+        The work is spread across workers threads (one per CPU by default).
+        Local files override this to change permissions relative to open folder
+        descriptors without looking anything up twice, which makes it much
+        faster than walking the tree and setting each file's mode in turn.
+        """
+        from fileutils.attributes import PosixPermissions
+        from fileutils.parallel import ordered_map
+        def chmod(f):
+            file_type = f.type
+            if file_type is FOLDER:
+                mode = dirs_mode
+            elif file_type is FILE:
+                mode = files_mode
+            else:
+                return
+            permissions = f.attributes.get(PosixPermissions)
+            if mode is not None and permissions is not None:
+                permissions.mode = mode
+        def skip_links(f):
+            return SKIP if f.is_link else True
+        for _ in ordered_map(chmod, self.recurse(skip_links), workers):
+            pass
+
+
+def _open_exclusively(f):
+    # Same as f.open_for_writing(exclusive=True), but for backends whose
+    # open_for_writing predates exclusive, check that f doesn't exist first
+    # instead. That isn't atomic, but it's what they got before.
+    try:
+        return f.open_for_writing(exclusive=True)
+    except TypeError as e:
+        if "exclusive" not in str(e):
+            raise
+    if f.type is not None:
+        raise generate(exceptions.FileExistsError, f)
+    return f.open_for_writing()
+
+
+def _start_transfer(source, progress, dereference_links):
+    # Tell progress, if given, how much copying (or reading) source is going
+    # to transfer
+    if progress is not None:
+        progress._start(*source._transfer_totals(dereference_links))
+
+
+def _copy_spec(which_attributes, attribute_set, ours):
+    # How attribute_set (whose instance on the source file is ours) should be
+    # copied, according to a which_attributes dictionary as given to
+    # BaseFile.copy_attributes_to. Try an attribute set specific spec first.
+    try:
+        return which_attributes[attribute_set]
+    except KeyError:
+        pass
+    # Wasn't specified for this particular attribute set, so use the default
+    # if one was specified
+    default_spec = which_attributes.get(None)
+    if default_spec is not None:
+        return default_spec
+    # Default wasn't specified, so use the attribute set's default copying
+    # policy. TODO: Consider changing this to only copy if both
+    # ours.copy_by_default and theirs.copy_by_default are True; this would
+    # allow certain targets to specifically request that they not be copied
+    # to by default.
+    return ours.copy_by_default
 
 
 class _AsWorking(object):
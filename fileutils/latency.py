@@ -0,0 +1,114 @@
+"""
+Simulated network latency and bandwidth for any backend.
+
+A :obj:`LatencyFileSystem` wraps a folder on any backend, usually a local
+one, and makes each operation on it take as long as it would over a slow
+link: every round trip (each stat, listing, open, read, write and so on)
+waits out a fixed latency, with optional random jitter, and the data read
+and written is squeezed through a bandwidth cap::
+
+    slow = LatencyFileSystem(File("/tmp/data"), latency=0.08,
+                             bandwidth=2 * 2**20)
+    slow.root.copy_to(File("/tmp/copy"))  # As if over an 80ms, 2 MB/s link
+
+This makes it possible to see how copy_to, recurse, merge_to and friends
+scale with round-trip time, and how much parallel and pipelined transfers
+help, without a real WAN link to hand.
+"""
+
+from fileutils.wrapper import WrapperFileSystem
+from fileutils.transfer import TokenBucket
+import threading
+import random
+import time
+
+__all__ = ["LatencyFileSystem"]
+
+# The operations that cost a round trip each. Everything else (copy_to,
+# recurse and so on) is made up of these.
+ROUND_TRIPS = frozenset(["type", "stat", "link_target", "size", "child_names",
+                         "open_for_reading", "open_for_writing",
+                         "create_folder", "delete", "link_to", "rename_to",
+                         "rename_over", "stream.read", "stream.readline",
+                         "stream.write", "stream.close"])
+
+
+class LatencyFileSystem(WrapperFileSystem):
+    """
+    A :obj:`WrapperFileSystem <fileutils.wrapper.WrapperFileSystem>` that
+    delays each round trip to the wrapped folder.
+
+    latency is the number of seconds each round trip takes, on top of
+    however long the wrapped backend takes. latencies can be a dictionary
+    mapping the names of particular operations (those in ROUND_TRIPS) to
+    latencies of their own; {"stream.write": 0} simulates a backend that
+    pipelines writes, for example.
+
+    jitter adds a random amount of up to that many seconds to, or takes it
+    away from, each delay. seed seeds the random number generator used for
+    this, so that runs can be repeated exactly.
+
+    bandwidth, if given, caps the rate, in bytes per second, at which data
+    is read from and written to all of this filesystem's files put together,
+    as a shared network link would; reads and writes running at the same
+    time share it between them. Each round trip's latency is waited out on
+    the thread that made it, so concurrent operations overlap their waits
+    the way they would over a real link.
+    """
+    def __init__(self, wrapped, latency=0.05, jitter=0.0, bandwidth=None,
+                 latencies=None, seed=None):
+        WrapperFileSystem.__init__(self, wrapped)
+        self.latency = latency
+        self.jitter = jitter
+        self.latencies = dict(latencies or {})
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._bandwidth = None
+        if bandwidth is not None:
+            # Bursts of a few milliseconds' worth, so that the cap holds over
+            # short transfers too
+            self._bandwidth = TokenBucket(bandwidth, max(bandwidth / 100.0,
+                                                         1))
+
+    @property
+    def bandwidth(self):
+        """
+        The bandwidth cap, in bytes per second, or None if there isn't one.
+        """
+        if self._bandwidth is None:
+            return None
+        return self._bandwidth.rate
+
+    def delay(self, operation):
+        """
+        Return the number of seconds that a round trip for the specified
+        operation should be delayed by: its latency plus or minus a random
+        amount of jitter, but never less than zero.
+        """
+        delay = self.latencies.get(operation, self.latency)
+        if self.jitter:
+            with self._random_lock:
+                delay += self._random.uniform(-self.jitter, self.jitter)
+        return max(delay, 0.0)
+
+    def _call(self, f, operation, details, function, *args):
+        if operation not in ROUND_TRIPS:
+            return function(*args)
+        delay = self.delay(operation)
+        if delay:
+            time.sleep(delay)
+        if self._bandwidth is not None and operation == "stream.write":
+            self._bandwidth.consume(details["size"])
+        result = function(*args)
+        if self._bandwidth is not None and operation in ("stream.read",
+                                                         "stream.readline"):
+            self._bandwidth.consume(len(result))
+        return result
+
+    def __repr__(self):
+        return "<fileutils.LatencyFileSystem of {0!r}: {1:g}s{2}>".format(
+            self._wrapped, self.latency,
+            "" if self._bandwidth is None else
+            ", {0:g} bytes/s".format(self._bandwidth.rate))
+
+    __str__ = __repr__
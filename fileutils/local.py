@@ -1,39 +1,40 @@
 from __future__ import print_function
-from fileutils.interface import BaseFile, FileSystem, MountPoint, DiskUsage, Usage
+from fileutils.interface import (BaseFile, FileSystem, MountPoint, DiskUsage,
+                                 Usage, FileStat)
 from fileutils.mixins import ChildrenMixin, DefaultMountDevice
 from fileutils.constants import FILE, FOLDER, LINK
 from fileutils.exceptions import Convert, generate
-from fileutils.attributes import ExtendedAttributes, PosixPermissions
+from fileutils.metrics import measure, wrap_stream
+from fileutils.attributes import (ExtendedAttributes, PosixPermissions,
+                                  Timestamps)
 from fileutils import exceptions
 import os.path
 import posixpath
 import ntpath
 import stat
-from contextlib import closing
-import zipfile as zip_module
-import glob as _glob
 import tempfile
 import atexit
-try:
-    from urllib import parse as urlparse
-    from urllib.request import pathname2url
-except ImportError:
-    import urlparse
-    from urllib import pathname2url
 import string
 import errno
-import subprocess
 import re
-import traceback
+import threading
 
-# I'm avoiding dependencies on pywin32 as long as possible... We'll see how
-# long I can turn out.
-import ctypes
+__all__ = ["LocalFileSystem", "PosixLocalFileSystem", "WindowsLocalFileSystem",
+           "LocalMountPoint", "PosixLocalMountPoint", "WindowsMountPoint",
+           "PosixLocalExtendedAttributes", "PosixLocalPermissions",
+           "LocalTimestamps", "LocalCache", "File", "PosixFile", "WindowsFile",
+           "LocalFile", "create_temporary_folder"]
 
-try:
-    import xattr
-except ImportError:
-    xattr = None
+# Python 3.3 added native extended attribute support (on Linux) in the form
+# of os.listxattr and family; elsewhere, fall back to the third-party xattr
+# module. Both accept either a path or a file descriptor.
+if hasattr(os, "listxattr"):
+    xattr = os
+else:
+    try:
+        import xattr
+    except ImportError:
+        xattr = None
 
 # Set of File objects whose delete_on_exit property has been set to True. These
 # are deleted by the atexit hook registered two lines down.
@@ -44,10 +45,50 @@ def _():
         try:
             f.delete(ignore_missing=True)
         except:
+            import traceback
             print("WARNING: Couldn't delete local file {0!r}:".format(f.path))
             traceback.print_exc()
 
 
+# Map of local paths of placeholders created by LocalFileSystem.cache(...,
+# lazy=True) to _LazyFile objects that know how to fetch their contents
+_lazy_files = {}
+_lazy_lock = threading.Lock()
+
+# libc's syncfs function, looked up on first use by _syncfs (and False if it
+# doesn't have one)
+_libc_syncfs = None
+
+# Whether os.open and os.mkdir can create things relative to an open folder
+_dir_fd_supported = (os.open in getattr(os, "supports_dir_fd", ()) and
+                     os.mkdir in getattr(os, "supports_dir_fd", ()))
+
+# Whether folders can be listed through a descriptor with os.scandir and
+# their children's modes changed relative to it with os.chmod (fchmodat)
+_chmod_at_supported = (getattr(os, "scandir", None) in
+                       getattr(os, "supports_fd", ()) and
+                       os.chmod in getattr(os, "supports_dir_fd", ()) and
+                       hasattr(os, "O_NOFOLLOW"))
+
+# Flags for opening folders, and files whose modes are being changed,
+# without following symbolic links
+_NOFOLLOW_FOLDER_FLAGS = (os.O_RDONLY | getattr(os, "O_DIRECTORY", 0) |
+                          getattr(os, "O_NOFOLLOW", 0) |
+                          getattr(os, "O_CLOEXEC", 0))
+_NOFOLLOW_FILE_FLAGS = (os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0) |
+                        getattr(os, "O_NONBLOCK", 0) |
+                        getattr(os, "O_NOCTTY", 0) |
+                        getattr(os, "O_CLOEXEC", 0))
+
+# Whether os.utime takes nanosecond timestamps (Python 3.3 and later), and
+# whether it can change them through a descriptor (futimens) and on symbolic
+# links themselves (utimensat with AT_SYMLINK_NOFOLLOW)
+_utime_ns_supported = getattr(os, "supports_fd", None) is not None
+_utime_fd_supported = os.utime in getattr(os, "supports_fd", ())
+_utime_nofollow_supported = (os.utime in
+                             getattr(os, "supports_follow_symlinks", ()))
+
+
 _local_file_system = None
 
 class LocalFileSystem(FileSystem):
@@ -66,7 +107,8 @@ class LocalFileSystem(FileSystem):
     def child(self, *path_components):
         return File(*path_components)
     
-    def cache(self, file_to_cache):
+    def cache(self, file_to_cache, store=None, lazy=False, prefetch=None,
+              workers=4):
         """
         Copy the specified file or directory (a BaseFile instance) onto the
         local machine in the system temporary directory and return a LocalCache
@@ -93,16 +135,73 @@ class LocalFileSystem(FileSystem):
         returned LocalCache instance as a context manager, if you so desire.
         (delete_on_exit will not, of course, be set to True if the file was
         already a local file.)
+        
+        If store is a :obj:`FileCache <fileutils.cache.FileCache>`, the copy
+        is kept in it instead of a temporary directory, and is reused by later
+        calls (from this process or any other using the same store) for as
+        long as the remote file hasn't changed. Such copies aren't deleted
+        when the block exits; the store evicts them as needed to stay within
+        its budget.
+        
+        If lazy is True, only the structure of the remote file or folder is
+        copied up front: folders are created, symbolic links are recreated as
+        links, and each file is created as an empty (sparse) placeholder of
+        the right size. A file's contents are fetched the first time it's
+        opened through a File instance (with open, open_for_reading, read,
+        read_blocks and so on), so working with a handful of files from a
+        large remote tree only costs the transfer of those files. Placeholders
+        opened by other means (another process, or the built-in open) just
+        read as zeros. Files opened only for writing aren't fetched at all.
+        
+        prefetch can be used with lazy to fetch files in the background
+        before they're asked for, using the specified number of worker
+        threads. It can be True to prefetch every file, in listing order, or
+        a function that's passed each remote file (a BaseFile) and returns
+        True if it should be prefetched. Background fetches stop when the
+        block exits.
         """
         if file_to_cache.filesystem == self:
             # Local file
             return LocalCache(None, file_to_cache)
+        elif lazy:
+            if store is not None:
+                raise ValueError("lazy can't be used with a store")
+            cache = create_temporary_folder(delete_on_exit=True)
+            location = cache.child(file_to_cache.name or "data")
+            entries = []
+            _create_skeleton(file_to_cache, location, entries)
+            return LocalCache(cache, location,
+                              lazy=_LazyTree(entries, prefetch, workers))
+        elif store is not None:
+            return store.get(file_to_cache)
         else:
             # Remote file
             cache = create_temporary_folder(delete_on_exit=True)
             location = file_to_cache.copy_into(cache)
             return LocalCache(cache, location)
     
+    def overlay(self, lower, upper=None):
+        """
+        Return the root of an :obj:`OverlayFileSystem
+        <fileutils.overlay.OverlayFileSystem>` layering the specified upper
+        folder over the specified lower folder (which can be any BaseFile
+        instance, such as an SSHFile or a URL).
+        
+        Files are only copied from the lower folder to the upper folder when
+        they're written to, so this allows a large remote tree to be worked
+        on as if it were local while paying the cost of transferring only the
+        files that are actually touched. Unmodified files are read straight
+        from the lower folder.
+        
+        If upper is None, a new temporary folder is created to serve as the
+        upper layer. Its delete_on_exit property is set to True, so it's
+        deleted on interpreter shutdown.
+        """
+        from fileutils.overlay import OverlayFileSystem
+        if upper is None:
+            upper = create_temporary_folder(delete_on_exit=True)
+        return OverlayFileSystem(lower, upper).root
+    
     @property
     def temporary_directory(self):
         return self.child(tempfile.gettempdir())
@@ -124,6 +223,29 @@ class PosixLocalFileSystem(LocalFileSystem):
     def roots(self):
         return [File("/")]
     
+    def sync(self, files):
+        """
+        Same as FileSystem.sync, but on Linux, this makes one syncfs(2) call
+        per device that the specified files are on instead of one fsync(2)
+        call per file.
+        """
+        devices = {}
+        for f in files:
+            with Convert(f.path):
+                with _measure("stat"):
+                    devices.setdefault(os.stat(f.path).st_dev, f)
+        for f in devices.values():
+            with Convert(f.path):
+                with _measure("open"):
+                    fd = os.open(f.path, os.O_RDONLY)
+                try:
+                    with _measure("sync"):
+                        synced = _syncfs(fd)
+                    if not synced:
+                        return LocalFileSystem.sync(self, files)
+                finally:
+                    os.close(fd)
+    
     @property
     def mountpoints(self):
         proc_mounts = File("/proc/self/mountinfo")
@@ -142,6 +264,9 @@ class PosixLocalFileSystem(LocalFileSystem):
 class WindowsLocalFileSystem(LocalFileSystem):
     @property
     def roots(self):
+        # I'm avoiding dependencies on pywin32 as long as possible... We'll
+        # see how long I can turn out.
+        import ctypes
         drives = []
         bitmask = ctypes.windll.kernel32.GetLogicalDrives() #@UndefinedVariable
         for letter in string.uppercase:
@@ -213,6 +338,7 @@ class PosixLocalMountPoint(LocalMountPoint):
         (among other things) force nonresponsive NFS mounts to unmount, as well
         as forcing mounts not listed in /etc/mtab to unmount.
         """
+        import subprocess
         command = ['umount', self.location.path]
         if force:
             command.append('-f')
@@ -239,17 +365,17 @@ _local_file_system = LocalFileSystem()
 
 
 class PosixLocalExtendedAttributes(ExtendedAttributes):
-    # Python 3.3 added native extended attribute support in the form of
-    # os.listxattr and family. When fileutils gains Python 3 compatibility, we
-    # should use os.listxattr and family if they exist.
-    def __init__(self, f):
+    def __init__(self, f, fd=None):
         self._file = f
         self._path = f.path
+        # Where to read and write attributes: a descriptor, if we were given
+        # one by for_stream, or our file's path
+        self._target = self._path if fd is None else fd
     
     def get(self, name):
         try:
-            return xattr.getxattr(self._path, name)
-        except IOError as e:
+            return xattr.getxattr(self._target, name)
+        except EnvironmentError as e:
             # TODO: See if this is different on other platforms, such as OS X
             if (e.errno == errno.ENODATA or e.errno == errno.EOPNOTSUPP
                     or e.errno == errno.ENOENT):
@@ -260,12 +386,12 @@ class PosixLocalExtendedAttributes(ExtendedAttributes):
     def set(self, name, value):
         # This can bail with EOPNOTSUPP if the user specifies attribute names
         # we don't like. Should we warn the user about this?
-        xattr.setxattr(self._path, name, value)
+        xattr.setxattr(self._target, name, value)
     
     def list(self):
         try:
-            return list(xattr.listxattr(self._path))
-        except IOError as e:
+            return list(xattr.listxattr(self._target))
+        except EnvironmentError as e:
             if e.errno == errno.EOPNOTSUPP or e.errno == errno.ENOENT: # No
                 # xattr support or the file doesn't exist
                 return []
@@ -274,14 +400,37 @@ class PosixLocalExtendedAttributes(ExtendedAttributes):
     
     def delete(self, name):
         try:
-            xattr.removexattr(self._path, name)
-        except IOError as e:
+            xattr.removexattr(self._target, name)
+        except EnvironmentError as e:
             if (e.errno == errno.ENODATA or e.errno == errno.EOPNOTSUPP
                     or e.errno == errno.ENOENT):
                 raise KeyError(name)
             else:
                 raise
     
+    def items(self):
+        if isinstance(self._target, int):
+            return ExtendedAttributes.items(self)
+        # Open the file once and read everything through the descriptor
+        # rather than looking the path up again for every attribute
+        try:
+            fd = os.open(self._path,
+                         os.O_RDONLY | getattr(os, "O_NONBLOCK", 0))
+        except EnvironmentError:
+            # Unreadable, or something like a socket; fall back to the path
+            return ExtendedAttributes.items(self)
+        try:
+            return PosixLocalExtendedAttributes(self._file, fd).items()
+        finally:
+            os.close(fd)
+    
+    def for_stream(self, stream):
+        try:
+            fd = stream.fileno()
+        except (AttributeError, EnvironmentError, ValueError):
+            return None
+        return PosixLocalExtendedAttributes(self._file, fd)
+    
     def __repr__(self):
         return "<PosixLocalExtendedAttributes for {0!r}>".format(self._file)
     
@@ -289,36 +438,103 @@ class PosixLocalExtendedAttributes(ExtendedAttributes):
 
 
 class PosixLocalPermissions(PosixPermissions):
-    def __init__(self, f):
+    def __init__(self, f, stream=None):
         self._file = f
+        # A stream open on our file, if we were created by for_stream
+        self._stream = stream
     
     @property
     def mode(self):
-        return os.stat(self._file.path).st_mode
+        with _measure("stat"):
+            if self._stream is not None:
+                return os.fstat(self._stream.fileno()).st_mode
+            return os.stat(self._file.path).st_mode
     
     @mode.setter
     def mode(self, value):
         # This is racy in the face of the underlying file being replaced with a
         # symlink, but, as Linux doesn't provide lchmod, I'm not sure there's
         # a better way to do this... Patches welcome.
-        if not self._file.is_link:
+        if self._stream is not None:
+            os.fchmod(self._stream.fileno(), value)
+        elif not self._file.is_link:
             os.chmod(self._file.path, value)
     
+    def for_stream(self, stream):
+        try:
+            stream.fileno()
+        except (AttributeError, EnvironmentError, ValueError):
+            return None
+        return PosixLocalPermissions(self._file, stream)
+    
     def __repr__(self):
         return "<PosixLocalPermissions for {0!r}>".format(self._file)
     
     __str__ = __repr__
 
 
+class LocalTimestamps(Timestamps):
+    def __init__(self, f, stream=None):
+        self._file = f
+        # A stream open on our file, if we were created by for_stream
+        self._stream = stream
+    
+    def get(self):
+        with _measure("stat"):
+            if self._stream is not None:
+                s = _file_stat(os.fstat(self._stream.fileno()))
+            else:
+                s = _file_stat(os.lstat(self._file.path))
+        return s.atime_ns, s.mtime_ns
+    
+    def set(self, atime_ns, mtime_ns):
+        path = self._file.path
+        if self._stream is not None:
+            # Write out anything still buffered first, as writing it later
+            # would update the modification time all over again
+            self._stream.flush()
+        if self._stream is not None and _utime_fd_supported:
+            os.utime(self._stream.fileno(), ns=(atime_ns, mtime_ns))
+        elif _utime_nofollow_supported:
+            os.utime(path, ns=(atime_ns, mtime_ns), follow_symlinks=False)
+        elif self._file.is_link:
+            # Same as PosixLocalPermissions: we'd end up changing the link's
+            # target instead, so leave it alone
+            pass
+        elif _utime_ns_supported:
+            os.utime(path, ns=(atime_ns, mtime_ns))
+        else:
+            os.utime(path, (atime_ns / 1e9, mtime_ns / 1e9))
+    
+    def for_stream(self, stream):
+        # Even without futimens, the stream saves looking the file up when
+        # reading its timestamps
+        try:
+            stream.fileno()
+        except (AttributeError, EnvironmentError, ValueError):
+            return None
+        return LocalTimestamps(self._file, stream)
+    
+    def __repr__(self):
+        return "<LocalTimestamps for {0!r}>".format(self._file)
+    
+    __str__ = __repr__
+
+
 class LocalCache(object):
     """
     An object representing a remote file that's been cached locally.
     These can be obtained from LocalFileSystem.cache(). See that method's
     docstring for more information.
     """
-    def __init__(self, cache, location):
+    def __init__(self, cache, location, lock=None, lazy=None):
         self._cache = cache
         self._location = location
+        # Held on copies handed out by a FileCache to keep them from being
+        # evicted while in use
+        self._lock = lock
+        # The _LazyTree tracking not-yet-fetched files, in lazy mode
+        self._lazy = lazy
     
     @property
     def location(self):
@@ -342,9 +558,13 @@ class LocalCache(object):
         return self.location
     
     def __exit__(self, *args):
+        if self._lazy:
+            self._lazy.close()
         if self._cache:
             self._cache.delete()
             self._cache.delete_on_exit = False
+        if self._lock:
+            self._lock.release()
 
 
 class File(ChildrenMixin, BaseFile):
@@ -406,7 +626,7 @@ class File(ChildrenMixin, BaseFile):
         path = self._resolve_path(path)
         self._path = path
         
-        self.attributes = {}
+        self.attributes = {Timestamps: LocalTimestamps(self)}
     
     @staticmethod
     def _resolve_path(path):
@@ -454,27 +674,40 @@ class File(ChildrenMixin, BaseFile):
     
     @property
     def url(self):
-        return urlparse.urljoin("file:", pathname2url(self._path))
+        # urllib.request takes a while to import on Python 3, so it's only
+        # imported here
+        try:
+            from urllib.parse import urljoin
+            from urllib.request import pathname2url
+        except ImportError:
+            from urlparse import urljoin
+            from urllib import pathname2url
+        return urljoin("file:", pathname2url(self._path))
 
     @property
     def child_names(self):
         if not self.is_folder:
             return
-        return sorted(os.listdir(self._path))
+        with _measure("list"):
+            return sorted(os.listdir(self._path))
     
     @property
     def type(self):
         try:
-            mode = os.lstat(self.path).st_mode
+            with _measure("stat"):
+                mode = os.lstat(self.path).st_mode
         except os.error: # File doesn't exist
             return None
-        if stat.S_ISREG(mode):
-            return FILE
-        if stat.S_ISDIR(mode):
-            return FOLDER
-        if stat.S_ISLNK(mode):
-            return LINK
-        return "fileutils.OTHER"
+        return _file_type(mode)
+    
+    @property
+    def stat(self):
+        try:
+            with _measure("stat"):
+                s = os.lstat(self._path)
+        except os.error:
+            return None
+        return _file_stat(s)
 
     @property
     def link_target(self):
@@ -485,7 +718,8 @@ class File(ChildrenMixin, BaseFile):
         """
         if not self.is_link:
             return None
-        return os.readlink(self._path)
+        with _measure("readlink"):
+            return os.readlink(self._path)
     
     def open_for_reading(self):
         # TODO: Consider wrapping with a stream that produces new-style
@@ -507,7 +741,8 @@ class File(ChildrenMixin, BaseFile):
         if self.is_folder:
             return sum(f.size for f in self.children)
         elif self.is_file:
-            return os.path.getsize(self.path)
+            with _measure("stat"):
+                return os.path.getsize(self.path)
         else: # Broken symbolic link or some other type of file
             return 0
 
@@ -536,37 +771,49 @@ class File(ChildrenMixin, BaseFile):
         False, an exception will be thrown. If recursive is True, the folder's
         parent, its parent's parent, and so on will be created automatically.
         """
-        # See if we're already a folder
-        if self.is_folder:
-            # We are. If ignore_existing is True, then just return.
-            if ignore_existing:
+        try:
+            with _measure("mkdir"), Convert():
+                os.mkdir(self._path)
+        except exceptions.FileExistsError:
+            if ignore_existing and self.is_folder:
                 return
-            # If it's not, raise an exception. TODO: EAFP
-            else:
-                raise generate(exceptions.FileExistsError, self)
-        else:
-            # We're not a folder. (We don't need to see if we already exist as
-            # e.g. a file as the call to os.mkdir will take care of raising an
-            # exception for us in such a case.) Now create our parent if it
-            # doesn't exist and recursive is True.
-            if recursive and self.parent and not self.parent.exists:
-                self.parent.create_folder(recursive=True)
-            # Now turn ourselves into a folder.
-            os.mkdir(self.path)
+            raise
+        except exceptions.FileNotFoundError:
+            # Our parent doesn't exist. Create it if we're allowed to, then
+            # try again.
+            parent = self.parent
+            if not recursive or parent is None:
+                raise
+            parent.create_folder(ignore_existing=True, recursive=True)
+            self.create_folder(ignore_existing=ignore_existing)
 
     def delete(self, contents=False, ignore_missing=False):
+        # Most things that get deleted are files, so try that first; we only
+        # need to look any closer if it fails.
+        try:
+            with _measure("remove"), Convert():
+                os.remove(self._path)
+            return
+        except exceptions.FileNotFoundError:
+            if ignore_missing:
+                return
+            raise
+        except EnvironmentError:
+            # Folders fail with EISDIR on Linux, EPERM on OS X and EACCES on
+            # Windows. Anything else is a genuine failure.
+            if not self.is_mount and (self.is_link or not self.is_folder):
+                raise
         # If it's a mount point, unmount it before trying to delete it
         while self.is_mount:
             self.mountpoint.unmount(force=True)
-        if not self.exists:
-            if not ignore_missing:
-                raise generate(exceptions.FileNotFoundError, self)
-        elif self.is_folder and not self.is_link:
+        if self.is_folder and not self.is_link:
             for child in self.children:
                 child.delete()
-            os.rmdir(self.path)
+            with _measure("remove"), Convert():
+                os.rmdir(self._path)
         else:
-            os.remove(self._path)
+            with _measure("remove"), Convert():
+                os.remove(self._path)
 
     def link_to(self, other):
         """
@@ -578,23 +825,63 @@ class File(ChildrenMixin, BaseFile):
         link will always be absolute.
         """
         if isinstance(other, File):
-            os.symlink(other.path, self._path)
-        else:
+            other = other.path
+        with _measure("symlink"), Convert():
             os.symlink(other, self._path)
     
-    def open_for_writing(self, append=False):
+    def open_for_writing(self, append=False, exclusive=False):
+        if exclusive:
+            # Python 2's open() doesn't support mode "x", so use O_EXCL
+            # ourselves
+            flags = (os.O_WRONLY | os.O_CREAT | os.O_EXCL |
+                     getattr(os, "O_BINARY", 0))
+            if append:
+                flags |= os.O_APPEND
+            with _measure("open"), Convert():
+                fd = os.open(self._path, flags, 0o666)
+            return wrap_stream(_local_file_system.metrics,
+                               os.fdopen(fd, "ab" if append else "wb"))
         if append:
             return self.open("ab")
         else:
             return self.open("wb")
     
     def open(self, *args, **kwargs):
-        with Convert():
-            return open(self._path, *args, **kwargs)
+        if _lazy_files:
+            _fetch_lazy(self._path, args[0] if args else kwargs.get("mode", "r"))
+        with _measure("open"), Convert():
+            stream = open(self._path, *args, **kwargs)
+        return wrap_stream(_local_file_system.metrics, stream)
+    
+    def _sync_stream(self, stream):
+        stream.flush()
+        with _measure("sync"), Convert(self._path):
+            os.fsync(stream.fileno())
+    
+    def _sync(self):
+        with Convert(self._path):
+            with _measure("open"):
+                fd = os.open(self._path, os.O_RDONLY)
+            try:
+                with _measure("sync"):
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+    
+    def _rename_over(self, other):
+        # os.rename replaces atomically on POSIX, but only os.replace does on
+        # Windows (and only on Python 3.3 and later)
+        replace = getattr(os, "replace", None)
+        if replace is None and os.name != "nt":
+            replace = os.rename
+        if replace is None or not isinstance(other, File):
+            return BaseFile._rename_over(self, other)
+        with _measure("rename"), Convert():
+            replace(self._path, other.path)
 
     def rename_to(self, other):
         if isinstance(other, File):
-            with Convert():
+            with _measure("rename"), Convert():
                 os.rename(self._path, other.path)
         else:
             BaseFile.rename_to(self, other)
@@ -605,68 +892,41 @@ class File(ChildrenMixin, BaseFile):
         matching files, as File objects. This is a thin wrapper around a call
         to Python's glob.glob function.
         """
+        import glob as _glob
         return [File(f) for f in _glob.glob(os.path.join(self.path, glob))]
     
-    def zip_into(self, filename, contents=True):
+    def zip_into(self, filename, contents=True, compression=None, level=6,
+                 workers=None, dereference_links=True):
         """
-        Creates a zip archive of this folder and writes it to the specified
-        filename, which can be either a pathname or a File object.
-        
-        If contents is True (the default), the files (and folders, and so on
-        recursively) contained within this folder will be written directly to
-        the zip file. If it's False, the folder will be written itself. The
-        difference is that, given a folder foo which looks like this::
-        
-            foo/
-                bar
-                baz/
-                    qux
-        
-        Specifying contents=False will result in a zip file whose contents look
-        something like::
-        
-            zipfile.zip/
-                foo/
-                    bar
-                    baz/
-                        qux
-        
-        Whereas specifying contents=True will result in this::
-        
-            zipfile.zip/
-                bar
-                baz/
-                    qux
-        
-        NOTE: This has only been tested on Linux. I still need to test it on
-        Windows to make sure pathnames are being handled correctly.
+        Same as BaseFile.zip_into, but filename can also be a local pathname.
         """
-        with closing(zip_module.ZipFile(File(filename).path, "w")) as zipfile:
-            for f in self.recurse():
-                if contents:
-                    path_in_zip = f.relative_path(self)
-                else:
-                    path_in_zip = f.relative_path(self.parent)
-                zipfile.write(f.path, path_in_zip)
+        if not isinstance(filename, BaseFile):
+            filename = File(filename)
+        BaseFile.zip_into(self, filename, contents, compression, level,
+                          workers, dereference_links)
         
-    def unzip_into(self, folder):
+    def unzip_into(self, folder, workers=None):
         """
-        Unzips the zip file referred to by self into the specified folder,
-        which will be automatically created (as if by File(folder).mkdirs())
-        if it does not yet exist.
+        Same as BaseFile.unzip_into, but folder can also be a local pathname.
         
-        NOTE: This is an unsafe operation! The same warning present on Python's
-        zipfile.ZipFile.extractall applies here, namely that a maliciously
-        crafted zip file could cause absolute filesystem paths to be
-        overwritten. I hope to hand-roll my own extraction code in the future
-        that will explicitly filter out absolute paths.
-        
-        The return value of this function is File(folder).
+        The return value of this function is File(folder) if folder was a
+        pathname, or folder itself otherwise.
+        """
+        if not isinstance(folder, BaseFile):
+            folder = File(folder)
+        return BaseFile.unzip_into(self, folder, workers)
+
+    def directory_writer(self, workers=None):
+        """
+        Same as BaseFile.directory_writer, but where the platform supports it
+        (Python 3.3 and later on POSIX systems), the writer holds the folders
+        it writes into open and creates files relative to them, instead of
+        by their full pathnames.
         """
-        folder = File(folder)
-        folder.mkdirs(silent=True)
-        with closing(zip_module.ZipFile(self._path, "r")) as zipfile:
-            zipfile.extractall(folder.path)
+        if not _dir_fd_supported:
+            return BaseFile.directory_writer(self, workers)
+        from fileutils.bulk import _LocalDirectoryWriter
+        return _LocalDirectoryWriter(self, workers)
 
     @property
     def delete_on_exit(self):
@@ -722,6 +982,21 @@ class PosixFile(File):
         if xattr:
             self.attributes[ExtendedAttributes] = PosixLocalExtendedAttributes(self)
     
+    def chmod_tree(self, files_mode=None, dirs_mode=None, workers=None):
+        """
+        Same as BaseFile.chmod_tree, but each folder is listed once, through
+        a descriptor, and the modes of its children are changed relative to
+        that descriptor (with fchmodat(2), on Python 3.7 and later), so that
+        nothing is looked up by its full path or statted more than once.
+
+        Links are never followed, even if a file or folder is swapped for one
+        while the tree is being walked: subfolders are opened with O_NOFOLLOW
+        relative to their parents' descriptors, and their modes changed
+        through the descriptors they were opened as.
+        """
+        if not self.is_link:
+            _chmod_tree(self._path, files_mode, dirs_mode, workers)
+    
     @staticmethod
     def _resolve_path(path):
         # Strip off double leading slashes
@@ -736,6 +1011,20 @@ class PosixFile(File):
 
 
 class WindowsFile(File):
+    def _sync(self):
+        # Windows can't open folders, and has no need to flush their entries
+        # anyway
+        if self.is_folder:
+            return
+        with Convert(self._path):
+            with _measure("open"):
+                fd = os.open(self._path, os.O_RDWR | os.O_BINARY)
+            try:
+                with _measure("sync"):
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+    
     @staticmethod
     def _resolve_path(path):
         # If it looks like a path with a drive letter that has leading slashes
@@ -756,6 +1045,319 @@ class WindowsFile(File):
 LocalFile = File
 
 
+def _measure(operation):
+    # LocalFileSystem is a singleton, so all local files record operations
+    # against its metrics
+    return measure(_local_file_system.metrics, operation)
+
+
+def _file_type(mode):
+    if stat.S_ISREG(mode):
+        return FILE
+    if stat.S_ISDIR(mode):
+        return FOLDER
+    if stat.S_ISLNK(mode):
+        return LINK
+    return "fileutils.OTHER"
+
+
+def _file_stat(s):
+    """
+    Convert an os.stat_result into a FileStat.
+    """
+    # st_mtime_ns and friends only exist on Python 3.3 and later
+    mtime_ns = getattr(s, "st_mtime_ns", None)
+    if mtime_ns is None:
+        mtime_ns = int(s.st_mtime * 1000000000)
+    atime_ns = getattr(s, "st_atime_ns", None)
+    if atime_ns is None:
+        atime_ns = int(s.st_atime * 1000000000)
+    return FileStat(_file_type(s.st_mode), s.st_size, mtime_ns, atime_ns,
+                    s.st_ino, s.st_mode)
+
+
+class _LazyFile(object):
+    def __init__(self, remote, path):
+        self.remote = remote
+        self.path = path
+        self.lock = threading.Lock()
+    
+    def fetch(self, contents=True):
+        # Fill in our placeholder (in place, so as to keep the attributes it
+        # was given), unless someone else already has, and unregister it
+        with self.lock:
+            with _lazy_lock:
+                if _lazy_files.get(self.path) is not self:
+                    return
+            if contents:
+                # Filling it in would otherwise leave it looking modified
+                timestamps = File(self.path).attributes[Timestamps]
+                times = timestamps.get()
+                # The placeholder was given the remote file's permissions,
+                # so make it writable while we fill it in if it isn't
+                mode = stat.S_IMODE(os.stat(self.path).st_mode)
+                if not mode & stat.S_IWUSR:
+                    os.chmod(self.path, mode | stat.S_IWUSR)
+                try:
+                    with open(self.path, "r+b") as f:
+                        for block in self.remote.read_blocks():
+                            f.write(block)
+                        f.truncate()
+                finally:
+                    if not mode & stat.S_IWUSR:
+                        os.chmod(self.path, mode)
+                timestamps.set(*times)
+            with _lazy_lock:
+                _lazy_files.pop(self.path, None)
+
+
+def _syncfs(fd):
+    # Call syncfs(2) on fd and return True, or return False if it isn't
+    # available (it's Linux-only, and not every libc wraps it)
+    global _libc_syncfs
+    import ctypes
+    if _libc_syncfs is None:
+        try:
+            _libc_syncfs = ctypes.CDLL(None, use_errno=True).syncfs
+        except (AttributeError, OSError, TypeError):
+            _libc_syncfs = False
+    if _libc_syncfs is False:
+        return False
+    if _libc_syncfs(fd) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+    return True
+
+
+def _chmod_tree(path, files_mode, dirs_mode, workers):
+    # Folders are handed out to a pool of threads, each of which changes the
+    # modes of a folder's children and queues up its subfolders for the
+    # other threads to pick up. Where possible, folders are queued as
+    # descriptors opened relative to their parents' without following links,
+    # so that a folder swapped for a link partway through can't lead the walk
+    # out of the tree.
+    try:
+        from queue import Queue
+    except ImportError: # Python 2
+        from Queue import Queue
+    from fileutils.parallel import default_workers
+    if workers is None:
+        workers = default_workers()
+    fd = None
+    with Convert(path):
+        if _chmod_at_supported:
+            fd = os.open(path, _NOFOLLOW_FOLDER_FLAGS)
+            if dirs_mode is not None:
+                os.fchmod(fd, dirs_mode)
+        elif dirs_mode is not None:
+            _chmod_nofollow(path, dirs_mode)
+    folders = Queue()
+    folders.put((path, fd))
+    errors = []
+    def work():
+        while True:
+            item = folders.get()
+            try:
+                if item is None:
+                    return
+                folder, fd = item
+                if not errors:
+                    for subfolder in _chmod_children(folder, fd, files_mode,
+                                                     dirs_mode):
+                        folders.put(subfolder)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                if item is not None and item[1] is not None:
+                    os.close(item[1])
+                folders.task_done()
+    threads = [threading.Thread(target=work) for _ in range(max(workers, 1))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    folders.join()
+    for thread in threads:
+        folders.put(None)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def _chmod_children(folder, fd, files_mode, dirs_mode):
+    # Change the modes of the children of folder (open as fd, if that isn't
+    # None) but not of their children, and return (path, descriptor) pairs
+    # for its subfolders, to be closed by the caller. Links are skipped.
+    subfolders = []
+    if fd is not None:
+        with Convert(folder):
+            entries = list(os.scandir(fd))
+        for entry in entries:
+            child = os.path.join(folder, entry.name)
+            if entry.is_symlink():
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                try:
+                    child_fd = os.open(entry.name, _NOFOLLOW_FOLDER_FLAGS,
+                                       dir_fd=fd)
+                except OSError as e:
+                    # Swapped for a link (or something else) since we listed
+                    # it, or gone
+                    if e.errno in (errno.ELOOP, errno.ENOTDIR, errno.ENOENT):
+                        continue
+                    raise exceptions.convert(e, child)
+                subfolders.append((child, child_fd))
+                if dirs_mode is not None:
+                    with Convert(child):
+                        os.fchmod(child_fd, dirs_mode)
+            elif entry.is_file(follow_symlinks=False):
+                if files_mode is not None:
+                    with Convert(child):
+                        _chmod_nofollow(entry.name, files_mode, fd)
+    else:
+        with Convert(folder):
+            names = os.listdir(folder)
+        for name in names:
+            child = os.path.join(folder, name)
+            with Convert(child):
+                child_mode = os.lstat(child).st_mode
+                if stat.S_ISDIR(child_mode):
+                    mode = dirs_mode
+                    subfolders.append((child, None))
+                elif stat.S_ISREG(child_mode):
+                    mode = files_mode
+                else:
+                    continue
+                if mode is not None:
+                    _chmod_nofollow(child, mode)
+    return subfolders
+
+
+def _chmod_nofollow(path, mode, dir_fd=None):
+    # Change the mode of path (relative to dir_fd, if given) without
+    # following it if it's been swapped for a symbolic link since it was
+    # looked at, in which case it's left alone
+    at = {} if dir_fd is None else {"dir_fd": dir_fd}
+    try:
+        if dir_fd is not None:
+            os.chmod(path, mode, dir_fd=dir_fd, follow_symlinks=False)
+            return
+        if hasattr(os, "lchmod"):
+            os.lchmod(path, mode)
+            return
+    except (ValueError, NotImplementedError):
+        # Python raises these when path is now a link, or when the C library
+        # can't change modes without following links at all
+        pass
+    except OSError as e:
+        if e.errno != errno.EOPNOTSUPP:
+            raise
+    # Otherwise, open it without following links and change it through the
+    # descriptor
+    try:
+        fd = os.open(path, _NOFOLLOW_FILE_FLAGS, **at)
+    except OSError as e:
+        if e.errno == errno.ELOOP:
+            return
+        if e.errno != errno.EACCES:
+            raise
+        # We can't read it, so it can't be opened without following links;
+        # this is the one case still open to a race
+        os.chmod(path, mode, **at)
+        return
+    try:
+        os.fchmod(fd, mode)
+    finally:
+        os.close(fd)
+
+
+def _fetch_lazy(path, mode):
+    # Placeholders are registered under their real paths, so that opening
+    # one through a symlink (to it, or to a folder above it) fetches it too
+    path = os.path.realpath(path)
+    with _lazy_lock:
+        entry = _lazy_files.get(path)
+    if entry is not None:
+        # Opening for writing truncates the file, so we only need to fetch
+        # its contents if it's being opened for reading or appending
+        entry.fetch(contents=("r" in mode or "a" in mode or "+" in mode))
+
+
+def _create_skeleton(remote, local, entries):
+    # Recreate remote's structure at local, appending _LazyFile objects for
+    # each placeholder created to entries
+    file_type = remote.type
+    if file_type is FOLDER:
+        local.create_folder()
+        for child in remote.children:
+            _create_skeleton(child, local.child(child.name), entries)
+    elif file_type is LINK:
+        local.link_to(remote.link_target)
+    elif file_type is FILE:
+        with open(local.path, "wb") as f:
+            f.truncate(remote.size)
+        entries.append(_LazyFile(remote, os.path.realpath(local.path)))
+    else:
+        raise generate(exceptions.FileNotFoundError, remote)
+    remote.copy_attributes_to(local)
+
+
+class _LazyTree(object):
+    """
+    Registers the placeholders of a lazily cached tree so that File.open
+    fetches them, and optionally prefetches them in the background.
+    """
+    def __init__(self, entries, prefetch, workers):
+        self._entries = entries
+        self._closed = False
+        with _lazy_lock:
+            for entry in entries:
+                _lazy_files[entry.path] = entry
+        if prefetch:
+            if prefetch is True:
+                queue = list(entries)
+            else:
+                queue = [entry for entry in entries if prefetch(entry.remote)]
+            # Workers pop from the end, so reverse to keep listing order
+            queue.reverse()
+            self._threads = [threading.Thread(target=self._prefetch,
+                                              args=(queue,))
+                             for _ in range(workers)]
+            for thread in self._threads:
+                thread.daemon = True
+                thread.start()
+        else:
+            self._threads = []
+    
+    def _prefetch(self, queue):
+        while not self._closed:
+            try:
+                entry = queue.pop()
+            except IndexError:
+                return
+            try:
+                entry.fetch()
+            except Exception:
+                # Leave it to be fetched (and the error reported) when it's
+                # actually opened
+                pass
+    
+    def wait(self):
+        """
+        Wait for background prefetching to finish.
+        """
+        for thread in self._threads:
+            thread.join()
+    
+    def close(self):
+        self._closed = True
+        self.wait()
+        with _lazy_lock:
+            for entry in self._entries:
+                if _lazy_files.get(entry.path) is entry:
+                    del _lazy_files[entry.path]
+
+
 def create_temporary_folder(suffix="", prefix="tmp", parent=None,
                             delete_on_exit=False):
     """
@@ -0,0 +1,626 @@
+"""
+An in-memory filesystem.
+
+MemoryFileSystem keeps an entire tree of files, folders and symbolic links in
+memory. It implements the same interface as the other backends, so it can be
+used anywhere a BaseFile is expected: as scratch space between two stages of
+a transfer, or in place of a temporary folder in tests::
+
+    root = MemoryFileSystem().root
+    remote.copy_to(root.child("staging"))
+    root.child("staging").copy_to(File("/srv/data"))
+
+Nothing is ever written to disk, and everything is lost once the last
+reference to the MemoryFileSystem goes away.
+"""
+
+from fileutils.interface import BaseFile, FileSystem, FileStat
+from fileutils.mixins import ChildrenMixin
+from fileutils.constants import FILE, FOLDER, LINK
+from fileutils.exceptions import generate
+from fileutils.attributes import (ExtendedAttributes, PosixPermissions,
+                                  Timestamps)
+from fileutils import exceptions
+import threading
+import posixpath
+import errno
+import stat
+import time
+import os
+
+__all__ = ["MemoryFileSystem", "MemoryFile"]
+
+try:
+    basestring
+except NameError: # Python 3
+    basestring = str
+
+# Same limit as Linux
+_MAX_LINK_DEPTH = 40
+
+
+def _now():
+    return int(time.time() * 1000000000)
+
+
+class _Node(object):
+    # A file, folder or symbolic link. Which fields are used depends on mode:
+    # data holds a file's contents (always an immutable bytes object, so that
+    # readers can share it without copying), children a folder's children by
+    # name, and target a link's target.
+    def __init__(self, mode, inode):
+        self.mode = mode
+        self.inode = inode
+        self.mtime_ns = self.atime_ns = _now()
+        self.xattrs = {}
+        self.data = b""
+        self.children = {}
+        self.target = None
+
+    @property
+    def type(self):
+        return _file_type(self.mode)
+
+
+class MemoryFileSystem(FileSystem):
+    """
+    A FileSystem whose files live entirely in memory.
+
+    If budget is given, it's the maximum number of bytes that files on this
+    filesystem may hold in total. Writes that would exceed it fail with an
+    IOError whose errno is ENOSPC, just like writes to a full disk, so
+    pipelines using a MemoryFileSystem as an intermediate stage can't run a
+    process out of memory. Only file contents count against the budget.
+
+    MemoryFileSystem instances are safe to use from multiple threads.
+    """
+    def __init__(self, budget=None):
+        self._lock = threading.RLock()
+        self._budget = budget
+        self._used = 0
+        self._next_inode = 1
+        self._root = self._new_node(stat.S_IFDIR | 0o755)
+
+    @property
+    def budget(self):
+        """
+        The maximum number of bytes this filesystem's files may hold, or None
+        if there's no limit.
+        """
+        return self._budget
+
+    @property
+    def used(self):
+        """
+        The number of bytes currently held by this filesystem's files,
+        including data written to streams that haven't been closed yet.
+        """
+        return self._used
+
+    def child(self, *path_components):
+        return MemoryFile(self, posixpath.join("/", *path_components))
+
+    @property
+    def roots(self):
+        return [MemoryFile(self, "/")]
+
+    @property
+    def temporary_directory(self):
+        temp = self.child("tmp")
+        temp.create_folder(ignore_existing=True)
+        return temp
+
+    def _new_node(self, mode):
+        with self._lock:
+            node = _Node(mode, self._next_inode)
+            self._next_inode += 1
+            return node
+
+    def _reserve(self, size, path):
+        # Account for size more bytes (or fewer, if negative) of file data
+        with self._lock:
+            if (size > 0 and self._budget is not None and
+                    self._used + size > self._budget):
+                raise IOError(errno.ENOSPC, os.strerror(errno.ENOSPC), path)
+            self._used += size
+
+    def _lookup(self, path, follow=True, depth=0):
+        # Return the node at the specified absolute path, or None if there
+        # isn't one. Links in the path's intermediate components are always
+        # followed; a link at the end is followed only if follow is True.
+        node = self._root
+        components = [c for c in path.split("/") if c]
+        current = "/"
+        for index, name in enumerate(components):
+            if node is None or node.type is not FOLDER:
+                return None
+            node = node.children.get(name)
+            current = posixpath.join(current, name)
+            last = index == len(components) - 1
+            if node is not None and node.type is LINK and (follow or not last):
+                if depth >= _MAX_LINK_DEPTH:
+                    raise OSError(errno.ELOOP, os.strerror(errno.ELOOP), path)
+                target = posixpath.join(posixpath.dirname(current),
+                                        node.target)
+                node = self._lookup(target, True, depth + 1)
+                current = posixpath.normpath(target)
+        return node
+
+    def _parent_of(self, path):
+        # Return the folder node that should contain the specified path and
+        # the name it should have in it, raising an appropriate exception if
+        # there's no such folder
+        parent_path, name = posixpath.split(path)
+        if not name:
+            raise generate(exceptions.FileExistsError, path)
+        parent = self._lookup(parent_path)
+        if parent is None:
+            raise generate(exceptions.FileNotFoundError, path)
+        if parent.type is not FOLDER:
+            raise generate(exceptions.NotADirectoryError, path)
+        return parent, name
+
+    def _tree_size(self, node):
+        if node.type is FOLDER:
+            return sum(self._tree_size(child)
+                       for child in node.children.values())
+        return len(node.data)
+
+    def __repr__(self):
+        return "<fileutils.MemoryFileSystem at {0:#x}>".format(id(self))
+
+    __str__ = __repr__
+
+
+class MemoryFile(ChildrenMixin, BaseFile):
+    """
+    A BaseFile implementation exposing a file on a :obj:`MemoryFileSystem`.
+
+    Instances are obtained from a MemoryFileSystem's root property or its
+    child method::
+
+        f = MemoryFileSystem().root.child("a", "b")
+
+    Streams returned by open_for_reading read a snapshot of the file's
+    contents as of the time they were opened, without copying them; see
+    open_for_writing for when writes become visible.
+    """
+    _default_block_size = 2**20 # 1 MB
+    _sep = "/"
+    attributes = None
+
+    def __init__(self, filesystem, path="/"):
+        self._filesystem = filesystem
+        self._path = posixpath.normpath(path)
+        while self._path.startswith("//"):
+            self._path = self._path[1:]
+        self.attributes = {
+            PosixPermissions: MemoryPermissions(self),
+            ExtendedAttributes: MemoryExtendedAttributes(self),
+            Timestamps: MemoryTimestamps(self)
+        }
+
+    @property
+    def filesystem(self):
+        return self._filesystem
+
+    def _with_path(self, new_path):
+        return MemoryFile(self._filesystem, new_path)
+
+    def _node(self, follow=True):
+        with self._filesystem._lock:
+            return self._filesystem._lookup(self._path, follow)
+
+    def _existing_node(self, follow=True):
+        node = self._node(follow)
+        if node is None:
+            raise generate(exceptions.FileNotFoundError, self._path)
+        return node
+
+    def get_path_components(self, relative_to=None):
+        if relative_to:
+            if not isinstance(relative_to, MemoryFile):
+                raise ValueError("relative_to must be another MemoryFile "
+                                 "instance")
+            return posixpath.relpath(self._path, relative_to._path).split("/")
+        return self._path.split("/")
+
+    @property
+    def parent(self):
+        parent = posixpath.dirname(self._path)
+        if parent == self._path:
+            return None
+        return self._with_path(parent)
+
+    def child(self, *names):
+        return self._with_path(posixpath.join(self._path, *names))
+
+    @property
+    def type(self):
+        node = self._node(follow=False)
+        if node is None:
+            return None
+        return node.type
+
+    @property
+    def stat(self):
+        node = self._node(follow=False)
+        if node is None:
+            return None
+        return FileStat(node.type, len(node.data), node.mtime_ns,
+                        node.atime_ns, node.inode, node.mode)
+
+    @property
+    def child_names(self):
+        node = self._node()
+        if node is None or node.type is not FOLDER:
+            return None
+        with self._filesystem._lock:
+            return sorted(node.children)
+
+    @property
+    def link_target(self):
+        node = self._node(follow=False)
+        if node is None or node.type is not LINK:
+            return None
+        return node.target
+
+    @property
+    def size(self):
+        node = self._node()
+        if node is None:
+            return 0
+        with self._filesystem._lock:
+            return self._filesystem._tree_size(node)
+
+    def read(self):
+        # Hand back the stored bytes object itself rather than a copy
+        node = self._existing_node()
+        if node.type is FOLDER:
+            raise generate(exceptions.IsADirectoryError, self._path)
+        node.atime_ns = _now()
+        return node.data
+
+    def open_for_reading(self):
+        node = self._existing_node()
+        if node.type is FOLDER:
+            raise generate(exceptions.IsADirectoryError, self._path)
+        node.atime_ns = _now()
+        return _MemoryReader(node.data)
+
+    def open_for_writing(self, append=False, exclusive=False):
+        """
+        Open this file for writing, creating it if it doesn't exist (or
+        raising FileExistsError if it does and exclusive is True).
+
+        Data written to the returned stream becomes visible to readers when
+        the stream is flushed or closed. Streams already open for reading
+        keep seeing the contents the file had when they were opened.
+        """
+        fs = self._filesystem
+        with fs._lock:
+            if exclusive:
+                parent, name = fs._parent_of(self._path)
+                if name in parent.children:
+                    raise generate(exceptions.FileExistsError, self._path)
+            node = fs._lookup(self._path)
+            if node is None:
+                parent, name = fs._parent_of(self._path)
+                if name in parent.children: # Broken link
+                    raise generate(exceptions.FileNotFoundError, self._path)
+                node = fs._new_node(stat.S_IFREG | 0o644)
+                parent.children[name] = node
+                parent.mtime_ns = node.mtime_ns
+            elif node.type is FOLDER:
+                raise generate(exceptions.IsADirectoryError, self._path)
+            elif not append:
+                fs._reserve(-len(node.data), self._path)
+                node.data = b""
+                node.mtime_ns = _now()
+            return _MemoryWriter(fs, node, self._path)
+
+    def create_folder(self, ignore_existing=False, recursive=False):
+        fs = self._filesystem
+        with fs._lock:
+            node = self._node()
+            if node is not None:
+                if node.type is FOLDER and ignore_existing:
+                    return
+                raise generate(exceptions.FileExistsError, self._path)
+            if recursive and not self.parent.exists:
+                self.parent.create_folder(ignore_existing=True,
+                                          recursive=True)
+            parent, name = fs._parent_of(self._path)
+            if name in parent.children: # Broken link
+                raise generate(exceptions.FileExistsError, self._path)
+            node = fs._new_node(stat.S_IFDIR | 0o755)
+            parent.children[name] = node
+            parent.mtime_ns = node.mtime_ns
+
+    def delete(self, ignore_missing=False):
+        fs = self._filesystem
+        with fs._lock:
+            if self._path == "/":
+                raise generate(exceptions.PermissionError, self._path)
+            parent, name = fs._parent_of(self._path)
+            node = parent.children.pop(name, None)
+            if node is None:
+                if ignore_missing:
+                    return
+                raise generate(exceptions.FileNotFoundError, self._path)
+            parent.mtime_ns = _now()
+            fs._reserve(-fs._tree_size(node), self._path)
+
+    def link_to(self, other):
+        if isinstance(other, MemoryFile):
+            target = other._path
+        elif isinstance(other, basestring):
+            target = other
+        else:
+            raise ValueError("Can't make a symlink from {0!r} to {1!r}"
+                             .format(self, other))
+        fs = self._filesystem
+        with fs._lock:
+            parent, name = fs._parent_of(self._path)
+            if name in parent.children:
+                raise generate(exceptions.FileExistsError, self._path)
+            node = fs._new_node(stat.S_IFLNK | 0o777)
+            node.target = target
+            parent.children[name] = node
+            parent.mtime_ns = node.mtime_ns
+
+    def rename_to(self, other):
+        if not (isinstance(other, MemoryFile) and
+                other._filesystem is self._filesystem):
+            return BaseFile.rename_to(self, other)
+        fs = self._filesystem
+        with fs._lock:
+            if (other._path + "/").startswith(self._path + "/"):
+                if other._path == self._path:
+                    return
+                raise OSError(errno.EINVAL, os.strerror(errno.EINVAL),
+                              other._path)
+            parent, name = fs._parent_of(self._path)
+            node = parent.children.get(name)
+            if node is None:
+                raise generate(exceptions.FileNotFoundError, self._path)
+            new_parent, new_name = fs._parent_of(other._path)
+            existing = new_parent.children.get(new_name)
+            if existing is not None:
+                # Same rules as rename(2)
+                if existing.type is FOLDER and node.type is not FOLDER:
+                    raise generate(exceptions.IsADirectoryError, other._path)
+                if existing.type is not FOLDER and node.type is FOLDER:
+                    raise generate(exceptions.NotADirectoryError, other._path)
+                if existing.children:
+                    raise OSError(errno.ENOTEMPTY,
+                                  os.strerror(errno.ENOTEMPTY), other._path)
+                fs._reserve(-fs._tree_size(existing), other._path)
+            del parent.children[name]
+            new_parent.children[new_name] = node
+            parent.mtime_ns = new_parent.mtime_ns = _now()
+
+    def _rename_over(self, other):
+        if (isinstance(other, MemoryFile) and
+                other._filesystem is self._filesystem):
+            # rename_to already replaces other in one step
+            self.rename_to(other)
+        else:
+            BaseFile._rename_over(self, other)
+
+    def __cmp__(self, other):
+        if not isinstance(other, MemoryFile):
+            return NotImplemented
+        return (cmp(id(self._filesystem), id(other._filesystem)) or
+                cmp(self._path, other._path))
+
+    def __hash__(self):
+        return hash((id(self._filesystem), self._path))
+
+    def __str__(self):
+        return "<fileutils.MemoryFile {0!r} on {1!r}>".format(
+            self._path, self._filesystem)
+
+    __repr__ = __str__
+
+
+class MemoryPermissions(PosixPermissions):
+    def __init__(self, f):
+        self._file = f
+
+    @property
+    def mode(self):
+        return self._file._existing_node().mode
+
+    @mode.setter
+    def mode(self, value):
+        node = self._file._existing_node()
+        node.mode = stat.S_IFMT(node.mode) | stat.S_IMODE(value)
+
+    def __repr__(self):
+        return "<MemoryPermissions for {0!r}>".format(self._file)
+
+    __str__ = __repr__
+
+
+class MemoryTimestamps(Timestamps):
+    def __init__(self, f):
+        self._file = f
+
+    def get(self):
+        node = self._file._existing_node(follow=False)
+        return node.atime_ns, node.mtime_ns
+
+    def set(self, atime_ns, mtime_ns):
+        node = self._file._existing_node(follow=False)
+        node.atime_ns, node.mtime_ns = atime_ns, mtime_ns
+
+    def __repr__(self):
+        return "<MemoryTimestamps for {0!r}>".format(self._file)
+
+    __str__ = __repr__
+
+
+class MemoryExtendedAttributes(ExtendedAttributes):
+    def __init__(self, f):
+        self._file = f
+
+    def get(self, name):
+        node = self._file._node()
+        if node is None:
+            raise KeyError(name)
+        return node.xattrs[name]
+
+    def set(self, name, value):
+        self._file._existing_node().xattrs[name] = value
+
+    def list(self):
+        node = self._file._node()
+        if node is None:
+            return []
+        return list(node.xattrs)
+
+    def items(self):
+        node = self._file._node()
+        if node is None:
+            return []
+        return list(node.xattrs.items())
+
+    def delete(self, name):
+        node = self._file._node()
+        if node is None:
+            raise KeyError(name)
+        del node.xattrs[name]
+
+    def __repr__(self):
+        return "<MemoryExtendedAttributes for {0!r}>".format(self._file)
+
+    __str__ = __repr__
+
+
+class _MemoryReader(object):
+    """
+    A read-only, seekable stream over a bytes object shared with the file it
+    was opened from.
+    """
+    def __init__(self, data):
+        self._data = data
+        self._position = 0
+        self.closed = False
+
+    def read(self, size=-1):
+        data = self._data
+        start = self._position
+        if size is None or size < 0:
+            size = len(data) - start
+        if start == 0 and size >= len(data):
+            # Reading everything, so no need to copy it
+            self._position = len(data)
+            return data
+        self._position = min(start + size, len(data))
+        return data[start:self._position]
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def getbuffer(self):
+        """
+        Return a read-only memoryview of the entire contents being read,
+        without copying them.
+        """
+        return memoryview(self._data)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += len(self._data)
+        self._position = max(offset, 0)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _MemoryWriter(object):
+    """
+    A write-only stream that appends to a file's contents, publishing them
+    when flushed or closed.
+    """
+    def __init__(self, filesystem, node, path):
+        self._filesystem = filesystem
+        self._node = node
+        self._path = path
+        self._chunks = [node.data] if node.data else []
+        self._pending = 0
+        self._size = len(node.data)
+        self.closed = False
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if not isinstance(data, bytes):
+            data = bytes(data)
+        self._filesystem._reserve(len(data), self._path)
+        self._chunks.append(data)
+        self._pending += len(data)
+        self._size += len(data)
+        return len(data)
+
+    def flush(self):
+        if not self._pending:
+            return
+        with self._filesystem._lock:
+            data = b"".join(self._chunks)
+            self._chunks = [data]
+            # Anything written through other streams since we last flushed
+            # is overwritten, as if each stream had its own file offset
+            self._filesystem._reserve(len(data) - self._pending -
+                                      len(self._node.data), self._path)
+            self._node.data = data
+            self._node.mtime_ns = _now()
+            self._pending = 0
+
+    def tell(self):
+        return self._size
+
+    def writable(self):
+        return True
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _file_type(mode):
+    if stat.S_ISREG(mode):
+        return FILE
+    if stat.S_ISDIR(mode):
+        return FOLDER
+    if stat.S_ISLNK(mode):
+        return LINK
+    return None
@@ -0,0 +1,350 @@
+"""
+Counting and timing the operations a filesystem carries out.
+
+Giving a FileSystem a :obj:`Metrics` makes its files record every operation
+they perform against the backend (each stat, listing, open, read, write,
+folder creation, removal and rename), along with how long it took and how
+many bytes it moved::
+
+    fs = SSHFileSystem.connect(...)
+    fs.metrics = Metrics()
+    fs.child("/srv/data").copy_to(File("/tmp/data"))
+    print(fs.metrics.snapshot()["stat"].count)
+
+LocalFileSystem and URLFileSystem don't hold on to any per-instance state, so
+their metrics are turned on for all local files (or all URLs) at once::
+
+    LocalFileSystem().metrics = Metrics()
+    URLFileSystem.metrics = Metrics()
+
+A single Metrics can be shared by any number of filesystems. Functions
+registered with :obj:`Metrics.add_hook` are called with each operation as
+it's recorded, which is the place to forward them to other metrics systems.
+"""
+
+import threading
+import time
+
+__all__ = ["Metrics", "OperationStats"]
+
+# Upper bounds, in seconds, of the buckets latencies are counted in: powers
+# of two from a microsecond up to about 17 seconds, and then everything else
+BUCKETS = tuple(2**i / 1000000.0 for i in range(25)) + (float("inf"),)
+
+
+class Metrics(object):
+    """
+    A collection of counters and latency histograms, one set per kind of
+    operation. Backends record operations named "stat", "list", "open",
+    "read", "write", "mkdir", "remove", "rename", "readlink", "symlink" and
+    "sync", and SSHFileSystem also records a "setstat" for each attribute
+    change it makes by path.
+
+    Metrics instances are safe to use from multiple threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operations = {}
+        self._hooks = []
+
+    def record(self, operation, seconds, bytes=0, error=False):
+        """
+        Record one operation that took the specified number of seconds and
+        moved the specified number of bytes. error is True if the operation
+        failed.
+
+        Backends call this (usually by way of :obj:`measure`) for each
+        operation they carry out; it's only useful to call it directly to
+        record operations of one's own.
+        """
+        with self._lock:
+            stats = self._operations.get(operation)
+            if stats is None:
+                stats = self._operations[operation] = _Counters()
+            stats.add(seconds, bytes, error)
+            hooks = self._hooks
+        for hook in hooks:
+            hook(operation, seconds, bytes, error)
+
+    def snapshot(self):
+        """
+        Return a dictionary mapping the name of each operation recorded so
+        far to an :obj:`OperationStats` describing it. The snapshot doesn't
+        change as further operations are recorded.
+        """
+        with self._lock:
+            return dict((operation, stats.freeze(operation))
+                        for operation, stats in self._operations.items())
+
+    def reset(self):
+        """
+        Forget everything recorded so far.
+        """
+        with self._lock:
+            self._operations.clear()
+
+    def add_hook(self, hook):
+        """
+        Call hook(operation, seconds, bytes, error) for every operation
+        recorded from now on. Hooks are called on whichever thread performed
+        the operation, after it completes, so they should be quick.
+        """
+        with self._lock:
+            # Copied rather than modified in place so that record() can call
+            # the hooks without holding the lock
+            self._hooks = self._hooks + [hook]
+
+    def remove_hook(self, hook):
+        """
+        Stop calling a hook previously passed to add_hook.
+        """
+        with self._lock:
+            hooks = list(self._hooks)
+            hooks.remove(hook)
+            self._hooks = hooks
+
+    def measure(self, operation, bytes=0):
+        """
+        Return a context manager that records one operation of the specified
+        kind, moving the specified number of bytes and taking as long as its
+        with statement takes. The operation is recorded as failed if the with
+        statement raises an exception.
+        """
+        return _Measurement(self, operation, bytes)
+
+    def wrap_stream(self, stream):
+        """
+        Return a stream that behaves like the specified one but records each
+        read and write (with the number of bytes it moved) against this
+        Metrics. Backends use this to measure the streams returned from
+        open_for_reading and open_for_writing.
+        """
+        return _MeasuredStream(self, stream)
+
+    def __repr__(self):
+        with self._lock:
+            counts = ", ".join("{0} {1}".format(stats.count, operation)
+                               for operation, stats in
+                               sorted(self._operations.items()))
+        return "<fileutils.Metrics: {0}>".format(counts or "nothing recorded")
+
+    __str__ = __repr__
+
+
+class OperationStats(object):
+    """
+    A snapshot of what a :obj:`Metrics` has recorded about one kind of
+    operation, as returned by :obj:`Metrics.snapshot`.
+    """
+    def __init__(self, operation, count, errors, bytes, seconds, histogram):
+        self._operation = operation
+        self._count = count
+        self._errors = errors
+        self._bytes = bytes
+        self._seconds = seconds
+        self._histogram = histogram
+
+    @property
+    def operation(self):
+        """
+        The name of the operation these stats are for, such as "stat".
+        """
+        return self._operation
+
+    @property
+    def count(self):
+        """
+        The number of times the operation was carried out.
+        """
+        return self._count
+
+    @property
+    def errors(self):
+        """
+        The number of times the operation failed.
+        """
+        return self._errors
+
+    @property
+    def bytes(self):
+        """
+        The total number of bytes read or written by the operation.
+        """
+        return self._bytes
+
+    @property
+    def seconds(self):
+        """
+        The total time, in seconds, spent carrying out the operation.
+        """
+        return self._seconds
+
+    @property
+    def mean(self):
+        """
+        The average time, in seconds, the operation took, or None if it was
+        never carried out.
+        """
+        if not self._count:
+            return None
+        return self._seconds / self._count
+
+    @property
+    def histogram(self):
+        """
+        A list of (upper_bound, count) pairs, one for each latency bucket:
+        count is the number of operations that took at most upper_bound
+        seconds and more than the previous bucket's upper bound. The last
+        bucket's upper bound is infinity.
+        """
+        return list(zip(BUCKETS, self._histogram))
+
+    def percentile(self, percent):
+        """
+        Return an upper bound on the time within which the specified
+        percentage of operations completed, accurate to within a factor of
+        two (the width of a histogram bucket), or None if the operation was
+        never carried out.
+        """
+        if not self._count:
+            return None
+        needed = self._count * percent / 100.0
+        seen = 0
+        for upper_bound, count in zip(BUCKETS, self._histogram):
+            seen += count
+            if seen >= needed:
+                return upper_bound
+        return BUCKETS[-1]
+
+    def __repr__(self):
+        return ("<fileutils.OperationStats for {0!r}: {1} operations, {2} "
+                "errors, {3} bytes, {4:.6f} seconds>".format(
+                    self._operation, self._count, self._errors, self._bytes,
+                    self._seconds))
+
+    __str__ = __repr__
+
+
+def measure(metrics, operation, bytes=0):
+    """
+    Same as metrics.measure(operation, bytes), but does nothing (cheaply) if
+    metrics is None. Backends wrap each of their operations with this,
+    passing their filesystem's metrics.
+    """
+    if metrics is None:
+        return _NOT_MEASURED
+    return _Measurement(metrics, operation, bytes)
+
+
+def wrap_stream(metrics, stream):
+    """
+    Same as metrics.wrap_stream(stream), but returns stream as-is if metrics
+    is None.
+    """
+    if metrics is None:
+        return stream
+    return _MeasuredStream(metrics, stream)
+
+
+def unwrap_stream(stream):
+    """
+    Return the stream that the specified stream (as returned by wrap_stream)
+    wraps, or stream itself if it isn't wrapped. Backends use this where they
+    need to get at their own stream type's internals.
+    """
+    if isinstance(stream, _MeasuredStream):
+        return stream._stream
+    return stream
+
+
+class _Counters(object):
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.histogram = [0] * len(BUCKETS)
+
+    def add(self, seconds, bytes, error):
+        self.count += 1
+        self.bytes += bytes
+        self.seconds += seconds
+        if error:
+            self.errors += 1
+        for index, upper_bound in enumerate(BUCKETS):
+            if seconds <= upper_bound:
+                self.histogram[index] += 1
+                break
+
+    def freeze(self, operation):
+        return OperationStats(operation, self.count, self.errors, self.bytes,
+                              self.seconds, tuple(self.histogram))
+
+
+class _Measurement(object):
+    def __init__(self, metrics, operation, bytes):
+        self._metrics = metrics
+        self._operation = operation
+        self._bytes = bytes
+
+    def __enter__(self):
+        self._start = time.time()
+
+    def __exit__(self, exception_type, *args):
+        self._metrics.record(self._operation, time.time() - self._start,
+                             self._bytes, exception_type is not None)
+
+
+class _NotMeasured(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+_NOT_MEASURED = _NotMeasured()
+
+
+class _MeasuredStream(object):
+    def __init__(self, metrics, stream):
+        self._metrics = metrics
+        self._stream = stream
+
+    def _call(self, operation, function, *args):
+        start = time.time()
+        try:
+            result = function(*args)
+        except Exception:
+            self._metrics.record(operation, time.time() - start, error=True)
+            raise
+        return start, result
+
+    def read(self, *args):
+        start, data = self._call("read", self._stream.read, *args)
+        self._metrics.record("read", time.time() - start, len(data))
+        return data
+
+    def readline(self, *args):
+        start, data = self._call("read", self._stream.readline, *args)
+        self._metrics.record("read", time.time() - start, len(data))
+        return data
+
+    def write(self, data):
+        start, result = self._call("write", self._stream.write, data)
+        self._metrics.record("write", time.time() - start, len(data))
+        return result
+
+    def __iter__(self):
+        return iter(self.readline, self._stream.read(0))
+
+    def __getattr__(self, name):
+        # Everything else (seek, tell, flush, close, fileno and the like)
+        # goes straight through to the stream
+        return getattr(self._stream, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._stream.close()
@@ -0,0 +1,350 @@
+"""
+Union filesystems.
+
+An :obj:`OverlayFileSystem` stacks a writable upper folder over a read-only
+lower folder, usually a fast local folder over a slow remote one, and
+exposes the combination as a single tree. This is most easily set up with
+:obj:`LocalFileSystem.overlay() <fileutils.local.LocalFileSystem.overlay>`::
+
+    tree = LocalFileSystem().overlay(SSHFile.connect(...).child("src"))
+    tree.child("setup.py").write(...)   # Only touches local disk
+    tree.child("README").read()         # Read from the remote tree
+
+Deletions from the lower layer are recorded in the upper layer with the
+whiteout files used by AUFS and OCI image layers (".wh.<name>" for a deleted
+entry and ".wh..wh..opq" for a folder that hides everything below it), so an
+upper folder populated by one OverlayFileSystem can be reused by the next.
+"""
+
+from fileutils.interface import BaseFile, FileSystem
+from fileutils.mixins import ChildrenMixin
+from fileutils.constants import FOLDER
+from fileutils.exceptions import generate
+from fileutils import exceptions
+import posixpath
+
+__all__ = ["OverlayFileSystem", "OverlayFile"]
+
+try:
+    basestring
+except NameError: # Python 3
+    basestring = str
+
+# A file named _WHITEOUT_PREFIX + name in the upper layer hides name in the
+# lower layer, and a folder in the upper layer containing a file named
+# _OPAQUE hides the entire contents of the corresponding lower folder.
+_WHITEOUT_PREFIX = ".wh."
+_OPAQUE = ".wh..wh..opq"
+
+
+class OverlayFileSystem(FileSystem):
+    """
+    A FileSystem presenting the union of two folders, lower and upper, which
+    can be any BaseFile instances, from any backends.
+
+    Reads are served from the upper layer when it has the file in question,
+    and from the lower layer otherwise. All modifications go to the upper
+    layer; the lower layer is never written to. In particular:
+
+     * Writing to a file that only exists in the lower layer first copies it
+       up to the upper layer, along with any of its folders that don't yet
+       exist there. Only files that are actually written to or appended to
+       are copied, so working against a large remote tree only costs the
+       transfer of the files that are touched.
+     * Deleting a file or folder that exists in the lower layer leaves a
+       whiteout behind in the upper layer that hides it.
+     * Folder listings merge both layers, minus whited-out names.
+
+    Changing the attributes of a file that only exists in the lower layer
+    would change them in the lower layer, so call
+    :obj:`OverlayFile.copy_up` on it first.
+    """
+    def __init__(self, lower, upper):
+        self._lower = lower
+        self._upper = upper
+
+    @property
+    def lower(self):
+        """
+        The read-only lower layer, as a BaseFile.
+        """
+        return self._lower
+
+    @property
+    def upper(self):
+        """
+        The writable upper layer, as a BaseFile.
+        """
+        return self._upper
+
+    def child(self, *path_components):
+        return OverlayFile(self, posixpath.join("/", *path_components))
+
+    @property
+    def roots(self):
+        return [OverlayFile(self, "/")]
+
+    def __repr__(self):
+        return "<fileutils.OverlayFileSystem of {0!r} over {1!r}>".format(
+            self._upper, self._lower)
+
+    __str__ = __repr__
+
+
+class OverlayFile(ChildrenMixin, BaseFile):
+    """
+    A BaseFile implementation exposing a file on an
+    :obj:`OverlayFileSystem`.
+
+    Instances are obtained from an OverlayFileSystem's root property or its
+    child method, or from :obj:`LocalFileSystem.overlay()
+    <fileutils.local.LocalFileSystem.overlay>`.
+    """
+    _sep = "/"
+
+    def __init__(self, filesystem, path="/"):
+        self._filesystem = filesystem
+        self._path = posixpath.normpath(path)
+        while self._path.startswith("//"):
+            self._path = self._path[1:]
+
+    @property
+    def filesystem(self):
+        return self._filesystem
+
+    def _with_path(self, new_path):
+        return OverlayFile(self._filesystem, new_path)
+
+    @property
+    def _names(self):
+        return [name for name in self._path.split("/") if name]
+
+    @property
+    def upper(self):
+        """
+        The file corresponding to this one in the upper layer. It may not
+        exist.
+        """
+        names = self._names
+        if not names:
+            return self._filesystem._upper
+        return self._filesystem._upper.child(*names)
+
+    @property
+    def lower(self):
+        """
+        The file corresponding to this one in the lower layer. It may not
+        exist, or it may exist but be hidden by the upper layer.
+        """
+        names = self._names
+        if not names:
+            return self._filesystem._lower
+        return self._filesystem._lower.child(*names)
+
+    @property
+    def _lower_visible(self):
+        # Whether the lower layer's copy of this file (if it has one) shows
+        # through the upper layer
+        upper = self._filesystem._upper
+        for index, name in enumerate(self._names):
+            if index:
+                upper_type = upper.type
+                if upper_type is None:
+                    # Nothing further down exists in the upper layer, so
+                    # there can't be any whiteouts there either
+                    return True
+                if upper_type is not FOLDER or upper.child(_OPAQUE).exists:
+                    return False
+            if upper.child(_WHITEOUT_PREFIX + name).exists:
+                return False
+            upper = upper.child(name)
+        return True
+
+    @property
+    def _layer(self):
+        # The file in whichever layer provides this file, or None
+        upper = self.upper
+        if upper.type is not None:
+            return upper
+        if self._lower_visible:
+            lower = self.lower
+            if lower.type is not None:
+                return lower
+        return None
+
+    def get_path_components(self, relative_to=None):
+        if relative_to:
+            if not isinstance(relative_to, OverlayFile):
+                raise ValueError("relative_to must be another OverlayFile "
+                                 "instance")
+            return posixpath.relpath(self._path, relative_to._path).split("/")
+        return self._path.split("/")
+
+    @property
+    def parent(self):
+        parent = posixpath.dirname(self._path)
+        if parent == self._path:
+            return None
+        return self._with_path(parent)
+
+    def child(self, *names):
+        return self._with_path(posixpath.join(self._path, *names))
+
+    @property
+    def type(self):
+        layer = self._layer
+        return layer.type if layer is not None else None
+
+    @property
+    def stat(self):
+        layer = self._layer
+        return layer.stat if layer is not None else None
+
+    @property
+    def link_target(self):
+        layer = self._layer
+        return layer.link_target if layer is not None else None
+
+    @property
+    def attributes(self):
+        layer = self._layer
+        return layer.attributes if layer is not None else {}
+
+    @property
+    def child_names(self):
+        upper = self.upper
+        upper_type = upper.type
+        names = set()
+        hidden = set()
+        if upper_type is not None:
+            if upper_type is not FOLDER:
+                return None
+            upper_names = upper.child_names
+            for name in upper_names:
+                if name.startswith(_WHITEOUT_PREFIX):
+                    hidden.add(name[len(_WHITEOUT_PREFIX):])
+                else:
+                    names.add(name)
+            if _OPAQUE in upper_names:
+                return sorted(names)
+        lower = self.lower
+        if self._lower_visible and lower.is_folder:
+            names.update(name for name in lower.child_names
+                         if name not in hidden)
+        elif upper_type is None:
+            return None
+        return sorted(names)
+
+    @property
+    def size(self):
+        if self.is_folder:
+            return sum(f.size for f in self.children)
+        layer = self.dereference(True)._layer
+        return layer.size if layer is not None else 0
+
+    def open_for_reading(self):
+        layer = self.dereference(True)._layer
+        if layer is None:
+            raise generate(exceptions.FileNotFoundError, self._path)
+        return layer.open_for_reading()
+
+    def _prepare_upper(self):
+        # Make sure our parent exists in the upper layer and that nothing is
+        # hiding our name, and return our upper file
+        parent = self.parent
+        if parent is not None:
+            if not parent.is_folder:
+                raise generate(exceptions.FileNotFoundError, self._path)
+            parent.copy_up()
+            whiteout = parent.upper.child(_WHITEOUT_PREFIX + self.name)
+            if whiteout.exists:
+                whiteout.delete()
+        return self.upper
+
+    def copy_up(self):
+        """
+        Copy this file from the lower layer to the upper layer if it's only
+        present in the lower layer. Folders are created empty in the upper
+        layer (their contents are left where they are), and links are copied
+        as links.
+
+        Nothing happens if the file is already present in the upper layer.
+        An exception is thrown if it doesn't exist at all.
+        """
+        upper = self.upper
+        if upper.type is not None:
+            return
+        layer = self._layer
+        if layer is None:
+            raise generate(exceptions.FileNotFoundError, self._path)
+        self._prepare_upper()
+        file_type = layer.type
+        if file_type is FOLDER:
+            upper.create_folder()
+            layer.copy_attributes_to(upper)
+        else:
+            layer.copy_to(upper, dereference_links=False)
+
+    def open_for_writing(self, append=False, exclusive=False):
+        if exclusive and self.type is not None:
+            raise generate(exceptions.FileExistsError, self._path)
+        if self.is_folder:
+            raise generate(exceptions.IsADirectoryError, self._path)
+        if append and self.exists:
+            self.dereference(True).copy_up()
+        target = self.dereference(True)
+        return target._prepare_upper().open_for_writing(append, exclusive)
+
+    def create_folder(self, ignore_existing=False, recursive=False):
+        if self.exists:
+            if self.is_folder and ignore_existing:
+                return
+            raise generate(exceptions.FileExistsError, self._path)
+        if recursive and self.parent is not None:
+            self.parent.create_folder(ignore_existing=True, recursive=True)
+        hides_lower = self.lower.type is not None
+        upper = self._prepare_upper()
+        upper.create_folder()
+        if hides_lower:
+            # Whatever used to be in the lower layer was deleted, so don't let
+            # its contents show through our new folder
+            upper.child(_OPAQUE).write(b"")
+
+    def delete(self, ignore_missing=False):
+        if not self.exists:
+            if ignore_missing:
+                return
+            raise generate(exceptions.FileNotFoundError, self._path)
+        if self._path == "/":
+            raise generate(exceptions.PermissionError, self._path)
+        upper = self.upper
+        if upper.type is not None:
+            upper.delete()
+        if self._lower_visible and self.lower.type is not None:
+            self._prepare_upper()
+            self.parent.upper.child(_WHITEOUT_PREFIX + self.name).write(b"")
+
+    def link_to(self, other):
+        if isinstance(other, OverlayFile):
+            other = other._path
+        elif not isinstance(other, basestring):
+            raise ValueError("Can't make a symlink from {0!r} to {1!r}"
+                             .format(self, other))
+        if self.exists:
+            raise generate(exceptions.FileExistsError, self._path)
+        self._prepare_upper().link_to(other)
+
+    def __cmp__(self, other):
+        if not isinstance(other, OverlayFile):
+            return NotImplemented
+        return (cmp(id(self._filesystem), id(other._filesystem)) or
+                cmp(self._path, other._path))
+
+    def __hash__(self):
+        return hash((id(self._filesystem), self._path))
+
+    def __str__(self):
+        return "<fileutils.OverlayFile {0!r} on {1!r}>".format(
+            self._path, self._filesystem)
+
+    __repr__ = __str__
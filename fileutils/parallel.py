@@ -0,0 +1,57 @@
+"""
+Small helpers for spreading work across a pool of threads.
+
+These are used by the parts of fileutils that parallelize I/O or compression
+(zip creation and extraction, for example). They're built on
+multiprocessing.pool.ThreadPool so that they work on both Python 2 and 3.
+"""
+
+from multiprocessing.pool import ThreadPool
+from collections import deque
+import multiprocessing
+
+
+def default_workers():
+    """
+    The number of worker threads used when a caller doesn't specify one: the
+    number of CPUs on this machine.
+    """
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def ordered_map(function, iterable, workers=None, window=None):
+    """
+    A generator that works like map(function, iterable), but calls function
+    from a pool of worker threads. Results are yielded in the same order as
+    the items they were computed from.
+
+    At most window items (twice the number of workers by default) are
+    submitted ahead of the result the caller is currently waiting for, so
+    iterable is consumed lazily and memory use stays bounded even when its
+    items are large. If workers is 1, everything runs in the calling thread.
+
+    Exceptions raised by function propagate out of the generator when the
+    corresponding result is reached.
+    """
+    if workers is None:
+        workers = default_workers()
+    if window is None:
+        window = workers * 2
+    if workers <= 1:
+        for item in iterable:
+            yield function(item)
+        return
+    pool = ThreadPool(workers)
+    try:
+        pending = deque()
+        for item in iterable:
+            pending.append(pool.apply_async(function, (item,)))
+            if len(pending) >= window:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
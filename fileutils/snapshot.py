@@ -0,0 +1,336 @@
+"""
+Compact snapshots of a tree's metadata, and fast comparisons between them.
+
+Snapshots are usually obtained from :obj:`BaseFile.snapshot_tree()
+<fileutils.interface.BaseFile.snapshot_tree>`::
+
+    before = folder.snapshot_tree()
+    ...
+    changes = diff(before, folder.snapshot_tree())
+    for path in changes.added:
+        ...
+
+This works against any backend, which makes it useful for detecting changes on
+hosts (such as those reached over SSH) where inotify and friends aren't
+available. Snapshots can be written out with :obj:`Snapshot.dump` and read back
+in with :obj:`Snapshot.load` to compare trees across runs.
+"""
+
+from fileutils.constants import FILE, FOLDER, LINK, YIELD, SKIP
+from array import array
+import struct
+
+__all__ = ["Snapshot", "SnapshotDiff", "diff"]
+
+# Python 2's array module doesn't know about "q", but "l" is 64 bits wide on
+# every platform of interest there except Windows.
+try:
+    array("q")
+    _INT64 = "q"
+except ValueError:
+    _INT64 = "l"
+
+# Types are stored as small integers in a byte array
+_TYPE_CODES = {FILE: 1, FOLDER: 2, LINK: 3}
+_TYPES = {0: None, 1: FILE, 2: FOLDER, 3: LINK, 4: "fileutils.OTHER"}
+
+_MAGIC = b"fileutils-snapshot-1\n"
+
+# Python 3 represents undecodable bytes in file names with lone surrogates;
+# make sure those survive a round trip through dump and load.
+_ERRORS = "strict" if str is bytes else "surrogateescape"
+
+
+class Snapshot(object):
+    """
+    The metadata of every file and folder in a tree as of a particular point
+    in time.
+
+    Entries are kept sorted by path in parallel arrays rather than as a list
+    of file objects, so a snapshot of a tree with a few million entries stays
+    reasonably small and two snapshots can be compared with a single merge
+    walk. Each entry is a tuple of (path, type, size, mtime_ns, inode, mode),
+    where path is relative to the root of the snapshot and always uses "/" as
+    its separator. Numbers that the backend in question doesn't expose are
+    recorded as 0.
+    """
+    def __init__(self, paths=(), types=(), sizes=(), mtimes=(), inodes=(),
+                 modes=()):
+        """
+        Create a snapshot from parallel sequences of entry fields. The
+        sequences must already be sorted by path; use :obj:`Snapshot.of` to
+        take a snapshot of an actual tree.
+        """
+        self._paths = list(paths)
+        self._types = array("b", types)
+        self._sizes = array(_INT64, sizes)
+        self._mtimes = array(_INT64, mtimes)
+        self._inodes = array(_INT64, inodes)
+        self._modes = array(_INT64, modes)
+
+    @staticmethod
+    def of(root, filter=None):
+        """
+        Take a snapshot of everything beneath the specified BaseFile. See
+        :obj:`BaseFile.snapshot_tree() <fileutils.interface.BaseFile.snapshot_tree>`
+        for the meaning of filter.
+        """
+        entries = []
+        def record(f):
+            if f is root:
+                return True
+            if filter is not None:
+                include = filter(f)
+                if include is False or include == SKIP:
+                    return SKIP
+            s = f._cached_stat
+            if s is None: # Vanished since its parent was listed
+                return SKIP
+            path = "/".join(f.get_path_components(relative_to=root))
+            entries.append((path, _TYPE_CODES.get(s.type, 4), s.size or 0,
+                            s.mtime_ns or 0, s.inode or 0, s.mode or 0))
+            # Don't descend into links, only real folders
+            return True if s.type is FOLDER else YIELD
+        # We do all of our work in the filter, so just drain the generator
+        for _ in root.recurse(record):
+            pass
+        entries.sort()
+        return Snapshot(*zip(*entries)) if entries else Snapshot()
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __getitem__(self, index):
+        return (self._paths[index], _TYPES[self._types[index]],
+                self._sizes[index], self._mtimes[index], self._inodes[index],
+                self._modes[index])
+
+    def __iter__(self):
+        for index in range(len(self._paths)):
+            yield self[index]
+
+    def __contains__(self, path):
+        return self._find(path) is not None
+
+    def get(self, path):
+        """
+        Return the entry for the specified relative path, or None if the path
+        isn't part of this snapshot.
+        """
+        index = self._find(path)
+        if index is None:
+            return None
+        return self[index]
+
+    @property
+    def paths(self):
+        """
+        A sorted list of the relative paths of all entries in this snapshot.
+        """
+        return list(self._paths)
+
+    @property
+    def total_size(self):
+        """
+        The sum of the sizes of all files in this snapshot.
+        """
+        return sum(self._sizes)
+
+    def _find(self, path):
+        # Binary search, since self._paths is sorted
+        low, high = 0, len(self._paths)
+        while low < high:
+            middle = (low + high) // 2
+            if self._paths[middle] < path:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self._paths) and self._paths[low] == path:
+            return low
+        return None
+
+    def _differs(self, index, other, other_index):
+        return (self._types[index] != other._types[other_index] or
+                self._sizes[index] != other._sizes[other_index] or
+                self._mtimes[index] != other._mtimes[other_index] or
+                self._inodes[index] != other._inodes[other_index] or
+                self._modes[index] != other._modes[other_index])
+
+    def dump(self, stream):
+        """
+        Write this snapshot to the specified binary file-like object in a
+        compact format that :obj:`Snapshot.load` can read back in.
+        """
+        paths = "\0".join(self._paths)
+        if not isinstance(paths, bytes):
+            paths = paths.encode("utf-8", _ERRORS)
+        stream.write(_MAGIC)
+        stream.write(struct.pack("<QQ", len(self._paths), len(paths)))
+        stream.write(paths)
+        for column in (self._types, self._sizes, self._mtimes, self._inodes,
+                       self._modes):
+            _write_array(stream, column)
+
+    @staticmethod
+    def load(stream):
+        """
+        Read a snapshot previously written with :obj:`Snapshot.dump` from the
+        specified binary file-like object.
+        """
+        if stream.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError("Not a fileutils snapshot")
+        count, paths_length = struct.unpack("<QQ", stream.read(16))
+        paths = stream.read(paths_length)
+        if str is not bytes: # Python 3, so paths are text
+            paths = paths.decode("utf-8", _ERRORS)
+        snapshot = Snapshot()
+        snapshot._paths = paths.split("\0") if count else []
+        snapshot._types = _read_array(stream, "b", count)
+        snapshot._sizes = _read_array(stream, _INT64, count)
+        snapshot._mtimes = _read_array(stream, _INT64, count)
+        snapshot._inodes = _read_array(stream, _INT64, count)
+        snapshot._modes = _read_array(stream, _INT64, count)
+        return snapshot
+
+    def __repr__(self):
+        return "<fileutils.Snapshot of {0} entries>".format(len(self))
+
+    __str__ = __repr__
+
+
+def _write_array(stream, column):
+    # Always store 64-bit little-endian integers (or bytes for the type
+    # column) regardless of the platform's native sizes.
+    data = array(column.typecode, column)
+    if data.itemsize not in (1, 8):
+        raise ValueError("64-bit integers aren't available")
+    if struct.pack("=H", 1) != struct.pack("<H", 1):
+        data.byteswap()
+    stream.write(data.tostring() if not hasattr(data, "tobytes")
+                 else data.tobytes())
+
+
+def _read_array(stream, typecode, count):
+    data = array(typecode)
+    raw = stream.read(count * data.itemsize)
+    if hasattr(data, "frombytes"):
+        data.frombytes(raw)
+    else:
+        data.fromstring(raw)
+    if struct.pack("=H", 1) != struct.pack("<H", 1):
+        data.byteswap()
+    return data
+
+
+class SnapshotDiff(object):
+    """
+    The differences between two snapshots, as returned by :obj:`diff`.
+
+    All paths are relative paths as stored in the snapshots themselves.
+    """
+    def __init__(self, added, removed, modified, renamed):
+        self._added = added
+        self._removed = removed
+        self._modified = modified
+        self._renamed = renamed
+
+    @property
+    def added(self):
+        """
+        A sorted list of paths present in the new snapshot but not the old one,
+        excluding those that were renamed.
+        """
+        return self._added
+
+    @property
+    def removed(self):
+        """
+        A sorted list of paths present in the old snapshot but not the new one,
+        excluding those that were renamed.
+        """
+        return self._removed
+
+    @property
+    def modified(self):
+        """
+        A sorted list of paths present in both snapshots whose type, size,
+        modification time, inode, or mode changed.
+        """
+        return self._modified
+
+    @property
+    def renamed(self):
+        """
+        A list of (old_path, new_path) tuples for files that disappeared from
+        one path and reappeared at another with the same inode, type, and
+        size. This requires a backend that exposes inode numbers; on those
+        that don't, renames show up as a removal and an addition.
+        """
+        return self._renamed
+
+    def __bool__(self):
+        return bool(self._added or self._removed or self._modified or
+                    self._renamed)
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return ("<fileutils.SnapshotDiff: {0} added, {1} removed, {2} "
+                "modified, {3} renamed>".format(
+                    len(self._added), len(self._removed), len(self._modified),
+                    len(self._renamed)))
+
+    __str__ = __repr__
+
+
+def diff(a, b):
+    """
+    Compare two snapshots of the same tree, a being the older one and b the
+    newer one, and return a :obj:`SnapshotDiff` describing the changes.
+
+    The comparison is a single merge walk over both snapshots' sorted paths,
+    followed by a pass that pairs up removed and added entries by inode to
+    detect renames, so it runs in time linear in the size of the snapshots.
+    """
+    added = []
+    removed = []
+    modified = []
+    i, j = 0, 0
+    a_paths, b_paths = a._paths, b._paths
+    a_length, b_length = len(a_paths), len(b_paths)
+    while i < a_length and j < b_length:
+        a_path, b_path = a_paths[i], b_paths[j]
+        if a_path == b_path:
+            if a._differs(i, b, j):
+                modified.append(a_path)
+            i += 1
+            j += 1
+        elif a_path < b_path:
+            removed.append(i)
+            i += 1
+        else:
+            added.append(j)
+            j += 1
+    removed.extend(range(i, a_length))
+    added.extend(range(j, b_length))
+
+    # Pair up removals and additions that refer to the same inode
+    removed_by_inode = {}
+    for index in removed:
+        inode = a._inodes[index]
+        if inode:
+            removed_by_inode[inode] = index
+    renamed = []
+    renamed_from = set()
+    still_added = []
+    for index in added:
+        old = removed_by_inode.pop(b._inodes[index], None) if b._inodes[index] else None
+        if (old is not None and a._types[old] == b._types[index] and
+                a._sizes[old] == b._sizes[index]):
+            renamed.append((a_paths[old], b_paths[index]))
+            renamed_from.add(old)
+        else:
+            still_added.append(b_paths[index])
+    still_removed = [a_paths[index] for index in removed
+                     if index not in renamed_from]
+    return SnapshotDiff(still_added, still_removed, modified, renamed)
@@ -1,12 +1,16 @@
-from fileutils.interface import BaseFile, FileSystem, MountPoint
+from fileutils.interface import BaseFile, FileSystem, MountPoint, FileStat
 from fileutils.mixins import ChildrenMixin
 from fileutils.constants import FILE, FOLDER, LINK
+from fileutils.exceptions import generate
+from fileutils.attributes import PosixPermissions, Timestamps
+from fileutils.metrics import measure, wrap_stream, unwrap_stream
 from fileutils import local, exceptions
 import os.path # for expanduser, used to find ~/.ssh/id_rsa
 import posixpath
 import stat
 import pipes
 import getpass
+import threading
 import sys
 
 try:
@@ -16,6 +20,10 @@ except ImportError:
     paramiko = None
     PartialAuthentication = None
 
+__all__ = ["SSHFileSystem", "Authenticator", "FirstOf", "Password",
+           "InteractivePassword", "Key", "Agent", "User", "SSHFile",
+           "SSHPermissions", "SSHTimestamps", "ssh_connect"]
+
 try:
     basestring
 except NameError: # Python 3
@@ -122,6 +130,10 @@ class SSHFileSystem(FileSystem):
         return getpass.getuser()
     
     def close(self):
+        # Close any SFTP sessions fileutils.aio opened on our connection too
+        aio = sys.modules.get("fileutils.aio")
+        if aio is not None:
+            aio._Sessions.close_all(self)
         if self._autoclose:
             self._transport.close()
     
@@ -138,7 +150,7 @@ class SSHFileSystem(FileSystem):
             self.close()
     
     def child(self, *path_components):
-        return SSHFile(self, posixpath.join("/", path_components))
+        return SSHFile(self, posixpath.join("/", *path_components))
     
     @property
     def roots(self):
@@ -256,9 +268,9 @@ class InteractivePassword(Authenticator):
                 raise
             except paramiko.AuthenticationException:
                 if attempt == self._attempts - 1:
-                    print 'Permission denied.'
+                    print('Permission denied.')
                 else:
-                    print 'Permission denied, please try again.'
+                    print('Permission denied, please try again.')
         raise paramiko.AuthenticationException('All provided passwords failed.')
 
 
@@ -425,11 +437,17 @@ class SSHFile(ChildrenMixin, BaseFile):
         self._path = posixpath.normpath(path)
         while self._path.startswith("//"):
             self._path = self._path[1:]
+        # The paramiko.SFTPAttributes the server sent for us as part of a
+        # listing, if we came from one (see children)
+        self._listing = None
     
     @property
     def _client(self):
         return self._filesystem._client
     
+    def _measure(self, operation, bytes=0):
+        return measure(self._filesystem.metrics, operation, bytes)
+    
     @staticmethod
     def connect(host, username=None, password=None, port=22):
         """
@@ -539,34 +557,148 @@ class SSHFile(ChildrenMixin, BaseFile):
     @property
     def link_target(self):
         if self.is_link:
-            return self._client.readlink(self.path)
+            with self._measure("readlink"):
+                return self._client.readlink(self.path)
         else:
             return None
     
     def open_for_reading(self):
-        f = self._client.open(self.path, "rb")
+        if self._filesystem.block_cache is not None:
+            f = self._open_cached(self._filesystem.block_cache)
+        else:
+            with self._measure("open"):
+                f = self._client.open(self.path, "rb")
         # Keep our connection open as long as a reference to this file is held
         f._fileutils_filesystem = self._filesystem
-        return f
+        return wrap_stream(self._filesystem.metrics, f)
+    
+    def _open_cached(self, cache):
+        with self._measure("stat"):
+            s = self._client.stat(self.path)
+        validator = "{0}:{1}".format(s.st_size, int(s.st_mtime) * 1000000000)
+        # Only open the file on the server once we actually miss the cache
+        handles = []
+        lock = threading.Lock()
+        def fetch(offset, length):
+            with lock:
+                if not handles:
+                    with self._measure("open"):
+                        handles.append(self._client.open(self.path, "rb"))
+                handles[0].seek(offset)
+                return handles[0].read(length)
+        def close():
+            with lock:
+                for handle in handles:
+                    handle.close()
+        return cache.open(self.url, validator, s.st_size, fetch, close)
     
     @property
     def type(self):
         try:
-            s = self._client.lstat(self.path)
+            with self._measure("stat"):
+                s = self._client.lstat(self.path)
         except IOError:
             return None
-        if stat.S_ISREG(s.st_mode):
-            return FILE
-        if stat.S_ISDIR(s.st_mode):
-            return FOLDER
+        return _file_type(s.st_mode)
+    
+    @property
+    def stat(self):
+        try:
+            with self._measure("stat"):
+                s = self._client.lstat(self.path)
+        except IOError:
+            return None
+        return _file_stat(s)
+    
+    @property
+    def attributes(self):
+        return {
+            PosixPermissions: SSHPermissions(self),
+            Timestamps: SSHTimestamps(self)
+        }
+    
+    @property
+    def _cached_stat(self):
+        if self._listing is not None:
+            return _file_stat(self._listing)
+        return self.stat
+    
+    def _lstat(self):
+        # Our attributes as of the listing we came from, if any, and as of
+        # now otherwise
+        if self._listing is not None:
+            return self._listing
+        with self._measure("stat"):
+            return self._client.lstat(self._path)
+    
+    def _setstat(self, attributes, stream=None):
+        # Apply attributes, a paramiko.SFTPAttributes, to this file. If
+        # stream (open for writing to this file) is given, the request is
+        # sent through its handle behind the writes already sent over it, and
+        # its reply is collected when the stream is closed; it therefore
+        # costs no round trip of its own.
+        if stream is not None:
+            stream.flush()
+            stream.set_pipelined(True)
+            stream.sftp._async_request(stream, paramiko.sftp.CMD_FSETSTAT,
+                                       stream.handle, attributes)
+            return
+        # SETSTAT follows symbolic links, so leave them alone like
+        # PosixLocalPermissions does rather than changing their targets
+        s = self._lstat()
         if stat.S_ISLNK(s.st_mode):
-            return LINK
-        return "fileutils.OTHER"
+            return
+        with self._measure("setstat"):
+            self._client._request(paramiko.sftp.CMD_SETSTAT, self._path,
+                                  attributes)
+        # Keep what we remember from our listing up to date
+        if attributes.st_mode is not None:
+            s.st_mode = stat.S_IFMT(s.st_mode) | attributes.st_mode
+        if attributes.st_mtime is not None:
+            s.st_atime, s.st_mtime = attributes.st_atime, attributes.st_mtime
+    
+    @property
+    def children(self):
+        """
+        Same as BaseFile.children, but each child remembers the attributes
+        the server sent for it as part of the listing, and its PosixPermissions
+        and Timestamps attribute sets (along with copy_to's progress totals
+        and snapshot_tree) read them from there instead of asking the server
+        again. Copying a folder from an SSH server (or taking a snapshot of
+        one) therefore costs no round trips per file for its attributes. The
+        stat property still asks the server every time.
+        
+        Those attributes are a snapshot as of the listing; changes made to a
+        child through its attribute sets are reflected in it, but changes
+        made by anything else aren't. Use self.child(name) to get a file
+        whose attributes are always fetched afresh.
+        
+        Children of files that the listing they came from says are neither
+        folders nor links are None without asking the server, so recursing
+        costs one request per folder.
+        """
+        if self._listing is not None and not (
+                stat.S_ISDIR(self._listing.st_mode) or
+                stat.S_ISLNK(self._listing.st_mode)):
+            return None
+        try:
+            with self._measure("list"):
+                entries = self._client.listdir_attr(self._path)
+        # Same as child_names
+        except IOError:
+            return None
+        children = []
+        for entry in sorted(entries, key=lambda entry: entry.filename):
+            child = self.child(entry.filename)
+            child._listing = entry
+            children.append(child)
+        return children
     
     @property
     def child_names(self):
         try:
-            return sorted(self._client.listdir(self._path))
+            with self._measure("list"):
+                return sorted(self._client.listdir(self._path))
         # TODO: This could mask permissions issues and such, but I'm not
         # sure there's a better way to do it without incuring extra (and
         # usually unneeded) requests against the connection
@@ -574,56 +706,116 @@ class SSHFile(ChildrenMixin, BaseFile):
             return None
     
     def create_folder(self, ignore_existing=False, recursive=False):
-        if recursive and not self.parent.exists:
-            self.parent.create_folder(recursive=True)
         try:
-            self._client.mkdir(self._path)
-        except IOError:
-            if self.is_folder and ignore_existing:
+            with self._measure("mkdir"), _Convert(self, creating=True):
+                self._client.mkdir(self._path)
+        except exceptions.FileExistsError:
+            if ignore_existing and self.is_folder:
                 return
-            else:
+            raise
+        except exceptions.FileNotFoundError:
+            parent = self.parent
+            if not recursive or parent is None:
                 raise
+            parent.create_folder(ignore_existing=True, recursive=True)
+            self.create_folder(ignore_existing=ignore_existing)
     
     def delete(self, ignore_missing=False):
+        # Try deleting ourselves as a file first, which is what we usually
+        # are, and only spend a round trip finding out what we are if that
+        # fails
         try:
-            file_type = self.type
-            if file_type is FOLDER: # Folder that's not a link
-                for child in self.children:
-                    child.delete()
-            if file_type is FOLDER:
-                self._client.rmdir(self._path)
-            else:
+            with self._measure("remove"), _Convert(self):
                 self._client.remove(self._path)
-        except IOError:
-            if not self.exists and ignore_missing:
-                return
-            else:
+            return
+        except EnvironmentError:
+            file_type = self.type
+            if file_type is None:
+                if ignore_missing:
+                    return
+                raise generate(exceptions.FileNotFoundError, self._path)
+            if file_type is not FOLDER: # Links to folders are files here
                 raise
+        for child in self.children:
+            child.delete()
+        with self._measure("remove"), _Convert(self):
+            self._client.rmdir(self._path)
     
     def link_to(self, other):
         if isinstance(other, SSHFile):
-            self._client.symlink(other.path, self.path)
-        elif isinstance(other, basestring):
-            self._client.symlink(other, self.path)
-        else:
+            other = other.path
+        elif not isinstance(other, basestring):
             raise ValueError("Can't make a symlink from {0!r} to {1!r}".format(self, other))
+        with self._measure("symlink"), _Convert(self, creating=True):
+            self._client.symlink(other, self.path)
     
-    def open_for_writing(self, append=False):
-        f = self._client.open(self.path, "wb")
+    def open_for_writing(self, append=False, exclusive=False):
+        mode = "ab" if append else "wb"
+        if exclusive:
+            mode += "x"
+        with self._measure("open"), _Convert(self, creating=exclusive):
+            f = self._client.open(self.path, mode)
         f._fileutils_filesystem = self._filesystem
-        return f
+        return wrap_stream(self._filesystem.metrics, f)
+    
+    def _sync_stream(self, stream):
+        stream.flush()
+        with self._measure("sync"):
+            _fsync(self._client, stream.handle)
+    
+    def _sync(self):
+        try:
+            with self._measure("open"):
+                f = self._client.open(self._path, "rb")
+        except IOError:
+            # Folders can't be opened (or synced) over SFTP
+            return
+        try:
+            with self._measure("sync"):
+                _fsync(self._client, f.handle)
+        finally:
+            f.close()
+    
+    def _rename_over(self, other):
+        if isinstance(other, SSHFile) and self._filesystem is other._filesystem:
+            try:
+                # posix-rename@openssh.com, which replaces other atomically
+                with self._measure("rename"), _Convert(self):
+                    self._client.posix_rename(self._path, other._path)
+                return
+            except exceptions.FileNotFoundError:
+                raise
+            except EnvironmentError as e:
+                # A generic failure probably means the server doesn't support
+                # posix-rename, so fall back to deleting other first. Anything
+                # more specific is a real error.
+                if e.errno is not None:
+                    raise
+        BaseFile._rename_over(self, other)
+    
+    def directory_writer(self, workers=None):
+        """
+        Same as BaseFile.directory_writer, but each of the writer's threads
+        writes over an SFTP session of its own, and the writes are pipelined,
+        so writing a small file costs two round trips and write_many keeps
+        one of those in flight per worker.
+        """
+        from fileutils.bulk import _SSHDirectoryWriter
+        return _SSHDirectoryWriter(self, workers)
     
     def rename_to(self, other):
         # If we're on the same file system as other, optimize this to a remote
         # side rename
         if isinstance(other, SSHFile) and self._filesystem is other._filesystem:
-            self._client.rename(self._path, other._path)
+            with self._measure("rename"), _Convert(self):
+                self._client.rename(self._path, other._path)
         else:
             return BaseFile.rename_to(self, other)
     
     @property
     def size(self):
-        return self._client.stat(self._path).st_size
+        with self._measure("stat"):
+            return self._client.stat(self._path).st_size
 
     def __str__(self):
         return "<fileutils.SSHFile {0!r} on {1!s}>".format(self._path, self._filesystem._client_name)
@@ -631,6 +823,134 @@ class SSHFile(ChildrenMixin, BaseFile):
     __repr__ = __str__
 
 
+class SSHPermissions(PosixPermissions):
+    def __init__(self, f, stream=None):
+        self._file = f
+        # A stream open for writing to our file, if for_stream gave us one
+        self._stream = stream
+    
+    @property
+    def mode(self):
+        s = self._file._lstat()
+        if stat.S_ISLNK(s.st_mode):
+            with self._file._measure("stat"):
+                s = self._file._client.stat(self._file.path)
+        return s.st_mode
+    
+    @mode.setter
+    def mode(self, value):
+        attributes = paramiko.SFTPAttributes()
+        attributes.st_mode = stat.S_IMODE(value)
+        self._file._setstat(attributes, self._stream)
+    
+    def for_stream(self, stream):
+        return SSHPermissions(self._file, _writable_stream(stream))
+    
+    def __repr__(self):
+        return "<SSHPermissions for {0!r}>".format(self._file)
+    
+    __str__ = __repr__
+
+
+class SSHTimestamps(Timestamps):
+    def __init__(self, f, stream=None):
+        self._file = f
+        # A stream open for writing to our file, if for_stream gave us one
+        self._stream = stream
+    
+    def get(self):
+        s = _file_stat(self._file._lstat())
+        return s.atime_ns, s.mtime_ns
+    
+    def set(self, atime_ns, mtime_ns):
+        # SFTP only deals in whole seconds
+        attributes = paramiko.SFTPAttributes()
+        attributes.st_atime = atime_ns // 1000000000
+        attributes.st_mtime = mtime_ns // 1000000000
+        self._file._setstat(attributes, self._stream)
+    
+    def for_stream(self, stream):
+        return SSHTimestamps(self._file, _writable_stream(stream))
+    
+    def __repr__(self):
+        return "<SSHTimestamps for {0!r}>".format(self._file)
+    
+    __str__ = __repr__
+
+
+class _Convert(object):
+    """
+    Like fileutils.exceptions.Convert, but for the IOErrors paramiko raises.
+    
+    SFTP v3 only has status codes for a handful of errors, and reports
+    everything else (notably, trying to create a file or folder that already
+    exists) as a generic failure, which paramiko raises without an errno. If
+    creating is True, such failures are classified with an lstat of the file
+    in question, and turned into FileExistsError if it turns out to exist.
+    This costs a round trip, but only once something has already failed.
+    """
+    def __init__(self, f, creating=False):
+        self.file = f
+        self.creating = creating
+    
+    def __enter__(self):
+        pass
+    
+    def __exit__(self, exception_type, value, traceback):
+        if not isinstance(value, EnvironmentError):
+            return
+        if (value.errno is None and self.creating and
+                self.file.type is not None):
+            raise generate(exceptions.FileExistsError, self.file._path)
+        new_exception = exceptions.convert(value, self.file._path)
+        if new_exception is not value:
+            raise new_exception
+
+
+def _writable_stream(stream):
+    # stream if attributes can be set through it, or None if they have to be
+    # set by path instead (as they do through the streams BlockCache hands
+    # out for reading, which aren't paramiko.SFTPFiles)
+    stream = unwrap_stream(stream)
+    if isinstance(stream, paramiko.SFTPFile):
+        return stream
+    return None
+
+
+def _fsync(client, handle):
+    # Ask the server to fsync the file open as handle, if it supports OpenSSH's
+    # fsync@openssh.com extension (which paramiko has no wrapper for)
+    try:
+        client._request(paramiko.sftp.CMD_EXTENDED, "fsync@openssh.com",
+                        handle)
+    except IOError:
+        pass
+
+
+def _file_type(mode):
+    if stat.S_ISREG(mode):
+        return FILE
+    if stat.S_ISDIR(mode):
+        return FOLDER
+    if stat.S_ISLNK(mode):
+        return LINK
+    return "fileutils.OTHER"
+
+
+def _file_stat(attributes):
+    """
+    Convert a paramiko.SFTPAttributes into a FileStat. SFTP v3 only gives us
+    whole-second timestamps and no inode numbers.
+    """
+    mtime_ns = atime_ns = None
+    if attributes.st_mtime is not None:
+        mtime_ns = int(attributes.st_mtime) * 1000000000
+    if attributes.st_atime is not None:
+        atime_ns = int(attributes.st_atime) * 1000000000
+    return FileStat(_file_type(attributes.st_mode), attributes.st_size,
+                    mtime_ns, atime_ns, None, attributes.st_mode)
+
+
 def ssh_connect(host, username):
     """
     Obsolete; use SSHFileSystem.connect instead. Present only for backward
@@ -0,0 +1,543 @@
+"""
+Tar archive support.
+
+:obj:`TarFile` exposes the contents of an existing tar archive, either
+uncompressed or gzip-compressed, as read-only BaseFile instances::
+
+    archive = TarFile(File("build.tar.gz"))
+    archive.child("bin", "tool").copy_to(File("tool"))
+
+Tar archives have no central directory, so the first time an archive is
+opened it has to be scanned from start to finish to find out where each
+member's data lives. That scan can be avoided on later opens by passing an
+index file, in which the result of the scan is stored::
+
+    archive = TarFile(File("build.tar.gz"),
+                      index=File("build.tar.gz.index"))
+"""
+
+from fileutils.interface import BaseFile, FileSystem, FileStat
+from fileutils.mixins import ChildrenMixin
+from fileutils.constants import FILE, FOLDER, LINK
+from fileutils.exceptions import generate
+from fileutils import exceptions
+import threading
+import posixpath
+import tarfile
+import bisect
+import json
+import zlib
+
+__all__ = ["TarFileSystem", "TarFile"]
+
+_INDEX_FORMAT = "fileutils-tar-index-1"
+
+_GZIP_MAGIC = b"\x1f\x8b"
+
+# Read this much compressed data at a time. Even a block of nothing but
+# zeros can only inflate to about 16 MB.
+_GZIP_BLOCK_SIZE = 16384
+
+_TYPE_NAMES = {FILE: "file", FOLDER: "folder", LINK: "link"}
+_TYPES = dict((name, file_type) for file_type, name in _TYPE_NAMES.items())
+
+
+class _Member(object):
+    """
+    What we know about a single member of an archive.
+    """
+    __slots__ = ["type", "size", "offset", "mtime", "mode", "link_target"]
+
+    def __init__(self, type, size, offset, mtime, mode, link_target):
+        self.type = type
+        self.size = size
+        self.offset = offset
+        self.mtime = mtime
+        self.mode = mode
+        self.link_target = link_target
+
+
+class TarFileSystem(FileSystem):
+    """
+    A read-only FileSystem exposing the contents of a tar archive.
+
+    When a TarFileSystem is created, the archive is scanned once to build an
+    in-memory index of its members, recording where each member's data
+    starts. Listing folders and looking up types and sizes only consult that
+    index, and opening a member of an uncompressed archive seeks straight to
+    its data, so copy_to, hash and read_blocks on a member only read that
+    member's bytes. The archive can be stored on any backend whose read
+    streams can seek, such as File and SSHFile.
+
+    gzip streams can't be entered at an arbitrary point, so for
+    gzip-compressed archives the scan also records a checkpoint of the
+    decompressor's state roughly every span bytes of uncompressed data.
+    Opening a member then only has to decompress from the nearest checkpoint
+    before it, which bounds the cost of reading a member near the end of a
+    huge archive at about span bytes of wasted decompression instead of
+    everything that comes before it. Checkpoints hold about 40 KB of
+    decompressor state each, so they're kept in memory only.
+
+    If index is given, it should be a BaseFile to store the member index in.
+    If it exists and was built from an archive of the same size and
+    modification time, it's loaded instead of scanning the archive;
+    otherwise the archive is scanned and the index written out. Checkpoints
+    for a compressed archive whose index was loaded from a file are built
+    the first time a member is opened, with a single pass over the archive
+    that doesn't have to parse any tar headers.
+
+    Hard links within the archive are exposed as regular files sharing
+    their target's data. Members other than files, folders, symbolic links
+    and hard links (devices, FIFOs, and sparse files) are left out.
+
+    Instances are usually created implicitly by passing the archive to
+    :obj:`TarFile`. TarFileSystem instances can be used as context managers
+    to close the stream they keep open on the archive.
+    """
+    def __init__(self, archive, index=None, span=32 * 2**20):
+        self._archive = archive
+        self._span = span
+        self._lock = threading.Lock()
+        self._checkpoint_lock = threading.Lock()
+        self._checkpoints = None
+        self._stream = archive.open_for_reading()
+        try:
+            self._compressed = self._read_at(0, 2) == _GZIP_MAGIC
+            archive_stat = archive.stat
+            validator = [archive_stat.size, archive_stat.mtime_ns]
+            members = None
+            if index is not None and index.exists:
+                members = _load_index(index.read(), validator)
+            if members is None:
+                members = self._scan()
+                if index is not None:
+                    with index.open_for_writing() as stream:
+                        stream.write(_dump_index(members, validator))
+        except:
+            self._stream.close()
+            raise
+        self._members = {}
+        self._folders = {"": set()}
+        for name, member in members:
+            components = name.split("/")
+            for end in range(len(components)):
+                parent = "/".join(components[:end])
+                self._folders.setdefault(parent, set()).add(components[end])
+            if member.type is FOLDER:
+                self._folders.setdefault(name, set())
+                self._members.pop(name, None)
+            else:
+                self._members[name] = member
+
+    @property
+    def archive(self):
+        """
+        The BaseFile containing the archive.
+        """
+        return self._archive
+
+    def child(self, *path_components):
+        return TarFile(self, posixpath.join("/", *path_components))
+
+    @property
+    def roots(self):
+        return [TarFile(self, "/")]
+
+    def close(self):
+        self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _read_at(self, offset, length):
+        with self._lock:
+            self._stream.seek(offset)
+            return self._stream.read(length)
+
+    def _scan(self):
+        # Return a list of (name, _Member) tuples for all members of the
+        # archive, in the order they appear in it
+        if self._compressed:
+            source = _GzipScanner(self, self._span)
+            tar = tarfile.open(fileobj=source, mode="r|")
+        else:
+            tar = tarfile.open(fileobj=_ArchiveReader(self), mode="r:")
+        members = []
+        by_name = {}
+        with tar:
+            for info in tar:
+                name = _normalize(info.name)
+                if name is None:
+                    continue
+                if info.isdir():
+                    member = _Member(FOLDER, 0, 0, info.mtime, info.mode, None)
+                elif info.issym():
+                    member = _Member(LINK, 0, 0, info.mtime, info.mode,
+                                     info.linkname)
+                elif info.islnk():
+                    target = by_name.get(_normalize(info.linkname))
+                    if target is None or target.type is not FILE:
+                        continue
+                    member = _Member(FILE, target.size, target.offset,
+                                     info.mtime, info.mode, None)
+                elif info.isfile() and not info.issparse():
+                    member = _Member(FILE, info.size, info.offset_data,
+                                     info.mtime, info.mode, None)
+                else:
+                    continue
+                by_name[name] = member
+                members.append((name, member))
+        if self._compressed:
+            self._checkpoints = source.checkpoints
+        return members
+
+    def _open(self, member):
+        if not self._compressed:
+            return _MemberStream(self._plain_chunks(member), member.size)
+        return _MemberStream(self._gzip_chunks(member), member.size)
+
+    def _plain_chunks(self, member):
+        offset, remaining = member.offset, member.size
+        while remaining > 0:
+            data = self._read_at(offset, min(65536, remaining))
+            if not data:
+                raise tarfile.ReadError("Unexpected end of archive")
+            offset += len(data)
+            remaining -= len(data)
+            yield data
+
+    def _gzip_chunks(self, member):
+        checkpoints = self._get_checkpoints()
+        # Start from the last checkpoint at or before the member's data
+        index = bisect.bisect_right([c[0] for c in checkpoints],
+                                    member.offset) - 1
+        if index >= 0:
+            position, input_position, decompressor = checkpoints[index]
+            decompressor = decompressor.copy()
+        else:
+            position, input_position = 0, 0
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        end = member.offset + member.size
+        while position < end:
+            data = self._read_at(input_position, _GZIP_BLOCK_SIZE)
+            if not data:
+                raise tarfile.ReadError("Unexpected end of archive")
+            input_position += len(data)
+            output, decompressor = _inflate(decompressor, data)
+            start = position
+            position += len(output)
+            if position <= member.offset:
+                continue
+            yield output[max(member.offset - start, 0):end - start]
+
+    def _get_checkpoints(self):
+        with self._checkpoint_lock:
+            if self._checkpoints is None:
+                scanner = _GzipScanner(self, self._span)
+                while scanner.read(2**20):
+                    pass
+                self._checkpoints = scanner.checkpoints
+            return self._checkpoints
+
+    def __repr__(self):
+        return "<fileutils.TarFileSystem on {0!r}>".format(self._archive)
+
+    __str__ = __repr__
+
+
+class TarFile(ChildrenMixin, BaseFile):
+    """
+    A read-only BaseFile implementation exposing a member of a tar archive.
+
+    TarFile(archive) returns the root folder of the specified archive, which
+    can be any BaseFile (or an existing :obj:`TarFileSystem`); members are
+    obtained from it with child() as usual::
+
+        archive = TarFile(SSHFile.connect(...).child("backups", "big.tar"))
+        archive.child("etc", "passwd").read()
+
+    index and span are passed to :obj:`TarFileSystem`, which describes how
+    the archive is read.
+    """
+    _sep = "/"
+
+    def __init__(self, archive, path="/", index=None, span=32 * 2**20):
+        if not isinstance(archive, TarFileSystem):
+            archive = TarFileSystem(archive, index, span)
+        self._filesystem = archive
+        self._path = posixpath.normpath(path)
+        while self._path.startswith("//"):
+            self._path = self._path[1:]
+
+    @property
+    def filesystem(self):
+        return self._filesystem
+
+    def _with_path(self, new_path):
+        return TarFile(self._filesystem, new_path)
+
+    @property
+    def _name(self):
+        # Our key in the filesystem's index
+        return self._path.lstrip("/")
+
+    @property
+    def _member(self):
+        return self._filesystem._members.get(self._name)
+
+    def get_path_components(self, relative_to=None):
+        if relative_to:
+            if not isinstance(relative_to, TarFile):
+                raise ValueError("relative_to must be another TarFile "
+                                 "instance")
+            return posixpath.relpath(self._path, relative_to._path).split("/")
+        return self._path.split("/")
+
+    @property
+    def parent(self):
+        parent = posixpath.dirname(self._path)
+        if parent == self._path:
+            return None
+        return self._with_path(parent)
+
+    def child(self, *names):
+        return self._with_path(posixpath.join(self._path, *names))
+
+    @property
+    def type(self):
+        if self._name in self._filesystem._folders:
+            return FOLDER
+        member = self._member
+        if member is None:
+            return None
+        return member.type
+
+    @property
+    def stat(self):
+        file_type = self.type
+        if file_type is None:
+            return None
+        member = self._member
+        if member is None: # Implicit folder
+            return FileStat(file_type, 0)
+        return FileStat(file_type, member.size,
+                        int(member.mtime) * 1000000000, None, None,
+                        member.mode)
+
+    @property
+    def child_names(self):
+        names = self._filesystem._folders.get(self._name)
+        if names is None:
+            return None
+        return sorted(names)
+
+    @property
+    def link_target(self):
+        member = self._member
+        if member is None or member.type is not LINK:
+            return None
+        return member.link_target
+
+    @property
+    def size(self):
+        if self.is_folder:
+            return sum(f.size for f in self.children)
+        member = self.dereference(True)._member
+        if member is None:
+            return 0
+        return member.size
+
+    def open_for_reading(self):
+        member = self.dereference(True)._member
+        if member is None or member.type is not FILE:
+            raise generate(exceptions.FileNotFoundError, self._path)
+        return self._filesystem._open(member)
+
+    def __cmp__(self, other):
+        if not isinstance(other, TarFile):
+            return NotImplemented
+        return (cmp(id(self._filesystem), id(other._filesystem)) or
+                cmp(self._path, other._path))
+
+    def __hash__(self):
+        return hash((id(self._filesystem), self._path))
+
+    def __str__(self):
+        return "<fileutils.TarFile {0!r} in {1!r}>".format(
+            self._path, self._filesystem._archive)
+
+    __repr__ = __str__
+
+
+class _MemberStream(object):
+    """
+    A read-only stream over the data of a single member, produced by a
+    generator of chunks of that data.
+    """
+    def __init__(self, chunks, size):
+        self._chunks = chunks
+        self._remaining = size
+        self._buffer = b""
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._remaining + len(self._buffer)
+        pieces = [self._buffer]
+        buffered = len(self._buffer)
+        while buffered < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._remaining -= len(chunk)
+            pieces.append(chunk)
+            buffered += len(chunk)
+        data = b"".join(pieces)
+        data, self._buffer = data[:size], data[size:]
+        return data
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self._chunks.close()
+        self._buffer = b""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _ArchiveReader(object):
+    """
+    A seekable file-like object over an uncompressed archive that shares the
+    archive's stream, for tarfile to scan.
+    """
+    def __init__(self, filesystem):
+        self._filesystem = filesystem
+        self._position = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = 2**62
+        data = self._filesystem._read_at(self._position, size)
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self._position = offset
+        elif whence == 1:
+            self._position += offset
+        else:
+            raise ValueError("Can't seek relative to the end of an archive")
+
+    def tell(self):
+        return self._position
+
+
+class _GzipScanner(object):
+    """
+    A file-like object that decompresses a gzip-compressed archive from
+    start to finish, recording checkpoints along the way.
+
+    Each checkpoint is a tuple of (uncompressed offset, compressed offset,
+    decompressor). Feeding a copy of the decompressor the data starting at
+    the compressed offset produces the data starting at the uncompressed
+    offset.
+    """
+    def __init__(self, filesystem, span):
+        self._filesystem = filesystem
+        self._span = span
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._position = 0
+        self._input_position = 0
+        self._next_checkpoint = span
+        self._buffer = b""
+        self._done = False
+        self.checkpoints = []
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = 2**62
+        pieces = [self._buffer]
+        buffered = len(self._buffer)
+        while buffered < size and not self._done:
+            data = self._filesystem._read_at(self._input_position,
+                                             _GZIP_BLOCK_SIZE)
+            if not data.strip(b"\0"):
+                # End of the archive, possibly followed by padding
+                self._done = True
+                break
+            self._input_position += len(data)
+            output, self._decompressor = _inflate(self._decompressor, data)
+            self._position += len(output)
+            # Every byte we've read has been consumed, so the decompressor's
+            # state lines up exactly with our input and output positions
+            if self._position >= self._next_checkpoint:
+                self.checkpoints.append((self._position, self._input_position,
+                                         self._decompressor.copy()))
+                self._next_checkpoint = self._position + self._span
+            pieces.append(output)
+            buffered += len(output)
+        data = b"".join(pieces)
+        data, self._buffer = data[:size], data[size:]
+        return data
+
+
+def _inflate(decompressor, data):
+    # Decompress data, moving on to a new decompressor whenever one gzip
+    # member ends and another begins. Returns the output and the decompressor
+    # to use for the data that follows.
+    output = decompressor.decompress(data)
+    while decompressor.unused_data.strip(b"\0"):
+        data = decompressor.unused_data
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        output += decompressor.decompress(data)
+    return output, decompressor
+
+
+def _normalize(name):
+    # Turn a member name into a relative "/"-separated path, or None if it
+    # refers to the archive's root or tries to escape from it
+    name = posixpath.normpath(name.lstrip("/"))
+    if name in (".", "", "..") or name.startswith("../"):
+        return None
+    return name
+
+
+def _dump_index(members, validator):
+    entries = [[name, _TYPE_NAMES[m.type], m.size, m.offset, m.mtime, m.mode,
+                m.link_target] for name, m in members]
+    data = {"format": _INDEX_FORMAT, "archive": validator, "members": entries}
+    if str is bytes:
+        # Python 2: names are byte strings, which latin-1 round-trips exactly
+        return json.dumps(data, encoding="latin-1")
+    # Python 3: undecodable bytes in names are lone surrogates, which JSON
+    # escapes and loads back unchanged
+    return json.dumps(data).encode("ascii")
+
+
+def _load_index(data, validator):
+    # Return the members stored in an index, or None if it's for a different
+    # version of the archive (or isn't an index at all)
+    try:
+        data = json.loads(data.decode("ascii"))
+    except ValueError:
+        return None
+    if (not isinstance(data, dict) or data.get("format") != _INDEX_FORMAT or
+            data.get("archive") != validator):
+        return None
+    members = []
+    for name, type_name, size, offset, mtime, mode, link_target in data["members"]:
+        if str is bytes:
+            name = name.encode("latin-1")
+            if link_target is not None:
+                link_target = link_target.encode("latin-1")
+        members.append((name, _Member(_TYPES[type_name], size, offset, mtime,
+                                      mode, link_target)))
+    return members
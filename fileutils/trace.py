@@ -0,0 +1,407 @@
+"""
+Recording the operations a program performs on a tree, and replaying them.
+
+Wrapping a folder in a :obj:`TracingFileSystem` and handing the program its
+root records every call the program makes on files in the tree, along with
+when it was made, on which thread, how long it took and how much data it
+moved::
+
+    fs = TracingFileSystem(File("/srv/data"))
+    run_job(fs.root)
+    with File("job.trace").open_for_writing() as stream:
+        fs.trace.dump(stream)
+
+The trace can then be replayed against any other tree, on any backend, with
+:obj:`replay`, which carries the same calls out with the same timing and
+concurrency and reports how long each took::
+
+    with File("job.trace").open_for_reading() as stream:
+        trace = Trace.load(stream)
+    metrics = replay(trace, SSHFile.connect(...).child("/srv/data"))
+    print(metrics.snapshot()["copy_to"].mean)
+
+Only the calls the program itself makes are recorded, not the calls those
+make in turn: a copy_to is recorded as a single copy_to, and replaying it
+calls copy_to on the tree being replayed against, so changes to how copy_to
+(or recurse, or the backend underneath) works show up in the replay. Calls
+spread across threads by fileutils itself (write_many, zip_into and
+chmod_tree, for example) are recorded as the individual calls they were made
+up of.
+
+Traces record the sizes of data read and written but not the data itself;
+replays write zeroes. Files outside the traced tree that calls refer to (the
+targets of a copy_to to elsewhere, say) are replayed against a separate
+scratch tree, which defaults to an empty :obj:`MemoryFileSystem
+<fileutils.memory.MemoryFileSystem>`.
+"""
+
+from fileutils.wrapper import WrapperFileSystem
+from fileutils.metrics import Metrics
+import itertools
+import threading
+import json
+import time
+
+__all__ = ["Trace", "TracingFileSystem", "replay"]
+
+
+class Trace(object):
+    """
+    A recording of the operations carried out on a :obj:`TracingFileSystem`.
+
+    Each event is a dictionary with the following keys, along with the
+    details of the operation's arguments described under
+    :obj:`WrapperFileSystem._call
+    <fileutils.wrapper.WrapperFileSystem._call>`:
+
+     * operation: the name of the operation, such as "copy_to"
+     * path: the path, relative to the root of the traced tree, of the file
+       it was performed on
+     * time: when it started, in seconds since the trace was created
+     * duration: how long it took, in seconds; for recurse and read_blocks,
+       this is how long it was until the generator they returned was
+       exhausted or closed
+     * thread: the number of the thread that performed it, counting up from
+       0 in the order threads first appear in the trace
+     * bytes: the number of bytes read or written, for operations that read
+       or write data
+     * count: the number of files or blocks yielded, for recurse and
+       read_blocks
+     * error: the name of the exception's class, if it raised one
+
+    Trace instances are safe to record into from multiple threads.
+    """
+    def __init__(self, events=()):
+        self._events = list(events)
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._threads = {}
+
+    @property
+    def events(self):
+        """
+        A list of the events recorded so far, in the order they finished.
+        """
+        with self._lock:
+            return list(self._events)
+
+    def _record(self, start, duration, event):
+        with self._lock:
+            thread = threading.current_thread()
+            number = self._threads.get(thread)
+            if number is None:
+                number = self._threads[thread] = len(self._threads)
+            event["time"] = start - self._start
+            event["duration"] = duration
+            event["thread"] = number
+            self._events.append(event)
+
+    def __len__(self):
+        return len(self._events)
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def dump(self, stream):
+        """
+        Write this trace to the specified binary stream, as one line of JSON
+        per event.
+        """
+        for event in self.events:
+            stream.write(json.dumps(event, sort_keys=True).encode("utf-8") +
+                         b"\n")
+
+    @staticmethod
+    def load(stream):
+        """
+        Read a trace written by :obj:`dump` from the specified binary stream
+        and return it.
+        """
+        return Trace(json.loads(line.decode("utf-8")) for line in stream
+                     if line.strip())
+
+    def __repr__(self):
+        return "<fileutils.Trace: {0} events>".format(len(self._events))
+
+    __str__ = __repr__
+
+
+class TracingFileSystem(WrapperFileSystem):
+    """
+    A :obj:`WrapperFileSystem <fileutils.wrapper.WrapperFileSystem>` that
+    records every operation performed on its files in a :obj:`Trace`.
+
+    trace is the Trace to record into; a new one is created if it's None.
+    """
+    def __init__(self, wrapped, trace=None):
+        WrapperFileSystem.__init__(self, wrapped)
+        self._trace = trace if trace is not None else Trace()
+        self._local = threading.local()
+
+    @property
+    def trace(self):
+        """
+        The :obj:`Trace` this filesystem records into.
+        """
+        return self._trace
+
+    def _call(self, f, operation, details, function, *args):
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        start = time.time()
+        try:
+            result = function(*args)
+        except Exception as e:
+            if not depth:
+                event = _event(f, operation, details)
+                event["error"] = type(e).__name__
+                self._trace._record(start, time.time() - start, event)
+            raise
+        finally:
+            self._local.depth = depth
+        if not depth:
+            event = _event(f, operation, details)
+            if operation in _READS:
+                event["bytes"] = len(result)
+            elif "size" in details and operation in _WRITES:
+                event["bytes"] = details["size"]
+            self._trace._record(start, time.time() - start, event)
+        return result
+
+    def _iterate(self, f, operation, details, function, *args):
+        if getattr(self._local, "depth", 0):
+            return function(*args)
+        return self._traced_generator(f, operation, details, function(*args))
+
+    def _traced_generator(self, f, operation, details, generator):
+        start = time.time()
+        event = _event(f, operation, details)
+        count = 0
+        size = 0
+        try:
+            while True:
+                self._local.depth = 1
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    break
+                finally:
+                    self._local.depth = 0
+                count += 1
+                if operation == "read_blocks":
+                    size += len(item)
+                yield item
+        except GeneratorExit:
+            generator.close()
+            raise
+        except Exception as e:
+            event["error"] = type(e).__name__
+            raise
+        finally:
+            event["count"] = count
+            if operation == "read_blocks":
+                event["bytes"] = size
+            self._trace._record(start, time.time() - start, event)
+
+    def __repr__(self):
+        return "<fileutils.TracingFileSystem of {0!r}>".format(self._wrapped)
+
+    __str__ = __repr__
+
+
+# Operations whose result is the data they read
+_READS = set(["read", "stream.read", "stream.readline"])
+# Operations whose details' size is the number of bytes they wrote
+_WRITES = set(["write", "append", "stream.write"])
+
+
+def _event(f, operation, details):
+    event = dict(details)
+    event["operation"] = operation
+    event["path"] = f._path
+    return event
+
+
+def replay(trace, root, external=None, timing=True, speed=1.0, metrics=None):
+    """
+    Carry out the operations recorded in trace against root, a folder on
+    any backend, and return a :obj:`Metrics <fileutils.metrics.Metrics>`
+    recording how long each took (along with the bytes it moved, and whether
+    it failed), under the same operation names as the trace.
+
+    Each thread in the trace is replayed on a thread of its own, so
+    operations that overlapped when they were recorded overlap again. If
+    timing is True, each operation is started no sooner than it was in the
+    recording, relative to the start of the replay, so that the gaps
+    between operations are preserved too; speed scales those gaps (2.0
+    replays twice as fast). If timing is False, each thread carries out its
+    operations as quickly as it can.
+
+    Files outside the traced tree are mapped to files at the same paths
+    beneath external, which defaults to the root of a new MemoryFileSystem.
+    recurse calls that were given a filter are replayed without one, but
+    stop after yielding as many files as they did when they were recorded.
+
+    Operations that fail are recorded as failed in the returned Metrics and
+    don't stop the replay. metrics can be a Metrics to record into instead of
+    a new one.
+    """
+    if external is None:
+        from fileutils.memory import MemoryFileSystem
+        external = MemoryFileSystem().root
+    if metrics is None:
+        metrics = Metrics()
+    threads = {}
+    for event in trace:
+        threads.setdefault(event["thread"], []).append(event)
+    for events in threads.values():
+        events.sort(key=lambda event: event["time"])
+    replayer = _Replayer(root, external, metrics)
+    start = time.time()
+    workers = [threading.Thread(target=replayer.run,
+                                args=(events, start if timing else None,
+                                      speed))
+               for events in threads.values()]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return metrics
+
+
+class _Replayer(object):
+    def __init__(self, root, external, metrics):
+        self._root = root
+        self._external = external
+        self._metrics = metrics
+        self._streams = {}
+
+    def run(self, events, start, speed):
+        for event in events:
+            if start is not None:
+                delay = start + event["time"] / speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            operation = event["operation"]
+            method = getattr(self, "_" + operation.replace(".", "_"), None)
+            if method is None:
+                continue
+            f = self._file({"path": event["path"]})
+            began = time.time()
+            try:
+                size = method(f, event)
+            except Exception:
+                self._metrics.record(operation, time.time() - began,
+                                     error=True)
+            else:
+                self._metrics.record(operation, time.time() - began,
+                                     size or 0)
+
+    def _file(self, description):
+        if "path" in description:
+            names = description["path"].split("/")
+            root = self._root
+        else:
+            names = description["external"].split("/")
+            root = self._external
+        names = [name for name in names if name]
+        return root.child(*names) if names else root
+
+    def _other(self, event):
+        other = self._file(event["other"])
+        if "external" in event["other"]:
+            # Make sure whatever's being copied to or from outside the tree
+            # has somewhere to go
+            other.parent.create_folder(ignore_existing=True, recursive=True)
+        return other
+
+    def _type(self, f, event):
+        f.type
+
+    def _stat(self, f, event):
+        f.stat
+
+    def _link_target(self, f, event):
+        f.link_target
+
+    def _size(self, f, event):
+        f.size
+
+    def _child_names(self, f, event):
+        f.child_names
+
+    def _open_for_reading(self, f, event):
+        self._streams[event["stream"]] = f.open_for_reading()
+
+    def _open_for_writing(self, f, event):
+        self._streams[event["stream"]] = f.open_for_writing(
+            event["append"], event["exclusive"])
+
+    def _stream_read(self, f, event):
+        return len(self._streams[event["stream"]].read(event["size"]))
+
+    def _stream_readline(self, f, event):
+        return len(self._streams[event["stream"]].readline(event["size"]))
+
+    def _stream_write(self, f, event):
+        self._streams[event["stream"]].write(b"\0" * event["size"])
+        return event["size"]
+
+    def _stream_close(self, f, event):
+        self._streams.pop(event["stream"]).close()
+
+    def _create_folder(self, f, event):
+        f.create_folder(event["ignore_existing"], event["recursive"])
+
+    def _delete(self, f, event):
+        f.delete(ignore_missing=event["ignore_missing"])
+
+    def _link_to(self, f, event):
+        target = event["target"]
+        if isinstance(target, dict):
+            target = self._file(target)
+        f.link_to(target)
+
+    def _rename_to(self, f, event):
+        f.rename_to(self._other(event))
+
+    def _rename_over(self, f, event):
+        f._rename_over(self._other(event))
+
+    def _copy_to(self, f, event):
+        f.copy_to(self._other(event), event["overwrite"],
+                  event["dereference_links"])
+
+    def _copy_into(self, f, event):
+        f.copy_into(self._other(event), event["overwrite"],
+                    event["dereference_links"])
+
+    def _merge_to(self, f, event):
+        f.merge_to(self._other(event), event["dereference_links"])
+
+    def _hash(self, f, event):
+        f.hash()
+
+    def _read(self, f, event):
+        return len(f.read())
+
+    def _write(self, f, event):
+        f.write(b"\0" * event["size"], atomic=event["atomic"])
+        return event["size"]
+
+    def _append(self, f, event):
+        f.append(b"\0" * event["size"])
+        return event["size"]
+
+    def _recurse(self, f, event):
+        generator = f.recurse(include_self=event["include_self"],
+                              recurse_skipped=event["recurse_skipped"])
+        for _ in itertools.islice(generator, event.get("count")):
+            pass
+
+    def _read_blocks(self, f, event):
+        size = 0
+        for block in itertools.islice(f.read_blocks(event["block_size"]),
+                                      event.get("count")):
+            size += len(block)
+        return size
@@ -0,0 +1,289 @@
+"""
+Rate limiting and progress reporting for transfers.
+
+:obj:`BaseFile.copy_to <fileutils.interface.BaseFile.copy_to>`,
+:obj:`merge_to <fileutils.interface.BaseFile.merge_to>`, :obj:`hash
+<fileutils.interface.BaseFile.hash>` and :obj:`read_blocks
+<fileutils.interface.BaseFile.read_blocks>` take a limiter, a
+:obj:`TokenBucket` that caps the rate at which they move data, and (all but
+read_blocks) a :obj:`Progress` that keeps track of how far along they are::
+
+    def show(progress):
+        print("{0.bytes_done}/{0.bytes_total} bytes, ETA {0.eta}".format(
+            progress))
+    limiter = TokenBucket(10 * 2**20) # 10 MB/s
+    source.copy_to(target, limiter=limiter, progress=Progress(show))
+
+A limiter can also be attached to a whole filesystem, in which case it
+applies to every transfer to or from it::
+
+    remote.filesystem.rate_limiter = TokenBucket(2**20)
+
+A single TokenBucket can be shared by any number of concurrent transfers,
+which then share its rate between them.
+"""
+
+from collections import deque
+import threading
+import time
+
+__all__ = ["TokenBucket", "Progress"]
+
+
+class TokenBucket(object):
+    """
+    A rate limiter allowing an average of rate bytes per second through,
+    with bursts of up to burst bytes (one second's worth by default).
+
+    TokenBucket instances are safe to use from multiple threads.
+    """
+    def __init__(self, rate, burst=None):
+        self._rate = float(rate)
+        self._burst = float(burst if burst is not None else rate)
+        self._tokens = self._burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        """
+        The number of bytes per second this bucket lets through. This
+        property can be modified (to lower the rate during business hours,
+        for example), and the new rate applies from then on.
+        """
+        return self._rate
+
+    @rate.setter
+    def rate(self, value):
+        with self._lock:
+            self._refill()
+            self._rate = float(value)
+
+    @property
+    def burst(self):
+        """
+        The largest number of bytes this bucket lets through at once after
+        being idle.
+        """
+        return self._burst
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self._burst,
+                           self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def consume(self, count):
+        """
+        Wait until count bytes can be let through, then let them through.
+
+        Requests larger than burst are let through too, but the bucket goes
+        into debt for them, so whoever asks next waits until the debt is
+        paid off. Callers waiting on the same bucket are let through roughly
+        in the order they asked.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= count
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+    def __repr__(self):
+        return "<fileutils.TokenBucket: {0:g} bytes/s, burst {1:g}>".format(
+            self._rate, self._burst)
+
+    __str__ = __repr__
+
+
+class Progress(object):
+    """
+    The progress of a transfer, reported to a callback as it goes.
+
+    callback is called with this Progress as its only argument whenever the
+    transfer has made progress, but no more often than once every interval
+    seconds, and once more when the transfer finishes. It's called on
+    whichever thread made the progress, so it should be quick.
+
+    Transfers given a Progress work out how many files and bytes they're
+    going to move before they start, by walking the tree being transferred.
+    A Progress can be used for more than one transfer (or by several
+    transfers at once, from different threads), in which case its totals
+    add up across all of them.
+    """
+    # How far back, in seconds, throughput is measured over
+    window = 5.0
+
+    def __init__(self, callback=None, interval=1.0):
+        self._callback = callback
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._files_done = 0
+        self._bytes_done = 0
+        self._files_total = None
+        self._bytes_total = None
+        self._started = None
+        self._finished = False
+        self._running = 0
+        self._last_report = 0
+        self._samples = deque()
+
+    @property
+    def files_done(self):
+        """
+        The number of files transferred so far.
+        """
+        return self._files_done
+
+    @property
+    def files_total(self):
+        """
+        The number of files to be transferred in all, or None if no transfer
+        has started yet.
+        """
+        return self._files_total
+
+    @property
+    def bytes_done(self):
+        """
+        The number of bytes transferred so far.
+        """
+        return self._bytes_done
+
+    @property
+    def bytes_total(self):
+        """
+        The number of bytes to be transferred in all, or None if no transfer
+        has started yet. Files that change size while they're being
+        transferred can push bytes_done past this.
+        """
+        return self._bytes_total
+
+    @property
+    def finished(self):
+        """
+        True once every transfer using this Progress has finished.
+        """
+        return self._finished
+
+    @property
+    def elapsed(self):
+        """
+        The number of seconds since the first transfer started.
+        """
+        if self._started is None:
+            return 0.0
+        return time.time() - self._started
+
+    @property
+    def throughput(self):
+        """
+        The current transfer rate in bytes per second, measured over the
+        last few seconds.
+        """
+        with self._lock:
+            if len(self._samples) < 2:
+                return 0.0
+            (first_time, first_bytes) = self._samples[0]
+            (last_time, last_bytes) = self._samples[-1]
+        if last_time <= first_time:
+            return 0.0
+        return (last_bytes - first_bytes) / (last_time - first_time)
+
+    @property
+    def eta(self):
+        """
+        The estimated number of seconds until the transfer finishes, at the
+        current throughput, or None if that can't be estimated yet.
+        """
+        if self._finished:
+            return 0.0
+        throughput = self.throughput
+        if self._bytes_total is None or not throughput:
+            return None
+        return max(self._bytes_total - self._bytes_done, 0) / throughput
+
+    def _start(self, files, bytes):
+        with self._lock:
+            now = time.time()
+            if self._started is None:
+                self._started = now
+                self._samples.append((now, 0))
+            self._files_total = (self._files_total or 0) + files
+            self._bytes_total = (self._bytes_total or 0) + bytes
+            self._running += 1
+            self._finished = False
+        self._report(True)
+
+    def _add(self, bytes):
+        with self._lock:
+            self._bytes_done += bytes
+            self._sample()
+        self._report()
+
+    def _file_done(self):
+        with self._lock:
+            self._files_done += 1
+        self._report()
+
+    def _finish(self):
+        with self._lock:
+            self._running -= 1
+            self._finished = self._running == 0
+            self._sample()
+        self._report(True)
+
+    def _sample(self):
+        # Called with the lock held
+        now = time.time()
+        self._samples.append((now, self._bytes_done))
+        while (len(self._samples) > 2 and
+               self._samples[1][0] < now - self.window):
+            self._samples.popleft()
+
+    def _report(self, force=False):
+        if self._callback is None:
+            return
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_report < self._interval:
+                return
+            self._last_report = now
+        self._callback(self)
+
+    def __repr__(self):
+        return ("<fileutils.Progress: {0}/{1} files, {2}/{3} bytes>".format(
+            self._files_done, self._files_total, self._bytes_done,
+            self._bytes_total))
+
+    __str__ = __repr__
+
+
+def _limiters(limiter, *files):
+    # The limiters that apply to a transfer between files: the one passed to
+    # the call, if any, and those of the files' filesystems, without
+    # repeating any
+    limiters = []
+    for candidate in [limiter] + [f.filesystem.rate_limiter for f in files]:
+        if candidate is not None and not any(candidate is l
+                                             for l in limiters):
+            limiters.append(candidate)
+    return limiters
+
+
+def _limit(limiters, count):
+    for limiter in limiters:
+        limiter.consume(count)
+
+
+def _copy_stream(read_from, write_to, block_size, limiters=(),
+                 progress=None):
+    # Copy everything from read_from to write_to a block at a time, letting
+    # each block through limiters and reporting it to progress
+    data = read_from.read(block_size)
+    while data:
+        _limit(limiters, len(data))
+        write_to.write(data)
+        if progress is not None:
+            progress._add(len(data))
+        data = read_from.read(block_size)
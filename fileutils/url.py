@@ -1,24 +1,53 @@
 from fileutils.interface import BaseFile, FileSystem
 from fileutils.constants import FILE, LINK
-from fileutils.local import File as _File
-from fileutils.ssh import SSHFile as _SSHFile
+from fileutils.metrics import measure, wrap_stream
 try:
-    import urllib2, urlparse
+    import urlparse
 except ImportError:
-    from urllib import request as urllib2, parse as urlparse
+    from urllib import parse as urlparse
 import os.path
 
-try:
-    import requests
-except ImportError:
-    requests = None
+__all__ = ["URLFileSystem", "URL", "sane_urlparse", "register_scheme"]
+
+# Moved permanently, found, temporary redirect and see other
+REDIRECT_CODES = (301, 302, 307, 303)
+SUCCESS_CODES = (200,)
+
+# Map of URL schemes to the functions URL uses to open URLs of those schemes,
+# as registered with register_scheme
+_schemes = {}
+
+# The requests module, once _requests has imported it, or False if it isn't
+# installed
+_requests_module = None
+
+
+def _requests():
+    # requests takes a while to import, so it's only imported when it's first
+    # needed. Returns None if it isn't installed.
+    global _requests_module
+    if _requests_module is None:
+        try:
+            import requests
+        except ImportError:
+            requests = False
+        _requests_module = requests
+    return _requests_module or None
 
-if requests:
-    REDIRECT_CODES = (requests.codes.moved_permanently,
-                      requests.codes.found,
-                      requests.codes.temporary_redirect,
-                      requests.codes.see_other)
-    SUCCESS_CODES = (requests.codes.ok,)
+
+def register_scheme(scheme, opener):
+    """
+    Register opener as the function URL(...) uses to open URLs of the
+    specified scheme, replacing any opener previously registered for it.
+
+    opener is called with the URL, as a string, and should return the file
+    it refers to, or None to have URL treat it like a URL of any other scheme
+    (using urllib2 and requests). Openers should import the backend they use
+    when they're called, not when they're defined, so that only programs
+    that actually use a scheme pay for importing its backend; the openers
+    for the built-in file, ssh and sftp schemes work this way.
+    """
+    _schemes[scheme.lower()] = opener
 
 
 def sane_urlparse(url):
@@ -70,6 +99,8 @@ class URL(BaseFile):
        converted to instances of SSHFile using SSHFile.connect().
      * file: URLs of the form file:/// are converted to instances of File,
        so they can be read, written, and listed as per usual.
+     * Schemes registered with register_scheme are converted to whatever
+       their opener returns.
      * All other schemes supported by urllib2 are supported by URL.
     """
     # NOTE: We currently discard path parameters, the query string, and the
@@ -86,39 +117,21 @@ class URL(BaseFile):
         # other File objects.
         if isinstance(url, BaseFile):
             return url
-        scheme, netloc, path, _, _, _ = sane_urlparse(url)
-        # If it's a file:// URL, return a fileutils.local.File wrapping
-        # the underlying path. The requests module doesn't like file:///
-        # URLs, and this fixes the problem quite nicely while also
-        # offering additional conveniences (like the ability to "write"
-        # to file:/// URLs).
-        # Also pretend it's a file if it doesn't have a scheme or the
-        # scheme's exactly one letter long (Windows paths look like this).
-        if scheme == "file" and url[4:7] == "://":
-            # Don't even bother trying to reconstruct the real path from the
-            # parsed url; just send in everything after file://, but prefix it
-            # with a slash just in case it's missing one.
-            return _File('/' + url[7:])
+        scheme = sane_urlparse(url).scheme
+        # Pretend it's a file if it doesn't have a scheme or the scheme's
+        # exactly one letter long (Windows paths look like this).
         if len(scheme) == 1 or not scheme:
             # Also a path. On Windows, the drive letter in a path containing
             # one will be interpreted as the scheme, hence our check for
             # single-letter schemes.
-            return _File(url)
-        # If it's an ssh:// URL, return a fileutils.ssh.SSHFile connected
-        # to the URL in question. SSHFiles learned the ability to close
-        # themselves when nothing else references them a few minutes ago,
-        # so there's no need for the user to know that the returned object
-        # is an SSHFile.
-        if scheme in ("ssh", "sftp"):
-            user_part, _, host_part = netloc.rpartition("@")
-            username, _, password = user_part.partition(":")
-            host, _, port = host_part.partition(":")
-            return _SSHFile.connect(host=host,
-                                    username=username or None,
-                                    password=password or None,
-                                    port=int(port or 22)).child(path or "/")
-        else:
-            return object.__new__(cls)
+            from fileutils.local import File
+            return File(url)
+        opener = _schemes.get(scheme)
+        if opener is not None:
+            f = opener(url)
+            if f is not None:
+                return f
+        return object.__new__(cls)
     
     def __init__(self, url):
         self._url = sane_urlparse(url)
@@ -146,9 +159,13 @@ class URL(BaseFile):
     def filesystem(self):
         return URLFileSystem(self._url.scheme, self._url.netloc)
     
+    def _head(self, url, **kwargs):
+        with measure(self.filesystem.metrics, "stat"):
+            return _requests().head(url, **kwargs)
+    
     @property
     def type(self):
-        response = requests.head(self._url.geturl(), allow_redirects=False)
+        response = self._head(self._url.geturl(), allow_redirects=False)
         if response.status_code in SUCCESS_CODES:
             return FILE
         elif response.status_code in REDIRECT_CODES:
@@ -158,7 +175,7 @@ class URL(BaseFile):
     
     @property
     def link_target(self):
-        response = requests.head(self._url.geturl(), allow_redirects=False)
+        response = self._head(self._url.geturl(), allow_redirects=False)
         if response.status_code in REDIRECT_CODES:
             return response.headers["Location"]
         else:
@@ -169,7 +186,7 @@ class URL(BaseFile):
         # TODO: We can save an extra request by just making the request
         # against our original URL and handling 30* redirects manually
         # (perhaps recursively call URL(response.headers["location"]).size)
-        response = requests.head(self.dereference(recursive=True)._url.geturl())
+        response = self._head(self.dereference(recursive=True)._url.geturl())
         if response.status_code in SUCCESS_CODES:
             try:
                 return int(response.headers["content-length"])
@@ -182,6 +199,13 @@ class URL(BaseFile):
         else:
             return 0
 
+    @property
+    def validator(self):
+        response = self._head(self.dereference(recursive=True)._url.geturl())
+        if response.status_code not in SUCCESS_CODES:
+            return None
+        return _validator(response.headers)
+
     def dereference(self, recursive=False):
         link_target = self.link_target
         if link_target is None: # We're not a redirect
@@ -193,11 +217,22 @@ class URL(BaseFile):
             return target
         
     def open_for_reading(self):
+        filesystem = self.filesystem
+        cache = filesystem.block_cache
+        if cache is not None and _requests():
+            stream = self._open_cached(cache)
+            if stream is not None:
+                return wrap_stream(filesystem.metrics, stream)
         # TODO: See how the returned object handles stream termination
         # before the number of bytes specified by the content-length header
         # have been read, and wrap it with a stream that performs such
         # checks if it doesn't already
-        stream = urllib2.urlopen(self._url.geturl())
+        try:
+            from urllib2 import urlopen
+        except ImportError:
+            from urllib.request import urlopen
+        with measure(filesystem.metrics, "open"):
+            stream = urlopen(self._url.geturl())
         # urllib.addinfourl objects don't provide __enter__ and __exit__;
         # patch the returned object to have them
         if not hasattr(stream, "__enter__"):
@@ -207,7 +242,40 @@ class URL(BaseFile):
                 stream.close()
             stream.__enter__ = __enter__
             stream.__exit__ = __exit__
-        return stream
+        return wrap_stream(filesystem.metrics, stream)
+    
+    def _open_cached(self, cache):
+        # Returns None if the server doesn't give us what we need to cache
+        # the URL's contents
+        url = self.dereference(recursive=True)._url.geturl()
+        response = self._head(url)
+        if response.status_code not in SUCCESS_CODES:
+            return None
+        validator = _validator(response.headers)
+        size = response.headers.get("content-length")
+        if validator is None or size is None:
+            return None
+        metrics = self.filesystem.metrics
+        requests = _requests()
+        # The whole of the file, once the server has ignored a Range header
+        # and sent us all of it
+        everything = []
+        def fetch(offset, length):
+            if everything:
+                return everything[0][offset:offset + length]
+            with measure(metrics, "open"):
+                response = requests.get(url, headers={
+                    "Range": "bytes={0}-{1}".format(offset,
+                                                    offset + length - 1)})
+            response.raise_for_status()
+            if response.status_code == requests.codes.partial_content:
+                return response.content
+            # The server ignored our Range header and sent everything, so
+            # serve the rest of the blocks from that rather than fetching
+            # the whole file again for each of them
+            everything.append(response.content)
+            return everything[0][offset:offset + length]
+        return cache.open(url, validator, int(size), fetch)
     
     def child(self, *names):
         if not names:
@@ -261,3 +329,52 @@ class URL(BaseFile):
     def same_as(self, other):
         return (BaseFile.same_as(self, other) and
                 self._url._replace(path="") == other._url._replace(path=""))
+
+
+def _validator(headers):
+    # Prefer the ETag, which is meant for exactly this, but fall back to
+    # Last-Modified (along with the size, to catch changes made within a
+    # second of each other) for servers that don't send one
+    etag = headers.get("etag")
+    if etag:
+        return "etag:" + etag
+    last_modified = headers.get("last-modified")
+    if last_modified:
+        return "last-modified:{0}:{1}".format(
+            last_modified, headers.get("content-length"))
+    return None
+
+
+def _open_file(url):
+    # Return a fileutils.local.File wrapping the underlying path. The
+    # requests module doesn't like file:/// URLs, and this fixes the problem
+    # quite nicely while also offering additional conveniences (like the
+    # ability to "write" to file:/// URLs).
+    if url[4:7] != "://":
+        return None
+    from fileutils.local import File
+    # Don't even bother trying to reconstruct the real path from the parsed
+    # url; just send in everything after file://, but prefix it with a slash
+    # just in case it's missing one.
+    return File('/' + url[7:])
+
+
+def _open_ssh(url):
+    # Return a fileutils.ssh.SSHFile connected to the URL in question.
+    # SSHFiles learned the ability to close themselves when nothing else
+    # references them a few minutes ago, so there's no need for the user to
+    # know that the returned object is an SSHFile.
+    from fileutils.ssh import SSHFile
+    _, netloc, path, _, _, _ = sane_urlparse(url)
+    user_part, _, host_part = netloc.rpartition("@")
+    username, _, password = user_part.partition(":")
+    host, _, port = host_part.partition(":")
+    return SSHFile.connect(host=host,
+                           username=username or None,
+                           password=password or None,
+                           port=int(port or 22)).child(path or "/")
+
+
+register_scheme("file", _open_file)
+register_scheme("ssh", _open_ssh)
+register_scheme("sftp", _open_ssh)
@@ -0,0 +1,384 @@
+"""
+Filesystems that pass every operation through to another tree.
+
+A :obj:`WrapperFileSystem` exposes a folder on any backend as a tree of its
+own, forwarding each operation on its files to the corresponding file in the
+wrapped folder. On its own that's of little use, but every operation goes
+through :obj:`WrapperFileSystem._call` on its way, which subclasses override
+to observe or alter what happens: :obj:`TracingFileSystem
+<fileutils.trace.TracingFileSystem>` records each operation, for example.
+
+Only the primitive operations (type, stat, child_names, open_for_reading and
+so on) are forwarded to the wrapped files. Higher-level operations such as
+copy_to, hash and recurse are carried out by BaseFile's own implementations
+on top of the wrapper's primitives, and go through _call too, so subclasses
+see both the call that was made and each of the primitives it was made up
+of. Deleting a folder likewise deletes its contents a child at a time.
+"""
+
+from fileutils.interface import BaseFile, FileSystem
+from fileutils.mixins import ChildrenMixin
+from fileutils.constants import FOLDER
+import itertools
+import hashlib
+import posixpath
+
+__all__ = ["WrapperFileSystem", "WrapperFile"]
+
+try:
+    basestring
+except NameError: # Python 3
+    basestring = str
+
+
+class WrapperFileSystem(FileSystem):
+    """
+    A FileSystem whose files pass every operation through to the
+    corresponding file beneath wrapped, which can be a folder on any backend.
+
+    Subclasses override :obj:`_call`, and :obj:`_iterate` for operations
+    that produce generators, to do something with each operation on the way
+    through.
+    """
+    def __init__(self, wrapped):
+        self._wrapped = wrapped
+        self._stream_ids = itertools.count(1)
+
+    @property
+    def wrapped(self):
+        """
+        The folder that this filesystem wraps, as a BaseFile.
+        """
+        return self._wrapped
+
+    def child(self, *path_components):
+        return WrapperFile(self, posixpath.join("/", *path_components))
+
+    @property
+    def roots(self):
+        return [WrapperFile(self, "/")]
+
+    def sync(self, files):
+        files = list(files)
+        if files:
+            files[0].wrapped.filesystem.sync([f.wrapped for f in files])
+
+    def _call(self, f, operation, details, function, *args):
+        """
+        Carry out an operation on one of this filesystem's files by calling
+        function(*args), and return what it returns.
+
+        f is the WrapperFile the operation was invoked on. operation is the
+        name of the BaseFile method or property invoked (such as "type" or
+        "copy_to"), "rename_over" for the replacing renames atomic writes
+        finish with, or "stream.read", "stream.readline", "stream.write" or
+        "stream.close" for operations on streams returned from
+        open_for_reading and open_for_writing.
+
+        details is a dictionary describing the operation's arguments,
+        containing only strings, numbers, booleans and None: other files are
+        described as {"path": path} if they're on this filesystem and
+        {"external": path} otherwise, data written by its size in bytes, and
+        streams by the number they were given when they were opened (as
+        "stream").
+
+        Operations may be nested: copy_to calls type, open_for_reading and
+        so on, each of which goes through here too. The default
+        implementation just calls function.
+        """
+        return function(*args)
+
+    def _iterate(self, f, operation, details, function, *args):
+        """
+        Same as _call, but for operations (recurse and read_blocks) whose
+        function returns a generator, which _iterate should return (or wrap
+        and return) without consuming. The default implementation calls
+        _call.
+        """
+        return self._call(f, operation, details, function, *args)
+
+    def __repr__(self):
+        return "<fileutils.WrapperFileSystem of {0!r}>".format(self._wrapped)
+
+    __str__ = __repr__
+
+
+class WrapperFile(ChildrenMixin, BaseFile):
+    """
+    A BaseFile implementation exposing a file on a
+    :obj:`WrapperFileSystem`.
+
+    The attribute sets in attributes are those of the wrapped file, so
+    changes made through them don't go through the wrapper.
+    """
+    _sep = "/"
+
+    def __init__(self, filesystem, path="/"):
+        self._filesystem = filesystem
+        self._path = posixpath.normpath(path)
+        while self._path.startswith("//"):
+            self._path = self._path[1:]
+
+    @property
+    def filesystem(self):
+        return self._filesystem
+
+    def _with_path(self, new_path):
+        return WrapperFile(self._filesystem, new_path)
+
+    @property
+    def wrapped(self):
+        """
+        The file beneath the wrapped folder that this file corresponds to.
+        """
+        names = [name for name in self._path.split("/") if name]
+        if not names:
+            return self._filesystem._wrapped
+        return self._filesystem._wrapped.child(*names)
+
+    def _call(self, operation, details, function, *args):
+        return self._filesystem._call(self, operation, details, function,
+                                      *args)
+
+    def _describe(self, other):
+        # Describe another file in a way that _call's details can hold: as
+        # {"path": path} for files on our filesystem, and as
+        # {"external": path} for everything else
+        if (isinstance(other, WrapperFile) and
+                other._filesystem is self._filesystem):
+            return {"path": other._path}
+        return {"external": "/".join(name for name in
+                                     other.path_components if name)}
+
+    def _unwrap(self, other):
+        # other's wrapped file, if it's on our filesystem, or None
+        if (isinstance(other, WrapperFile) and
+                other._filesystem is self._filesystem):
+            return other.wrapped
+        return None
+
+    def get_path_components(self, relative_to=None):
+        if relative_to:
+            if not isinstance(relative_to, WrapperFile):
+                raise ValueError("relative_to must be another WrapperFile "
+                                 "instance")
+            return posixpath.relpath(self._path, relative_to._path).split("/")
+        return self._path.split("/")
+
+    @property
+    def parent(self):
+        parent = posixpath.dirname(self._path)
+        if parent == self._path:
+            return None
+        return self._with_path(parent)
+
+    def child(self, *names):
+        return self._with_path(posixpath.join(self._path, *names))
+
+    @property
+    def type(self):
+        return self._call("type", {}, lambda: self.wrapped.type)
+
+    @property
+    def stat(self):
+        return self._call("stat", {}, lambda: self.wrapped.stat)
+
+    @property
+    def link_target(self):
+        return self._call("link_target", {}, lambda: self.wrapped.link_target)
+
+    @property
+    def size(self):
+        return self._call("size", {}, lambda: self.wrapped.size)
+
+    @property
+    def child_names(self):
+        return self._call("child_names", {},
+                          lambda: self.wrapped.child_names)
+
+    @property
+    def attributes(self):
+        return self.wrapped.attributes
+
+    def open_for_reading(self):
+        stream_id = next(self._filesystem._stream_ids)
+        stream = self._call("open_for_reading", {"stream": stream_id},
+                            lambda: self.wrapped.open_for_reading())
+        return _WrapperStream(self, stream, stream_id)
+
+    def open_for_writing(self, append=False, exclusive=False):
+        stream_id = next(self._filesystem._stream_ids)
+        stream = self._call("open_for_writing",
+                            {"stream": stream_id, "append": append,
+                             "exclusive": exclusive},
+                            lambda: self.wrapped.open_for_writing(append,
+                                                                  exclusive))
+        return _WrapperStream(self, stream, stream_id)
+
+    def create_folder(self, ignore_existing=False, recursive=False):
+        self._call("create_folder", {"ignore_existing": ignore_existing,
+                                     "recursive": recursive},
+                   lambda: self.wrapped.create_folder(ignore_existing,
+                                                      recursive))
+
+    def delete(self, ignore_missing=False):
+        self._call("delete", {"ignore_missing": ignore_missing},
+                   self._delete, ignore_missing)
+
+    def _delete(self, ignore_missing):
+        # Folders are emptied a child at a time through our own primitives,
+        # the way most backends have to go about it, so that subclasses see
+        # each of the operations that entails
+        if self.type is FOLDER:
+            for child in self.children:
+                child.delete()
+        self.wrapped.delete(ignore_missing=ignore_missing)
+
+    def link_to(self, target):
+        wrapped_target = self._unwrap(target)
+        if wrapped_target is not None:
+            details = {"target": self._describe(target)}
+        elif isinstance(target, basestring):
+            details = {"target": target}
+        else:
+            raise ValueError("Can't make a symlink from {0!r} to {1!r}"
+                             .format(self, target))
+        if wrapped_target is not None:
+            target = wrapped_target
+        self._call("link_to", details, lambda: self.wrapped.link_to(target))
+
+    def rename_to(self, other):
+        wrapped_other = self._unwrap(other)
+        if wrapped_other is None:
+            function = lambda: BaseFile.rename_to(self, other)
+        else:
+            function = lambda: self.wrapped.rename_to(wrapped_other)
+        self._call("rename_to", {"other": self._describe(other)}, function)
+
+    def _rename_over(self, other):
+        wrapped_other = self._unwrap(other)
+        if wrapped_other is None:
+            function = lambda: BaseFile._rename_over(self, other)
+        else:
+            function = lambda: self.wrapped._rename_over(wrapped_other)
+        self._call("rename_over", {"other": self._describe(other)}, function)
+
+    def _sync_stream(self, stream):
+        self.wrapped._sync_stream(stream._stream)
+
+    def _sync(self):
+        self.wrapped._sync()
+
+    # The rest are carried out by BaseFile on top of the above
+
+    def copy_to(self, other, overwrite=False, dereference_links=True,
+                which_attributes={}, progress=None, limiter=None):
+        self._call("copy_to", {"other": self._describe(other),
+                               "overwrite": overwrite,
+                               "dereference_links": dereference_links},
+                   BaseFile.copy_to, self, other, overwrite,
+                   dereference_links, which_attributes, progress, limiter)
+
+    def copy_into(self, other, overwrite=False, dereference_links=True,
+                  which_attributes={}, progress=None, limiter=None):
+        self._call("copy_into", {"other": self._describe(other),
+                                 "overwrite": overwrite,
+                                 "dereference_links": dereference_links},
+                   BaseFile.copy_into, self, other, overwrite,
+                   dereference_links, which_attributes, progress, limiter)
+
+    def merge_to(self, other, dereference_links=True, which_attributes={},
+                 progress=None, limiter=None):
+        self._call("merge_to", {"other": self._describe(other),
+                                "dereference_links": dereference_links},
+                   BaseFile.merge_to, self, other, dereference_links,
+                   which_attributes, progress, limiter)
+
+    def hash(self, algorithm=hashlib.md5, return_hex=True, progress=None,
+             limiter=None):
+        return self._call("hash", {}, BaseFile.hash, self, algorithm,
+                          return_hex, progress, limiter)
+
+    def read(self):
+        return self._call("read", {}, BaseFile.read, self)
+
+    def write(self, data, binary=True, atomic=False):
+        self._call("write", {"size": len(data), "atomic": bool(atomic)},
+                   BaseFile.write, self, data, binary, atomic)
+
+    def append(self, data):
+        self._call("append", {"size": len(data)}, BaseFile.append, self, data)
+
+    def recurse(self, filter=None, include_self=True, recurse_skipped=True):
+        return self._filesystem._iterate(
+            self, "recurse", {"filter": filter is not None,
+                              "include_self": include_self,
+                              "recurse_skipped": recurse_skipped},
+            BaseFile.recurse, self, filter, include_self, recurse_skipped)
+
+    def read_blocks(self, block_size=None, limiter=None):
+        return self._filesystem._iterate(
+            self, "read_blocks", {"block_size": block_size},
+            BaseFile.read_blocks, self, block_size, limiter)
+
+    def __cmp__(self, other):
+        if not isinstance(other, WrapperFile):
+            return NotImplemented
+        return (cmp(id(self._filesystem), id(other._filesystem)) or
+                cmp(self._path, other._path))
+
+    def __hash__(self):
+        return hash((id(self._filesystem), self._path))
+
+    def __str__(self):
+        return "<fileutils.WrapperFile {0!r} on {1!r}>".format(
+            self._path, self._filesystem)
+
+    __repr__ = __str__
+
+
+class _WrapperStream(object):
+    # A stream returned from WrapperFile.open_for_reading or
+    # open_for_writing, which passes reads, writes and closing through the
+    # file's filesystem's _call
+    def __init__(self, f, stream, stream_id):
+        self._file = f
+        self._stream = stream
+        self._id = stream_id
+        self._closed = False
+
+    def read(self, size=-1):
+        return self._file._call("stream.read",
+                                {"stream": self._id, "size": size},
+                                self._stream.read, size)
+
+    def readline(self, size=-1):
+        return self._file._call("stream.readline",
+                                {"stream": self._id, "size": size},
+                                self._stream.readline, size)
+
+    def write(self, data):
+        return self._file._call("stream.write",
+                                {"stream": self._id, "size": len(data)},
+                                self._stream.write, data)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._file._call("stream.close", {"stream": self._id},
+                         self._stream.close)
+
+    def __iter__(self):
+        return iter(self.readline, self._stream.read(0))
+
+    def __getattr__(self, name):
+        # Everything else (seek, tell, flush, fileno and the like) goes
+        # straight through to the stream
+        return getattr(self._stream, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
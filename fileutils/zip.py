@@ -1,8 +1,794 @@
+"""
+Zip archive support.
 
-from fileutils.interface import BaseFile
-from fileutils.constants import FILE, FOLDER
+:obj:`ZipFile` exposes the contents of an existing archive as read-only
+BaseFile instances::
 
-class ZipFile(BaseFile):
-    pass
+    archive = ZipFile(SSHFile.connect(...).child("releases", "big.zip"))
+    print(archive.child("docs", "README").read())
 
+:obj:`ZipWriter` writes zip archives to any writable stream, including
+non-seekable ones like the streams returned by SSHFile.open_for_writing, and
+compresses members in parallel worker threads. Most code will want to use it
+through :obj:`BaseFile.zip_into <fileutils.interface.BaseFile.zip_into>`
+instead of directly.
+"""
 
+from fileutils.interface import BaseFile, FileSystem, FileStat
+from fileutils.mixins import ChildrenMixin
+from fileutils.constants import FILE, FOLDER, LINK, YIELD
+from fileutils.exceptions import generate
+from fileutils import exceptions
+from fileutils.parallel import ordered_map
+from contextlib import closing
+import zipfile as zip_module
+import threading
+import posixpath
+import datetime
+import struct
+import time
+import stat
+import zlib
+
+try:
+    import bz2
+except ImportError:
+    bz2 = None
+
+__all__ = ["ZipFileSystem", "ZipFile", "ZipWriter", "extract", "ZIP_STORED",
+           "ZIP_DEFLATED", "ZIP_BZIP2", "ZIP_LZMA"]
+
+ZIP_STORED = zip_module.ZIP_STORED
+ZIP_DEFLATED = zip_module.ZIP_DEFLATED
+ZIP_BZIP2 = 12
+ZIP_LZMA = 14
+
+_ZIP64_LIMIT = (1 << 31) - 1
+_UINT32_MAX = 0xFFFFFFFF
+_UINT16_MAX = 0xFFFF
+
+_VERSION_NEEDED = {ZIP_STORED: 20, ZIP_DEFLATED: 20, ZIP_BZIP2: 46,
+                   ZIP_LZMA: 63}
+_ZIP64_VERSION = 45
+# Made by Unix, spec version 2.0, so that external attributes carry modes
+_VERSION_MADE_BY = (3 << 8) | 20
+
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+_FLAG_LZMA_EOS = 0x02
+
+# Deflate's window size. Each chunk after the first is primed with this much
+# of the data preceding it so that splitting files into chunks for parallel
+# compression costs next to nothing in terms of compression ratio.
+_DICTIONARY_SIZE = 32768
+
+
+class _Entry(object):
+    # Bookkeeping for one member of the archive being written
+    def __init__(self, name, flags, compression, mtime, mode, zip64):
+        self.name = name
+        self.flags = flags
+        self.compression = compression
+        self.mtime = mtime
+        self.mode = mode
+        self.zip64 = zip64
+        self.offset = None
+        self.crc = 0
+        self.compressed_size = 0
+        self.size = 0
+
+
+class ZipWriter(object):
+    """
+    An object that writes a zip archive to a stream.
+
+    The archive is written strictly sequentially, with each member's CRC and
+    sizes stored in a data descriptor following its data, so the stream need
+    not be seekable (or even support tell()). Member data is split into chunks
+    that are compressed concurrently by a pool of worker threads and written
+    out in order, so creating an archive isn't limited to the speed of a
+    single core.
+
+    compression is one of ZIP_STORED, ZIP_DEFLATED (the default), ZIP_BZIP2,
+    or ZIP_LZMA (Python 3 only), and level is the compression level to use.
+    workers is the number of worker threads to use, and defaults to the number
+    of CPUs on this machine. Deflated and stored members are read and
+    compressed in chunks of chunk_size bytes; bzip2 and LZMA members can't be
+    split like that, so each one is read into memory and compressed by a
+    single worker.
+
+    Members are added with :obj:`add` and :obj:`add_tree`, and the archive is
+    finished with :obj:`close` (or by using the writer as a context manager).
+    Closing the writer doesn't close the underlying stream.
+    """
+    def __init__(self, stream, compression=ZIP_DEFLATED, level=6,
+                 workers=None, chunk_size=2**18):
+        if compression not in _VERSION_NEEDED:
+            raise ValueError("Unsupported compression method {0!r}"
+                             .format(compression))
+        if compression == ZIP_BZIP2 and bz2 is None:
+            raise ValueError("bzip2 compression isn't available")
+        if (compression == ZIP_LZMA and
+                getattr(zip_module, "LZMACompressor", None) is None):
+            raise ValueError("LZMA compression isn't available")
+        self._stream = stream
+        self._compression = compression
+        self._level = level
+        self._workers = workers
+        self._chunk_size = chunk_size
+        self._offset = 0
+        self._entries = []
+        self._closed = False
+
+    def add(self, f, name, dereference_links=True):
+        """
+        Add the specified BaseFile to the archive under the specified name,
+        which should use "/" as its separator. Folders are added as empty
+        directory entries; use add_tree to add their contents as well.
+
+        If dereference_links is False, symbolic links are stored as links
+        instead of as the file they point to.
+        """
+        self._write_all(self._jobs([(f, name)], dereference_links))
+
+    def add_tree(self, folder, prefix="", dereference_links=True):
+        """
+        Add the specified BaseFile and everything beneath it to the archive.
+        Names in the archive are made up of prefix followed by each file's
+        path relative to folder; if prefix is empty, folder itself isn't given
+        an entry of its own.
+        """
+        def members():
+            for f in folder.recurse(None if dereference_links else
+                                    _skip_links):
+                names = f.get_path_components(relative_to=folder)
+                names = [n for n in names if n not in ("", ".")]
+                name = "/".join(([prefix.strip("/")] if prefix else []) +
+                                names)
+                if name:
+                    yield f, name
+        self._write_all(self._jobs(members(), dereference_links))
+
+    def close(self):
+        """
+        Write out the archive's central directory. No more members can be
+        added after this is called.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        start = self._offset
+        for entry in self._entries:
+            self._write_central_entry(entry)
+        self._write_end_records(start, self._offset - start)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, *args):
+        if exception_type is None:
+            self.close()
+
+    def _jobs(self, members, dereference_links):
+        # Generator of units of work for _process. Reading happens here, in
+        # the calling thread; compressing happens in the workers.
+        for f, name in members:
+            source = f.dereference(True) if dereference_links else f
+            s = source.stat
+            if s is None:
+                continue
+            file_type = s.type
+            if file_type is FOLDER:
+                name = name.rstrip("/") + "/"
+                entry = self._entry(name, ZIP_STORED, s, 0, stat.S_IFDIR | 0o755)
+                yield entry, None, True, None
+            elif file_type is FILE or file_type is LINK:
+                entry = self._entry(name, self._compression, s, s.size or 0,
+                                    stat.S_IFREG | 0o644)
+                if file_type is LINK:
+                    target = source.link_target
+                    if not isinstance(target, bytes):
+                        target = target.encode("utf-8")
+                    chunks = [target]
+                elif self._compression in (ZIP_BZIP2, ZIP_LZMA):
+                    chunks = [source.read()]
+                else:
+                    chunks = source.read_blocks(self._chunk_size)
+                previous = None
+                for chunk in chunks:
+                    if previous is not None:
+                        yield entry, previous[0], False, previous[1]
+                        previous = (chunk, previous[0][-_DICTIONARY_SIZE:])
+                    else:
+                        previous = (chunk, None)
+                if previous is None:
+                    yield entry, b"", True, None
+                else:
+                    yield entry, previous[0], True, previous[1]
+
+    def _entry(self, name, compression, s, size, default_mode):
+        if not isinstance(name, bytes):
+            try:
+                name = name.encode("ascii")
+                flags = 0
+            except UnicodeError:
+                name = name.encode("utf-8")
+                flags = _FLAG_UTF8
+        else:
+            flags = 0
+            try:
+                name.decode("ascii")
+            except UnicodeError:
+                flags = _FLAG_UTF8
+        if compression == ZIP_LZMA:
+            flags |= _FLAG_LZMA_EOS
+        mode = s.mode if s.mode else default_mode
+        if s.type is LINK:
+            mode = s.mode if s.mode else stat.S_IFLNK | 0o777
+        mtime = s.mtime_ns / 1e9 if s.mtime_ns else time.time()
+        # Same heuristic as the zipfile module: leave some room for data
+        # that doesn't compress
+        zip64 = size * 1.05 > _ZIP64_LIMIT
+        return _Entry(name, flags, compression, mtime, mode, zip64)
+
+    def _process(self, job):
+        entry, data, last, dictionary = job
+        if data is None:
+            return job, None
+        compression = entry.compression
+        if compression == ZIP_STORED:
+            compressed = data
+        elif compression == ZIP_DEFLATED:
+            if dictionary and _zdict_supported:
+                compressor = zlib.compressobj(self._level, zlib.DEFLATED,
+                                              -15, 8, zlib.Z_DEFAULT_STRATEGY,
+                                              dictionary)
+            else:
+                compressor = zlib.compressobj(self._level, zlib.DEFLATED,
+                                              -15)
+            compressed = compressor.compress(data) + compressor.flush(
+                zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+        elif compression == ZIP_BZIP2:
+            compressor = bz2.BZ2Compressor(max(1, min(self._level, 9)))
+            compressed = compressor.compress(data) + compressor.flush()
+        else:
+            compressor = zip_module.LZMACompressor()
+            compressed = compressor.compress(data) + compressor.flush()
+        return job, compressed
+
+    def _write_all(self, jobs):
+        if self._closed:
+            raise ValueError("ZipWriter has already been closed")
+        for (entry, data, last, _), compressed in ordered_map(
+                self._process, jobs, self._workers):
+            if entry.offset is None:
+                entry.offset = self._offset
+                self._write_local_header(entry, data is None)
+            if data is not None:
+                entry.crc = zlib.crc32(data, entry.crc) & 0xFFFFFFFF
+                entry.size += len(data)
+                entry.compressed_size += len(compressed)
+                self._write(compressed)
+            if last:
+                if data is not None:
+                    self._write_data_descriptor(entry)
+                self._entries.append(entry)
+
+    def _write(self, data):
+        self._stream.write(data)
+        self._offset += len(data)
+
+    def _write_local_header(self, entry, is_directory):
+        extra = b""
+        flags = entry.flags
+        version = _VERSION_NEEDED[entry.compression]
+        if is_directory:
+            sizes = (0, 0, 0)
+        else:
+            flags |= _FLAG_DATA_DESCRIPTOR
+            if entry.zip64:
+                # Sizes go in the data descriptor, but their being 8 bytes
+                # wide there is signalled by a zip64 extra field here
+                extra = struct.pack("<HHQQ", 1, 16, 0, 0)
+                sizes = (0, _UINT32_MAX, _UINT32_MAX)
+                version = max(version, _ZIP64_VERSION)
+            else:
+                sizes = (0, 0, 0)
+        dos_time, dos_date = _dos_time(entry.mtime)
+        self._write(struct.pack("<IHHHHHIIIHH", 0x04034b50, version, flags,
+                                entry.compression, dos_time, dos_date,
+                                sizes[0], sizes[1], sizes[2],
+                                len(entry.name), len(extra)))
+        self._write(entry.name)
+        self._write(extra)
+
+    def _write_data_descriptor(self, entry):
+        if entry.zip64:
+            self._write(struct.pack("<IIQQ", 0x08074b50, entry.crc,
+                                    entry.compressed_size, entry.size))
+        else:
+            if (entry.size > _UINT32_MAX or
+                    entry.compressed_size > _UINT32_MAX):
+                raise ValueError("{0!r} grew past 4 GB while it was being "
+                                 "archived".format(entry.name))
+            self._write(struct.pack("<IIII", 0x08074b50, entry.crc,
+                                    entry.compressed_size, entry.size))
+
+    def _write_central_entry(self, entry):
+        zip64_fields = []
+        size, compressed_size, offset = (entry.size, entry.compressed_size,
+                                         entry.offset)
+        if entry.zip64 or size > _UINT32_MAX:
+            zip64_fields.append(size)
+            size = _UINT32_MAX
+        if entry.zip64 or compressed_size > _UINT32_MAX:
+            zip64_fields.append(compressed_size)
+            compressed_size = _UINT32_MAX
+        if offset > _UINT32_MAX:
+            zip64_fields.append(offset)
+            offset = _UINT32_MAX
+        extra = b""
+        version = _VERSION_NEEDED[entry.compression]
+        if zip64_fields:
+            extra = struct.pack("<HH" + "Q" * len(zip64_fields), 1,
+                                8 * len(zip64_fields), *zip64_fields)
+            version = max(version, _ZIP64_VERSION)
+        flags = entry.flags
+        if not entry.name.endswith(b"/"):
+            flags |= _FLAG_DATA_DESCRIPTOR
+        external = (entry.mode & 0xFFFF) << 16
+        if entry.name.endswith(b"/"):
+            external |= 0x10 # MS-DOS directory flag
+        dos_time, dos_date = _dos_time(entry.mtime)
+        self._write(struct.pack("<IHHHHHHIIIHHHHHII", 0x02014b50,
+                                _VERSION_MADE_BY, version, flags,
+                                entry.compression, dos_time, dos_date,
+                                entry.crc, compressed_size, size,
+                                len(entry.name), len(extra), 0, 0, 0,
+                                external, offset))
+        self._write(entry.name)
+        self._write(extra)
+
+    def _write_end_records(self, start, length):
+        count = len(self._entries)
+        if (count > _UINT16_MAX or start > _UINT32_MAX or
+                length > _UINT32_MAX):
+            zip64_end = self._offset
+            self._write(struct.pack("<IQHHIIQQQQ", 0x06064b50, 44,
+                                    _VERSION_MADE_BY, _ZIP64_VERSION, 0, 0,
+                                    count, count, length, start))
+            self._write(struct.pack("<IIQI", 0x07064b50, 0, zip64_end, 1))
+            count = min(count, _UINT16_MAX)
+            start = min(start, _UINT32_MAX)
+            length = min(length, _UINT32_MAX)
+        self._write(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, count, count,
+                                length, start, 0))
+
+
+def _skip_links(f):
+    # recurse filter that records links without following them
+    return YIELD if f.is_link else True
+
+
+def _dos_time(timestamp):
+    t = time.localtime(timestamp)
+    if t.tm_year < 1980:
+        return 0, (0 << 9) | (1 << 5) | 1
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+def _zdict_test():
+    try:
+        zlib.compressobj(6, zlib.DEFLATED, -15, 8, zlib.Z_DEFAULT_STRATEGY,
+                         b"x")
+        return True
+    except TypeError:
+        return False
+
+# zlib only learned to take a preset dictionary in Python 3.3. Without one,
+# chunks are compressed independently of each other, which costs a little in
+# compression ratio.
+_zdict_supported = _zdict_test()
+
+
+def extract(archive, folder, workers=None):
+    """
+    Extract the zip archive stored in the specified BaseFile into the
+    specified folder (also a BaseFile), creating the folder if it doesn't
+    already exist. The archive can live on any backend whose read streams can
+    seek, and the folder can be on any backend at all; members are streamed
+    straight from one to the other without being staged locally.
+
+    Every member's name is checked with folder.safe_child before anything is
+    written, and ValueError is raised if any of them would escape the folder
+    (by way of an absolute path or "..", for example). Symbolic links stored
+    in the archive are extracted as regular files containing the link's
+    target, as zipfile.ZipFile.extractall does.
+
+    Folders are created up front, then files are decompressed and written by
+    a pool of worker threads, workers of them (one per CPU by default), each
+    of which reads the archive through its own stream.
+    """
+    with closing(archive.open_for_reading()) as stream:
+        with closing(zip_module.ZipFile(stream)) as z:
+            infos = z.infolist()
+    
+    # Validate every name before we touch the target
+    folders = set()
+    files = []
+    for info in infos:
+        name = info.filename.rstrip("/")
+        if not name:
+            continue
+        target = folder.safe_child(name)
+        relative = target.get_path_components(relative_to=folder)
+        for end in range(1, len(relative)):
+            folders.add(tuple(relative[:end]))
+        if info.filename.endswith("/"):
+            folders.add(tuple(relative))
+        else:
+            files.append((info, target))
+    
+    folder.create_folder(ignore_existing=True, recursive=True)
+    # Sorting puts parents before their children
+    for names in sorted(folders):
+        folder.child(*names).create_folder(ignore_existing=True)
+    
+    local = threading.local()
+    opened = []
+    lock = threading.Lock()
+    def extract_one(job):
+        info, target = job
+        z = getattr(local, "zip", None)
+        if z is None:
+            stream = archive.open_for_reading()
+            z = local.zip = zip_module.ZipFile(stream)
+            with lock:
+                opened.append((z, stream))
+        with closing(z.open(info)) as source:
+            with target.open_for_writing() as destination:
+                data = source.read(target._default_block_size)
+                while data:
+                    destination.write(data)
+                    data = source.read(target._default_block_size)
+    try:
+        for _ in ordered_map(extract_one, files, workers):
+            pass
+    finally:
+        for z, stream in opened:
+            z.close()
+            stream.close()
+    return folder
+
+
+class ZipFileSystem(FileSystem):
+    """
+    A read-only FileSystem exposing the contents of a zip archive.
+    
+    The archive's central directory is read once, when the ZipFileSystem is
+    created, and turned into an in-memory index of paths; listing folders and
+    looking up types and sizes never touches the archive again. Member data is
+    only read when a member is opened, by seeking straight to it, so pulling a
+    single file out of a multi-gigabyte archive only reads that file's bytes
+    (plus the central directory). The archive can be stored on any backend
+    whose read streams can seek, such as File and SSHFile.
+    
+    A single stream is kept open on the archive and shared by all readers,
+    which take turns seeking it, so any number of members can be read at the
+    same time, from any number of threads. ZipFileSystem instances can be
+    used as context managers to close that stream when done.
+    
+    Instances are usually created implicitly by passing the archive to
+    :obj:`ZipFile`.
+    """
+    def __init__(self, archive):
+        self._archive = archive
+        self._stream = archive.open_for_reading()
+        self._lock = threading.Lock()
+        try:
+            with closing(zip_module.ZipFile(self._stream)) as z:
+                infos = z.infolist()
+        except:
+            self._stream.close()
+            raise
+        # Map of path (relative, "/"-separated, "" for the root) to ZipInfo
+        # for every member, and of folder path to a set of child names
+        self._members = {}
+        self._folders = {"": set()}
+        for info in infos:
+            name = posixpath.normpath(info.filename.lstrip("/"))
+            if name in (".", "") or name.startswith("../") or name == "..":
+                continue
+            components = name.split("/")
+            for end in range(len(components)):
+                parent = "/".join(components[:end])
+                self._folders.setdefault(parent, set()).add(components[end])
+            if info.filename.endswith("/"):
+                self._folders.setdefault(name, set())
+                self._members.pop(name, None)
+            else:
+                self._members[name] = info
+    
+    @property
+    def archive(self):
+        """
+        The BaseFile containing the archive.
+        """
+        return self._archive
+    
+    def child(self, *path_components):
+        return ZipFile(self, posixpath.join("/", *path_components))
+    
+    @property
+    def roots(self):
+        return [ZipFile(self, "/")]
+    
+    def close(self):
+        self._stream.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+    
+    def _open(self, info):
+        # Find where the member's data starts by reading its local header,
+        # whose extra field can differ from the one in the central directory
+        header = self._read_at(info.header_offset, zip_module.sizeFileHeader)
+        if len(header) != zip_module.sizeFileHeader:
+            raise zip_module.BadZipfile("Truncated local header for {0!r}"
+                                        .format(info.filename))
+        fields = struct.unpack(zip_module.structFileHeader, header)
+        if fields[0] != b"PK\003\004":
+            raise zip_module.BadZipfile("Bad local header for {0!r}"
+                                        .format(info.filename))
+        if info.flag_bits & 0x1:
+            raise NotImplementedError("{0!r} is encrypted".format(info.filename))
+        offset = (info.header_offset + zip_module.sizeFileHeader +
+                  fields[zip_module._FH_FILENAME_LENGTH] +
+                  fields[zip_module._FH_EXTRA_FIELD_LENGTH])
+        return _MemberStream(self, info, offset)
+    
+    def _read_at(self, offset, length):
+        with self._lock:
+            self._stream.seek(offset)
+            return self._stream.read(length)
+    
+    def __repr__(self):
+        return "<fileutils.ZipFileSystem on {0!r}>".format(self._archive)
+    
+    __str__ = __repr__
+
+
+class ZipFile(ChildrenMixin, BaseFile):
+    """
+    A read-only BaseFile implementation exposing a member of a zip archive.
+    
+    ZipFile(archive) returns the root folder of the specified archive, which
+    can be any BaseFile (or an existing :obj:`ZipFileSystem`); members are
+    obtained from it with child() as usual::
+    
+        archive = ZipFile(File("foo.zip"))
+        archive.child_names
+        archive.child("bar", "baz").copy_to(File("baz"))
+    
+    Members that were stored as symbolic links are exposed as links. See
+    :obj:`ZipFileSystem` for how the archive is read.
+    """
+    _sep = "/"
+    
+    def __init__(self, archive, path="/"):
+        if not isinstance(archive, ZipFileSystem):
+            archive = ZipFileSystem(archive)
+        self._filesystem = archive
+        self._path = posixpath.normpath(path)
+        while self._path.startswith("//"):
+            self._path = self._path[1:]
+    
+    @property
+    def filesystem(self):
+        return self._filesystem
+    
+    def _with_path(self, new_path):
+        return ZipFile(self._filesystem, new_path)
+    
+    @property
+    def _name(self):
+        # Our key in the filesystem's index
+        return self._path.lstrip("/")
+    
+    @property
+    def _info(self):
+        return self._filesystem._members.get(self._name)
+    
+    def get_path_components(self, relative_to=None):
+        if relative_to:
+            if not isinstance(relative_to, ZipFile):
+                raise ValueError("relative_to must be another ZipFile "
+                                 "instance")
+            return posixpath.relpath(self._path, relative_to._path).split("/")
+        return self._path.split("/")
+    
+    @property
+    def parent(self):
+        parent = posixpath.dirname(self._path)
+        if parent == self._path:
+            return None
+        return self._with_path(parent)
+    
+    def child(self, *names):
+        return self._with_path(posixpath.join(self._path, *names))
+    
+    @property
+    def type(self):
+        if self._name in self._filesystem._folders:
+            return FOLDER
+        info = self._info
+        if info is None:
+            return None
+        if stat.S_ISLNK(info.external_attr >> 16):
+            return LINK
+        return FILE
+    
+    @property
+    def stat(self):
+        file_type = self.type
+        if file_type is None:
+            return None
+        info = self._info
+        if info is None: # Implicit folder
+            return FileStat(file_type, 0)
+        mtime = datetime.datetime(*info.date_time)
+        mtime_ns = int(time.mktime(mtime.timetuple())) * 1000000000
+        return FileStat(file_type, info.file_size, mtime_ns, None, None,
+                        (info.external_attr >> 16) or None)
+    
+    @property
+    def child_names(self):
+        names = self._filesystem._folders.get(self._name)
+        if names is None:
+            return None
+        return sorted(names)
+    
+    @property
+    def link_target(self):
+        if not self.is_link:
+            return None
+        target = self.read()
+        if str is not bytes:
+            target = target.decode("utf-8")
+        return target
+    
+    @property
+    def size(self):
+        if self.is_folder:
+            return sum(f.size for f in self.children)
+        info = self.dereference(True)._info
+        if info is None:
+            return 0
+        return info.file_size
+    
+    def open_for_reading(self):
+        info = self._info
+        if info is None:
+            raise generate(exceptions.FileNotFoundError, self._path)
+        return self._filesystem._open(info)
+    
+    def __cmp__(self, other):
+        if not isinstance(other, ZipFile):
+            return NotImplemented
+        return (cmp(id(self._filesystem), id(other._filesystem)) or
+                cmp(self._path, other._path))
+    
+    def __hash__(self):
+        return hash((id(self._filesystem), self._path))
+    
+    def __str__(self):
+        return "<fileutils.ZipFile {0!r} in {1!r}>".format(
+            self._path, self._filesystem._archive)
+    
+    __repr__ = __str__
+
+
+class _MemberStream(object):
+    """
+    A read-only stream over the data of a single archive member. Compressed
+    data is fetched from the archive's shared stream in blocks, seeking to
+    the right place for each one, so several of these can be in use at once.
+    """
+    _block_size = 65536
+    
+    def __init__(self, filesystem, info, offset):
+        self._filesystem = filesystem
+        self._info = info
+        self._offset = offset
+        self._remaining = info.compress_size
+        self._buffer = b""
+        self._crc = 0
+        self._produced = 0
+        self._eof = False
+        compression = info.compress_type
+        if compression == ZIP_STORED:
+            self._decompressor = None
+        elif compression == ZIP_DEFLATED:
+            self._decompressor = zlib.decompressobj(-15)
+        elif compression == ZIP_BZIP2 and bz2 is not None:
+            self._decompressor = bz2.BZ2Decompressor()
+        elif (compression == ZIP_LZMA and
+                getattr(zip_module, "LZMADecompressor", None) is not None):
+            self._decompressor = zip_module.LZMADecompressor()
+        else:
+            raise NotImplementedError("Unsupported compression method {0!r} "
+                                      "for {1!r}".format(compression,
+                                                         info.filename))
+    
+    def _fill(self, size):
+        # Decompress until we've got at least size bytes buffered (or all
+        # of them, if size is negative) or we reach the end of the member
+        chunks = [self._buffer]
+        buffered = len(self._buffer)
+        while not self._eof and (size < 0 or buffered < size):
+            if self._produced >= self._info.file_size:
+                self._finish()
+                break
+            # zlib leaves input it couldn't inflate within max_length for us
+            data = getattr(self._decompressor, "unconsumed_tail", b"")
+            if not data and self._remaining > 0:
+                data = self._filesystem._read_at(
+                    self._offset, min(self._block_size, self._remaining))
+                self._offset += len(data)
+                self._remaining -= len(data)
+            deflated = self._info.compress_type == ZIP_DEFLATED
+            if not data and not deflated:
+                raise zip_module.BadZipfile("Truncated data for {0!r}"
+                                            .format(self._info.filename))
+            if self._decompressor is None:
+                output = data
+            elif deflated:
+                # Bound how much a single block can inflate to. Once all the
+                # input's been fed in, zlib can still be holding back output
+                # that the bound cut off, which decompressing nothing more
+                # gets out of it.
+                output = self._decompressor.decompress(data,
+                                                       4 * self._block_size)
+                if not data and not output:
+                    raise zip_module.BadZipfile("Truncated data for {0!r}"
+                                                .format(self._info.filename))
+            else:
+                output = self._decompressor.decompress(data)
+            self._crc = zlib.crc32(output, self._crc) & 0xFFFFFFFF
+            self._produced += len(output)
+            chunks.append(output)
+            buffered += len(output)
+        self._buffer = b"".join(chunks)
+    
+    def _finish(self):
+        self._eof = True
+        if self._crc != self._info.CRC:
+            raise zip_module.BadZipfile("Bad CRC-32 for {0!r}"
+                                        .format(self._info.filename))
+    
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        self._fill(size)
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+    
+    def readable(self):
+        return True
+    
+    def close(self):
+        self._eof = True
+        self._buffer = b""
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()